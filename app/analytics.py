@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from . import fastjson
+from .partitions import HISTORY_NAMES, rows_to_columns, run_plan
+
+logger = logging.getLogger("analytics")
+
+# --- 工作行程端 (需為模組層級函式才能傳給子行程) ---
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(nice: int):
+    # 降低分析工作的排程優先權，避免與 Gateway 輪詢搶 CPU
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def history_json(db_path: str, plan: list, limit: int) -> bytes:
+    """在子行程中依分區查詢計畫讀取並直接編碼為 JSON bytes (與 /api/history 回應格式相同)"""
+    rows = [dict(zip(HISTORY_NAMES, r)) for r in run_plan(db_path, plan, limit)]
+    return fastjson.dumps(rows)
+
+
+def history_columnar(db_path: str, plan: list, limit: int) -> bytes:
+    """同上，但輸出欄位式 {"timestamp": [...], "weight": [...], ...}"""
+    return fastjson.dumps(rows_to_columns(list(run_plan(db_path, plan, limit))))
+
+
+def simulate_recipe(db_path: str, fish_code: str, params: Dict[str, Any],
+                    start_time: Optional[str] = None, end_time: Optional[str] = None) -> Dict[str, Any]:
+    """What-if 模擬 (每個子行程保留自己的重量陣列快取)"""
+    sim = _worker_state.get('sim')
+    if sim is None:
+        from .historian import Historian
+        from .recipe_sim import RecipeSimulator
+        sim = _worker_state['sim'] = RecipeSimulator(Historian(db_path))
+    return sim.run(fish_code, params, start_time, end_time)
+
+
+# --- 主行程端 ---
+class AdmissionRejected(Exception):
+    """同一客戶端 (或全部) 進行中的重量級查詢已達上限"""
+
+
+class AnalyticsPool:
+    """
+    重量級分析查詢的行程池。
+    查詢結果在子行程中完成編碼，主行程只收到 bytes / 精簡結果，不與輪詢迴圈競爭 GIL。
+    每個客戶端同時進行的查詢數與總待處理數皆有上限 (超過時拒絕，由 API 回傳 429)。
+    workers = 0 時改在執行緒中執行。
+    """
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.workers = int(cfg.get('workers', 2))
+        self.row_threshold = int(cfg.get('row_threshold', 2000))
+        self.max_per_client = int(cfg.get('max_per_client', 2))
+        self.max_pending = int(cfg.get('max_pending', 8))
+        self.nice = int(cfg.get('nice', 10))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._active: Dict[str, int] = {}
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: 子行程不繼承主行程的執行緒與連線 (日誌 fsync 執行緒、SQLite 連線等)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.nice,)
+            )
+        return self._executor
+
+    async def run(self, client_id: str, fn: Callable, *args):
+        if self._active.get(client_id, 0) >= self.max_per_client or self._pending >= self.max_pending:
+            self.rejected += 1
+            raise AdmissionRejected(f"Too many concurrent analytic queries (limit {self.max_per_client} per client)")
+        self._active[client_id] = self._active.get(client_id, 0) + 1
+        self._pending += 1
+        try:
+            if self.workers <= 0:
+                return await asyncio.to_thread(fn, *args)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool:
+                logger.error("Analytics worker crashed, restarting pool")
+                self._executor = None
+                raise
+        finally:
+            self._pending -= 1
+            self._active[client_id] -= 1
+            if not self._active[client_id]:
+                del self._active[client_id]
+            self.completed += 1
+
+    async def history(self, client_id: str, historian, start_time=None, end_time=None, fish_code=None,
+                      limit: int = 1000, columnar: bool = False):
+        """
+        /api/history：預估筆數 (limit 與查詢範圍內的實際筆數取小者) 未達門檻時直接查詢；
+        否則在子行程中查詢並編碼，結果同樣放入 Historian 的查詢快取。
+        """
+        key = historian.normalize_history_query(start_time, end_time, fish_code, limit, columnar=columnar)
+        deps = ('history',)
+        cached = historian.cache.lookup(key, deps)
+        if cached is not None:
+            return cached
+        if key[4] < self.row_threshold:
+            return historian.get_history_result(*key[1:4], key[4], columnar=columnar)
+        # 預估本身也要讀取索引 (篩選條件選擇性高時可能掃過整個分區)，在執行緒中進行
+        estimate = await asyncio.to_thread(historian.estimate_history_rows, *key[1:4], cap=self.row_threshold)
+        if estimate < self.row_threshold:
+            return historian.get_history_result(*key[1:4], key[4], columnar=columnar)
+        # 水位與是否可永久快取都在查詢之前決定 (查詢期間套用的遲到事件不會被永久快取遮蔽)
+        marks = historian.cache.marks(deps)
+        immutable = historian.is_past(key[2])
+        plan = historian.history_plan(*key[1:4])
+        worker = history_columnar if columnar else history_json
+        body = await self.run(client_id, worker, historian.db_path, plan, key[4])
+        return historian.cache.store(key, marks, body=body, immutable=immutable)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "pending": self._pending, "completed": self.completed,
+                "rejected": self.rejected}
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("assets")
+
+# 只壓縮文字類型 (圖片 / 字型本身已壓縮)
+COMPRESSIBLE = {'.js', '.mjs', '.css', '.html', '.json', '.svg', '.map', '.txt'}
+MIN_COMPRESS_SIZE = 256
+
+
+class Asset:
+    __slots__ = ('path', 'hashed', 'content_type', 'etag', 'variants')
+
+    def __init__(self, path: str, hashed: str, content_type: str, etag: str, variants: Dict[str, bytes]):
+        self.path = path              # 邏輯路徑 js/api.js
+        self.hashed = hashed          # 雜湊路徑 js/api.1a2b3c4d5e.js
+        self.content_type = content_type
+        self.etag = etag
+        self.variants = variants      # encoding -> bytes ('identity' / 'gzip' / 'br')
+
+
+class AssetPipeline:
+    """
+    啟動時處理 web/static 下的靜態檔 (不需額外建置工具)：
+
+    - 依內容計算雜湊，產生 /assets/<path>.<hash>.<ext> 網址 (內容不變網址就不變)
+    - 預先產生 gzip (與 brotli，若已安裝) 版本，寫入 cache_dir，重啟時依雜湊重用
+    - 雜湊網址回應 Cache-Control: immutable，之後的頁面載入不需任何資源往返
+    - 模板透過 asset('js/api.js') 取得雜湊網址；JS 模組間的 import 由 import map 導向雜湊網址
+    """
+    def __init__(self, static_dir: str = 'web/static', cache_dir: str = 'data/assets', url_prefix: str = '/assets'):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self._by_path: Dict[str, Asset] = {}
+        self._by_url: Dict[str, Asset] = {}
+
+    def build(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        by_path, by_url = {}, {}
+        raw_total = sent_total = 0
+        for root, _, files in os.walk(self.static_dir):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                rel = os.path.relpath(full, self.static_dir).replace(os.sep, '/')
+                with open(full, 'rb') as f:
+                    body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:10]
+                stem, ext = os.path.splitext(rel)
+                hashed = f"{stem}.{digest}{ext}"
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                if content_type.startswith('text/') or content_type.endswith('javascript'):
+                    content_type += '; charset=utf-8'
+                variants = {'identity': body}
+                if ext.lower() in COMPRESSIBLE and len(body) >= MIN_COMPRESS_SIZE:
+                    variants.update(self._compressed(hashed, body))
+                asset = Asset(rel, hashed, content_type, f'"{digest}"', variants)
+                by_path[rel] = asset
+                by_url[rel] = asset
+                by_url[hashed] = asset
+                raw_total += len(body)
+                sent_total += min(len(v) for v in variants.values())
+        self._by_path, self._by_url = by_path, by_url
+        self._prune(by_path.values())
+        logger.info(f"Assets ready: {len(by_path)} files, {raw_total / 1024:.0f} KB -> "
+                    f"{sent_total / 1024:.0f} KB compressed (brotli {'on' if brotli else 'off'})")
+
+    def _compressed(self, hashed: str, body: bytes) -> Dict[str, bytes]:
+        """讀取或產生壓縮版本 (檔名含內容雜湊，內容相同時重用)"""
+        out = {}
+        encoders = [('gzip', '.gz', lambda b: gzip.compress(b, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('br', '.br', lambda b: brotli.compress(b, quality=11)))
+        for encoding, suffix, encode in encoders:
+            path = os.path.join(self.cache_dir, hashed.replace('/', '__') + suffix)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = encode(body)
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            if len(data) < len(body):
+                out[encoding] = data
+        return out
+
+    def _prune(self, assets):
+        """移除已不對應任何目前檔案的舊壓縮檔"""
+        keep = {a.hashed.replace('/', '__') for a in assets}
+        for name in os.listdir(self.cache_dir):
+            base = name.rsplit('.', 1)[0]
+            if base not in keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    # --- 模板用 ---
+    def url(self, path: str) -> str:
+        """asset('js/api.js') -> /assets/js/api.<hash>.js (未知檔案退回 /static)"""
+        asset = self._by_path.get(path.lstrip('/'))
+        if asset is None:
+            return f"/static/{path.lstrip('/')}"
+        return f"{self.url_prefix}/{asset.hashed}"
+
+    def importmap(self) -> str:
+        """
+        JS 模組的 import map：模組內 import './api.js' 會解析為 /assets/js/api.js，
+        在此導向雜湊網址，使相依模組同樣可被永久快取。
+        """
+        imports = {f"{self.url_prefix}/{a.path}": f"{self.url_prefix}/{a.hashed}"
+                   for a in self._by_path.values() if a.path.endswith(('.js', '.mjs'))}
+        return json.dumps({"imports": imports}, indent=2)
+
+    # --- 回應 ---
+    def lookup(self, url_path: str) -> Optional[Asset]:
+        return self._by_url.get(url_path)
+
+    @staticmethod
+    def negotiate(asset: Asset, accept_encoding: str) -> str:
+        accepted = {p.split(';')[0].strip() for p in (accept_encoding or '').lower().split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in asset.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+    def stats(self) -> Dict:
+        return {"files": len(self._by_path), "brotli": brotli is not None,
+                "bytes": sum(len(a.variants['identity']) for a in self._by_path.values()),
+                "gzip_bytes": sum(len(a.variants.get('gzip', a.variants['identity']))
+                                  for a in self._by_path.values())}
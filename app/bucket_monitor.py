@@ -0,0 +1,123 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from .buckets import BUCKET_COUNT
+
+logger = logging.getLogger("buckets")
+
+# 即時產能以最近 60 秒的計數增量計算
+RATE_WINDOW_SECONDS = 60.0
+# WebSocket 推播最短間隔 (秒)
+PUBLISH_INTERVAL = 1.0
+
+
+class _BucketState:
+    __slots__ = ('prev_total', 'prev_count', 'window', 'win_count', 'win_weight',
+                 'min_count', 'min_weight', 'min_giveaway')
+
+    def __init__(self):
+        self.prev_total = None
+        self.prev_count = None
+        self.window = deque()  # (ts, d_count, d_weight)
+        self.win_count = 0
+        self.win_weight = 0.0
+        self.min_count = 0
+        self.min_weight = 0.0
+        self.min_giveaway = 0.0
+
+
+class BucketMonitor:
+    """
+    由 PLC 分規統計區塊 (40015~) 的累計計數器計算每個分規的即時產能、平均重量與超重 (Giveaway)。
+    每次輪詢只處理計數器差值；每分鐘彙總寫入 bucket_minute 表。
+    """
+    def __init__(self, historian, ws_hub):
+        self.historian = historian
+        self.ws_hub = ws_hub
+        self._buckets = {i: _BucketState() for i in range(1, BUCKET_COUNT + 1)}
+        self._minute: Optional[str] = None
+        self._last_publish = 0.0
+        self._dirty = False
+        self._tags: Dict[str, Any] = {}
+
+    def update(self, tags: Dict[str, Any], now: Optional[float] = None):
+        """每次輪詢後呼叫"""
+        now = now or time.time()
+        self._tags = tags
+        minute = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M')
+        if self._minute is None:
+            self._minute = minute
+        elif minute != self._minute:
+            self._flush_minute(tags)
+            self._minute = minute
+
+        for i, st in self._buckets.items():
+            total = tags.get(f'bkt_b{i}_total')
+            count = tags.get(f'bkt_b{i}_count')
+            if total is None or count is None:
+                continue
+
+            if st.prev_count is not None:
+                d_count = count - st.prev_count
+                d_total = total - st.prev_total
+                if d_count < 0 or d_total < 0:
+                    # PLC 計數器歸零 (換班清除或重新開機)，以目前值作為增量
+                    d_count, d_total = count, total
+                if d_count > 0:
+                    target = tags.get(f'cfg_b{i}_target')
+                    st.window.append((now, d_count, d_total))
+                    st.win_count += d_count
+                    st.win_weight += d_total
+                    st.min_count += d_count
+                    st.min_weight += d_total
+                    if target:
+                        st.min_giveaway += d_total - d_count * target
+                    self._dirty = True
+            st.prev_total, st.prev_count = total, count
+
+            # 移除超出視窗的增量
+            while st.window and st.window[0][0] < now - RATE_WINDOW_SECONDS:
+                _, c, w = st.window.popleft()
+                st.win_count -= c
+                st.win_weight -= w
+                self._dirty = True
+
+        if self._dirty and now - self._last_publish >= PUBLISH_INTERVAL:
+            self._last_publish = now
+            self._dirty = False
+            if self.ws_hub.clients:
+                self.ws_hub.broadcast({"type": "bucket_stats", "data": self._build_snapshot(tags)})
+
+    def _build_snapshot(self, tags: Dict[str, Any]) -> Dict[str, Any]:
+        buckets = {}
+        for i, st in self._buckets.items():
+            target = tags.get(f'cfg_b{i}_target')
+            total_count = tags.get(f'bkt_b{i}_count') or 0
+            total_weight = tags.get(f'bkt_b{i}_total') or 0
+            win_avg = st.win_weight / st.win_count if st.win_count else None
+            avg = total_weight / total_count if total_count else None
+            buckets[str(i)] = {
+                "rate_per_min": round(st.win_count * 60.0 / RATE_WINDOW_SECONDS, 1),
+                "avg_weight": round(win_avg, 1) if win_avg is not None else None,
+                "total_count": total_count,
+                "total_avg_weight": round(avg, 1) if avg is not None else None,
+                "target": target,
+                "giveaway": round(win_avg - target, 1) if (win_avg is not None and target) else None,
+            }
+        return {"fish_code": tags.get('fish_code'), "buckets": buckets}
+
+    def _flush_minute(self, tags: Dict[str, Any]):
+        rows = []
+        for i, st in self._buckets.items():
+            if st.min_count:
+                rows.append((self._minute, i, tags.get('fish_code'), st.min_count,
+                             st.min_weight, round(st.min_giveaway, 1)))
+            st.min_count, st.min_weight, st.min_giveaway = 0, 0.0, 0.0
+        if rows:
+            self.historian.save_bucket_minutes(rows)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._build_snapshot(self._tags)
@@ -0,0 +1,34 @@
+from typing import Dict, List, Optional, Tuple
+
+BUCKET_COUNT = 7
+
+
+def bucket_ranges(params: Dict) -> List[Tuple[int, float, float, Optional[float]]]:
+    """
+    從 cfg_bN_min / cfg_bN_max / cfg_bN_target 取出有效的分規區間。
+    params 可以是 Gateway tags，也可以是 fish_recipes 中儲存的配方。
+    回傳 [(bucket_id, min, max, target), ...]，只包含 max > min 的分規。
+    """
+    ranges = []
+    for i in range(1, BUCKET_COUNT + 1):
+        b_min = params.get(f'cfg_b{i}_min')
+        b_max = params.get(f'cfg_b{i}_max')
+        if b_min is None or b_max is None:
+            continue
+        try:
+            b_min, b_max = float(b_min), float(b_max)
+        except (TypeError, ValueError):
+            continue
+        if b_max <= b_min:
+            continue
+        target = params.get(f'cfg_b{i}_target')
+        ranges.append((i, b_min, b_max, float(target) if target is not None else None))
+    return ranges
+
+
+def classify_weight(weight: float, ranges: List[Tuple[int, float, float, Optional[float]]]) -> Optional[int]:
+    """與 PLC 相同的判斷方式：min <= weight < max，回傳第一個符合的分規"""
+    for bucket_id, b_min, b_max, _ in ranges:
+        if b_min <= weight < b_max:
+            return bucket_id
+    return None
@@ -17,7 +17,7 @@ def check_database():
 
         # 1. 檢查所有表格
         print("\n[1. 資料表列表]")
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view');")
         tables = cursor.fetchall()
         
         if not tables:
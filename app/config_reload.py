@@ -0,0 +1,176 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from .gateway import PollPlan
+
+logger = logging.getLogger("config")
+
+# 不需重啟即可套用的設定 (其餘變更只回報，需重啟服務)
+HOT_PREFIXES = ('plc.', 'publish.', 'logging.level')
+# 需要重新連線的設定
+RECONNECT_KEYS = ('plc.host', 'plc.port')
+
+# 多暫存器欄位的寬度 (其餘欄位只檢查起始位址)
+FIELD_WIDTHS = {'weight_now': 2, 'fish_code': 2, 'production_count': 2, 'start_time_year': 6}
+MAX_READ_COUNT = 2000
+
+
+def flatten(cfg: Any, prefix: str = '') -> Dict[str, Any]:
+    """{'plc': {'port': 1}} -> {'plc.port': 1} (list 視為單一值)"""
+    if not isinstance(cfg, dict):
+        return {prefix: cfg}
+    out = {}
+    for key, value in cfg.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict) and value:
+            out.update(flatten(value, path))
+        else:
+            out[path] = value
+    return out
+
+
+def diff(old: Dict, new: Dict) -> List[Dict[str, Any]]:
+    a, b = flatten(old), flatten(new)
+    changes = []
+    for key in sorted(set(a) | set(b)):
+        if a.get(key, KeyError) != b.get(key, KeyError):
+            changes.append({"key": key, "old": a.get(key), "new": b.get(key)})
+    return changes
+
+
+def validate(cfg: Any) -> List[str]:
+    """回傳錯誤訊息列表 (空列表表示可套用)"""
+    if not isinstance(cfg, dict):
+        return ["config must be a mapping"]
+    errors = []
+    plc = cfg.get('plc')
+    if not isinstance(plc, dict):
+        return ["plc section is missing"]
+    if not isinstance(plc.get('host'), str) or not plc.get('host'):
+        errors.append("plc.host must be a non-empty string")
+    port = plc.get('port')
+    if not isinstance(port, int) or not 0 < port < 65536:
+        errors.append("plc.port must be an integer between 1 and 65535")
+    interval = plc.get('poll_interval')
+    if not isinstance(interval, (int, float)) or not 0 < interval <= 60:
+        errors.append("plc.poll_interval must be between 0 and 60 seconds")
+
+    registers = plc.get('registers')
+    if not isinstance(registers, dict):
+        return errors + ["plc.registers section is missing"]
+    start, count = registers.get('read_start'), registers.get('read_count')
+    if not isinstance(start, int) or start < 0:
+        errors.append("plc.registers.read_start must be a non-negative integer")
+        start = None
+    if not isinstance(count, int) or not 0 < count <= MAX_READ_COUNT:
+        errors.append(f"plc.registers.read_count must be between 1 and {MAX_READ_COUNT}")
+        count = None
+    reg_map = registers.get('map')
+    if not isinstance(reg_map, dict) or 'weight_now' not in reg_map:
+        errors.append("plc.registers.map must define at least weight_now")
+    elif start is not None and count is not None:
+        for name, addr in reg_map.items():
+            if not isinstance(addr, int):
+                errors.append(f"plc.registers.map.{name} must be an integer address")
+                continue
+            width = FIELD_WIDTHS.get(name, 1)
+            if addr < start or addr + width > start + count:
+                errors.append(f"plc.registers.map.{name} ({addr}) is outside the read range "
+                              f"{start}..{start + count - 1}")
+
+    database = cfg.get('database')
+    if not isinstance(database, dict) or not isinstance(database.get('path'), str):
+        errors.append("database.path must be a string")
+    publish = cfg.get('publish')
+    if publish is not None and not isinstance(publish, dict):
+        errors.append("publish must be a mapping")
+    return errors
+
+
+class ConfigReloader:
+    """
+    重新載入 config.yaml (SIGHUP 或管理 API)。
+
+    新檔案先驗證，失敗時維持目前設定；plc / publish 變更在背景執行緒建立新的輪詢設定
+    (解碼器 + 讀取範圍)，再由 Gateway 在兩次 tick 之間整組替換，只有 host / port 變更才重新連線。
+    其他區段 (資料庫路徑等) 只回報差異，需重啟服務才生效。
+    """
+    def __init__(self, path: str, config: Dict, gateway):
+        self.path = path
+        self.config = config          # 執行中的設定 (與各元件共用的同一個 dict)
+        self.gateway = gateway
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def _read(self) -> Dict:
+        with open(self.path, 'r') as f:
+            return yaml.safe_load(f)
+
+    async def reload(self, dry_run: bool = False) -> Dict[str, Any]:
+        async with self._lock:
+            try:
+                new = await asyncio.to_thread(self._read)
+            except Exception as e:
+                return self._done({"ok": False, "errors": [f"Cannot read {self.path}: {e}"]}, dry_run)
+            errors = validate(new)
+            if errors:
+                return self._done({"ok": False, "errors": errors}, dry_run)
+
+            changes = diff(self.config, new)
+            hot = [c for c in changes if c['key'].startswith(HOT_PREFIXES)]
+            restart = [c['key'] for c in changes if c not in hot]
+            result = {
+                "ok": True, "dry_run": dry_run, "changes": changes,
+                "applied": [c['key'] for c in hot] if not dry_run else [],
+                "reconnect": any(c['key'] in RECONNECT_KEYS for c in hot),
+                "restart_required": restart,
+            }
+            if dry_run or not hot:
+                return self._done(result, dry_run)
+
+            try:
+                result['pending'] = not await self._apply(new, hot)
+            except Exception as e:
+                logger.error(f"Config reload failed while applying: {e}")
+                result.update(ok=False, applied=[], errors=[f"Apply failed: {e}"])
+            return self._done(result, dry_run)
+
+    async def _apply(self, new: Dict, hot: List[Dict]) -> bool:
+        """回傳 False 表示輪詢設定尚在等待 tick 結束 (之後自動套用)"""
+        keys = [c['key'] for c in hot]
+        applied = True
+        plc_changed = any(k.startswith('plc.') for k in keys)
+        publish_changed = any(k.startswith('publish.') for k in keys)
+        if plc_changed or publish_changed:
+            plc_cfg = copy.deepcopy(new['plc'] if plc_changed else self.config['plc'])
+            publish_cfg = copy.deepcopy(new.get('publish') or {}) if publish_changed else None
+            plan = await asyncio.to_thread(PollPlan, plc_cfg, publish_cfg)
+            applied = await self.gateway.replace_plan(plan)
+        if 'logging.level' in keys:
+            level = str(new['logging']['level']).upper()
+            logging.getLogger().setLevel(getattr(logging, level, logging.INFO))
+            self.config.setdefault('logging', {})['level'] = new['logging']['level']
+        return applied
+
+    def _done(self, result: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+        if dry_run:
+            return result
+        self.reloads += 1
+        self.last_result = result
+        if not result['ok']:
+            logger.error(f"Config reload rejected: {'; '.join(result['errors'])}")
+        elif result['changes']:
+            logger.info(f"Config reloaded: applied {result['applied'] or 'nothing'}"
+                        + (f", restart required for {result['restart_required']}"
+                           if result['restart_required'] else ''))
+        else:
+            logger.info("Config reloaded: no changes")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"reloads": self.reloads, "last": self.last_result}
@@ -0,0 +1,102 @@
+import time
+from fnmatch import fnmatchcase
+from typing import Dict, Any, Optional, Tuple
+
+
+class TagRule:
+    """
+    單一 Tag 的發佈條件 (Report-by-exception)
+      deadband:     與上次發佈值的差距需達此值才發佈 (數值 Tag)
+      deadband_pct: 同上，以上次發佈值的百分比表示
+      min_interval: 兩次發佈的最短間隔 (秒)
+      max_silence:  超過此時間未發佈時，即使未變化也重送目前值 (心跳，秒)
+    """
+    __slots__ = ('deadband', 'deadband_pct', 'min_interval', 'max_silence')
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.deadband = float(cfg.get('deadband', 0) or 0)
+        self.deadband_pct = float(cfg.get('deadband_pct', 0) or 0)
+        self.min_interval = float(cfg.get('min_interval', 0) or 0)
+        self.max_silence = float(cfg.get('max_silence', 0) or 0)
+
+    def exceeds(self, value, last) -> bool:
+        """value 相對於上次發佈值 last 是否算是「有變化」"""
+        if value == last:
+            return False
+        numeric = (isinstance(value, (int, float)) and isinstance(last, (int, float))
+                   and not isinstance(value, bool) and not isinstance(last, bool))
+        if not numeric:
+            return True
+        diff = abs(value - last)
+        if self.deadband and diff < self.deadband:
+            return False
+        if self.deadband_pct and diff < abs(last) * self.deadband_pct / 100.0:
+            return False
+        return True
+
+
+class PublishFilter:
+    """
+    依 config.yaml `publish` 區段決定 Tag 變化是否要發佈到 WebSocket / 趨勢。
+    原始值不經過此處 (事件偵測仍使用每次輪詢的原始值)。
+
+    publish:
+      default: {min_interval: 0}
+      tags:
+        weight: {deadband: 2, min_interval: 0.2, max_silence: 5}
+        "bkt_b*": {min_interval: 1.0}
+    tags 的鍵可使用萬用字元，第一個符合者生效。
+    """
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.default = TagRule(cfg.get('default'))
+        self.rules: Tuple[Tuple[str, TagRule], ...] = tuple(
+            (pattern, TagRule(rule)) for pattern, rule in (cfg.get('tags') or {}).items())
+        self._rule_cache: Dict[str, TagRule] = {}
+        # Tag -> (上次發佈值, 發佈時間)
+        self._last: Dict[str, Tuple[Any, float]] = {}
+        self.published = 0
+        self.suppressed = 0
+
+    def inherit(self, prev: 'PublishFilter'):
+        """替換設定時沿用前一個過濾器的上次發佈值與計數，避免替換後全部 Tag 重送"""
+        self._last = prev._last
+        self.published = prev.published
+        self.suppressed = prev.suppressed
+
+    def rule(self, name: str) -> TagRule:
+        rule = self._rule_cache.get(name)
+        if rule is None:
+            rule = next((r for p, r in self.rules if fnmatchcase(name, p)), self.default)
+            self._rule_cache[name] = rule
+        return rule
+
+    def check(self, name: str, value: Any, now: Optional[float] = None) -> bool:
+        """回傳 True 表示此值應發佈 (並記錄為最新發佈值)"""
+        now = now if now is not None else time.time()
+        last = self._last.get(name)
+        if last is None:
+            self._last[name] = (value, now)
+            self.published += 1
+            return True
+
+        last_value, last_ts = last
+        rule = self.rule(name)
+        elapsed = now - last_ts
+        if rule.max_silence and elapsed >= rule.max_silence:
+            publish = True
+        elif rule.exceeds(value, last_value):
+            publish = elapsed >= rule.min_interval
+        else:
+            publish = False
+
+        if publish:
+            self._last[name] = (value, now)
+            self.published += 1
+        elif value != last_value:
+            self.suppressed += 1
+        return publish
+
+    def stats(self) -> Dict[str, int]:
+        return {"published": self.published, "suppressed": self.suppressed}
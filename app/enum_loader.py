@@ -1,43 +1,144 @@
+import asyncio
 import json
+import logging
+import threading
+import time
 from pathlib import Path
+from typing import Dict, List, Optional
+
 from app.enums import DEFAULT_MACHINE_STATUS
+from app.query_cache import CachedResult
+
+logger = logging.getLogger("enums")
 
 ENUM_DIR = Path("config/enums")
 
+# 查表陣列上限 (value 超過此值改用 dict 查詢，避免異常大的代碼建立巨大陣列)
+MAX_TABLE_SIZE = 4096
+
+
+class EnumTable:
+    """
+    由 enum JSON 預先編譯的整數查表：codes[value] -> code 字串。
+    解析暫存器時只需一次陣列索引，不必每次建立 dict 或逐筆比對。
+    """
+    __slots__ = ('codes', 'extra', 'unknown')
+
+    def __init__(self, items: List[Dict], unknown: str = 'UNKNOWN'):
+        self.unknown = unknown
+        small = {int(i['value']): i['code'] for i in items
+                 if 'value' in i and 'code' in i and 0 <= int(i['value']) < MAX_TABLE_SIZE}
+        size = max(small) + 1 if small else 0
+        self.codes: List[Optional[str]] = [None] * size
+        for value, code in small.items():
+            self.codes[value] = code
+        self.extra = {int(i['value']): i['code'] for i in items
+                      if 'value' in i and 'code' in i and not 0 <= int(i['value']) < MAX_TABLE_SIZE}
+
+    def code(self, value: int) -> str:
+        if 0 <= value < len(self.codes):
+            return self.codes[value] or self.unknown
+        return self.extra.get(value, self.unknown)
+
+
 class EnumLoader:
-    def __init__(self):
-        self._cache = {}
+    """
+    載入 config/enums/*.json。
+    背景工作 (run) 每 check_interval 秒檢查 mtime，變動時重新載入，不需重啟；輪詢路徑上的
+    table() 只讀取已編譯的查表。單一檔案格式錯誤 (JSON 或 value 無法轉為整數) 時保留該檔的上一版內容。所有 enum 合併為一個帶版本號與 ETag 的回應 (/enums)。
+    """
+    def __init__(self, enum_dir: Path = ENUM_DIR, check_interval: float = 1.0):
+        self.enum_dir = Path(enum_dir)
+        self.check_interval = check_interval
+        self._cache: Dict[str, List[Dict]] = {}
+        self._tables: Dict[str, EnumTable] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._result: Optional[CachedResult] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def _read(self, path: Path) -> List[Dict]:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # 保證是 list
+        if not isinstance(data, list):
+            raise ValueError(f"{path} must be a list")
+        return data
+
+    def refresh(self, force: bool = False) -> bool:
+        """檢查 mtime，有新增 / 變動 / 刪除的檔案時重新載入；回傳是否有變動"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            self._last_check = now
+            try:
+                files = {p.stem: p for p in self.enum_dir.glob("*.json")}
+                mtimes = {name: p.stat().st_mtime for name, p in files.items()}
+            except OSError as e:
+                logger.error(f"Enum directory scan failed: {e}")
+                return False
+            if mtimes == self._mtimes and self.version:
+                return False
 
-    def load(self, name: str):
-        # cache
-        if name in self._cache:
-            return self._cache[name]
+            cache, tables = {}, {}
+            for name, path in files.items():
+                if self._mtimes.get(name) == mtimes[name] and name in self._cache:
+                    cache[name], tables[name] = self._cache[name], self._tables[name]
+                    continue
+                try:
+                    items = self._read(path)
+                    tables[name] = EnumTable(items)
+                    cache[name] = items
+                except Exception as e:
+                    logger.error(f"Enum load failed: {name} ({e})")
+                    if name in self._cache:
+                        cache[name], tables[name] = self._cache[name], self._tables[name]
+            # fallback（JSON 失效時）
+            if "machine_status" not in cache:
+                cache["machine_status"] = [{"value": v, **item} for v, item in DEFAULT_MACHINE_STATUS.items()]
+                tables["machine_status"] = EnumTable(cache["machine_status"])
 
-        path = ENUM_DIR / f"{name}.json"
+            self._cache = cache
+            self._tables = tables
+            self._mtimes = mtimes
+            self.version += 1
+            payload = {"version": self.version, **cache}
+            self._result = CachedResult(payload, f'"enums-{self.version}-{int(max(mtimes.values(), default=0))}"')
+            if self.version > 1:
+                logger.info(f"Enums reloaded (v{self.version}): {', '.join(sorted(cache))}")
+            return True
 
-        try:
-            if not path.exists():
-                raise FileNotFoundError(path)
+    async def run(self):
+        """背景檢查 enum 檔案變動 (目錄掃描與 stat 在執行緒中進行，不佔用輪詢迴圈)"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.to_thread(self.refresh, True)
+            except Exception as e:
+                logger.error(f"Enum refresh failed: {e}")
 
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+    def _ensure_loaded(self):
+        if not self.version:
+            self.refresh(force=True)
 
-            # 保證是 list
-            if not isinstance(data, list):
-                raise ValueError(f"{path} must be a list")
+    def load(self, name: str) -> List[Dict]:
+        self._ensure_loaded()
+        return self._cache.get(name, [])
 
-            self._cache[name] = data
-            return data
+    def table(self, name: str) -> EnumTable:
+        """取得預先編譯的查表 (不存在時回傳空表，查詢一律為 UNKNOWN)"""
+        self._ensure_loaded()
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = EnumTable([])
+        return table
 
-        except Exception as e:
-            print(f"[ENUM] load failed: {name} ({e})")
+    def result(self) -> CachedResult:
+        """/enums 回應 (全部 enum + version，ETag 隨內容版本變動)"""
+        self._ensure_loaded()
+        return self._result
 
-            # fallback（轉成 list）
-            if name == "machine_status":
-                fallback = list(DEFAULT_MACHINE_STATUS.values())
-                self._cache[name] = fallback
-                return fallback
 
-            return []
-            
 enum_loader = EnumLoader()
@@ -0,0 +1,275 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger("exporter")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+# 匯出串流: events = history 明細 (以 id 為水位)，rollups = 分規每分鐘彙總 (以 minute 為水位)
+STREAM_EVENTS = 'events'
+STREAM_ROLLUPS = 'rollups'
+
+# 可重試的 4xx (其餘 4xx 表示接收端永久拒絕此批次)
+RETRYABLE_HTTP = (408, 425, 429)
+
+
+class SinkRejected(Exception):
+    """接收端永久拒絕批次 (重送也不會成功)"""
+
+
+def compress(body: bytes, method: str):
+    """回傳 (壓縮後資料, Content-Encoding)；zstd 不可用時改用 gzip"""
+    if method in ('zstd', 'auto') and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(body), 'zstd'
+    return gzip.compress(body, compresslevel=6), 'gzip'
+
+
+class HttpSink:
+    """以 HTTP POST 送出批次 (帶 Idempotency-Key，接收端可據此去除重送)"""
+    def __init__(self, cfg: Dict):
+        self.url = cfg['url']
+        self.timeout = float(cfg.get('timeout', 10))
+        self.headers = dict(cfg.get('headers') or {})
+
+    def send(self, body: bytes, encoding: str, key: str):
+        req = urllib.request.Request(self.url, data=body, method='POST')
+        req.add_header('Content-Type', 'application/json')
+        req.add_header('Content-Encoding', encoding)
+        req.add_header('Idempotency-Key', key)
+        for k, v in self.headers.items():
+            req.add_header(k, v)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                if resp.status >= 300:
+                    raise RuntimeError(f"HTTP {resp.status}")
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in RETRYABLE_HTTP:
+                raise SinkRejected(f"HTTP {e.code} {e.reason}") from e
+            raise
+
+    def close(self):
+        pass
+
+
+class MqttSink:
+    """以 MQTT (QoS 1) 發佈批次，需安裝 paho-mqtt；冪等鍵附在 topic 最後一段"""
+    def __init__(self, cfg: Dict):
+        if mqtt is None:
+            raise RuntimeError("paho-mqtt is not installed (pip install paho-mqtt)")
+        self.host = cfg.get('host', '127.0.0.1')
+        self.port = int(cfg.get('port', 1883))
+        self.topic = cfg.get('topic', 'plc-gateway/export')
+        self.timeout = float(cfg.get('timeout', 10))
+        self._client = mqtt.Client(client_id=cfg.get('client_id', ''))
+        if cfg.get('username'):
+            self._client.username_pw_set(cfg['username'], cfg.get('password'))
+        self._connected = False
+
+    def send(self, body: bytes, encoding: str, key: str):
+        if not self._connected:
+            self._client.connect(self.host, self.port)
+            self._client.loop_start()
+            self._connected = True
+        info = self._client.publish(f"{self.topic}/{encoding}/{key}", body, qos=1)
+        info.wait_for_publish(timeout=self.timeout)
+        if not info.is_published():
+            raise RuntimeError("MQTT publish not acknowledged")
+
+    def close(self):
+        if self._connected:
+            self._client.loop_stop()
+            self._client.disconnect()
+            self._connected = False
+
+
+class Exporter:
+    """
+    將新的生產事件與分規彙總批次推送到上游 (MES)。
+
+    依水位 (high-water mark) 讀取新資料，筆數或時間到達時組成批次，
+    先壓縮寫入 outbox 目錄再推進水位，之後由 outbox 依序送出 (至少一次，帶冪等鍵)。
+    送出失敗以指數退避重試；接收端永久拒絕 (非重試類的 4xx) 的批次移到 failed/ 目錄後繼續送出下一批。
+    outbox 滿時暫停讀取新資料 (資料仍在 SQLite，不會遺失)。
+    所有資料庫 / 網路 I/O 皆在執行緒中進行，不影響輪詢迴圈。
+    """
+    def __init__(self, historian, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.historian = historian
+        self.enabled = bool(cfg.get('enabled', False))
+        self.source = cfg.get('source') or socket.gethostname()
+        self.batch_size = int(cfg.get('batch_size', 500))
+        self.max_wait = float(cfg.get('max_wait', 10.0))
+        self.interval = float(cfg.get('interval', 1.0))
+        self.compression = cfg.get('compression', 'auto')
+        self.outbox = cfg.get('outbox_path', 'data/outbox')
+        self.failed_path = os.path.join(self.outbox, 'failed')
+        self.outbox_max_batches = int(cfg.get('outbox_max_batches', 1000))
+        self.max_backoff = float(cfg.get('max_backoff', 60.0))
+        self.streams = [s for s in cfg.get('streams', [STREAM_EVENTS, STREAM_ROLLUPS])
+                        if s in (STREAM_EVENTS, STREAM_ROLLUPS)]
+        self.cfg = cfg
+        self.sink = None
+
+        self._first_seen: Dict[str, float] = {}  # 串流 -> 首次發現未匯出資料的時間
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self.sent_batches = 0
+        self.failures = 0
+        self.rejected_batches = 0
+        self.last_rejected: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def _make_sink(self):
+        kind = self.cfg.get('sink', 'http')
+        if kind == 'mqtt':
+            return MqttSink(self.cfg.get('mqtt', {}))
+        return HttpSink(self.cfg.get('http', {}))
+
+    # --- outbox ---
+    def _outbox_files(self) -> List[str]:
+        try:
+            return sorted(n for n in os.listdir(self.outbox) if not n.endswith('.tmp') and n != 'failed')
+        except FileNotFoundError:
+            return []
+
+    def _write_outbox(self, key: str, body: bytes, encoding: str):
+        os.makedirs(self.outbox, exist_ok=True)
+        name = f"{time.time_ns():020d}_{key}.{encoding}"
+        tmp = os.path.join(self.outbox, name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.outbox, name))
+
+    # --- 組批次 ---
+    def _read(self, stream: str):
+        """回傳 (rows, 新水位)"""
+        mark = self.historian.get_export_mark(stream)
+        if stream == STREAM_EVENTS:
+            rows = self.historian.get_history_after(int(mark or 0), self.batch_size)
+            return rows, (str(rows[-1]['id']) if rows else mark)
+        # 只匯出已結束且已寫入的分鐘 (分規彙總於下一分鐘開始時才寫入，保留一分鐘緩衝)
+        cutoff = datetime.fromtimestamp(time.time() - 60).strftime('%Y-%m-%d %H:%M')
+        rows = self.historian.get_bucket_minutes_after(mark or '', cutoff, self.batch_size)
+        if rows and len(rows) >= self.batch_size:
+            # 同一分鐘的分規不可跨批次拆開 (水位以分鐘為單位)
+            last_minute = rows[-1]['minute']
+            trimmed = [r for r in rows if r['minute'] != last_minute]
+            rows = trimmed or rows
+        return rows, (rows[-1]['minute'] if rows else mark)
+
+    def _collect(self) -> int:
+        """讀取各串流的新資料，達到筆數或等待時間時寫入 outbox 並推進水位"""
+        created = 0
+        for stream in self.streams:
+            while len(self._outbox_files()) < self.outbox_max_batches:
+                rows, mark = self._read(stream)
+                if not rows:
+                    self._first_seen.pop(stream, None)
+                    break
+                first_seen = self._first_seen.setdefault(stream, time.time())
+                if len(rows) < self.batch_size and time.time() - first_seen < self.max_wait:
+                    break
+                first = rows[0]['id'] if stream == STREAM_EVENTS else rows[0]['minute']
+                key = f"{self.source}-{stream}-{first}-{mark}".replace(' ', 'T').replace(':', '')
+                doc = {"source": self.source, "stream": stream, "key": key, "rows": rows}
+                body, encoding = compress(json.dumps(doc, separators=(',', ':')).encode('utf-8'),
+                                          self.compression)
+                self._write_outbox(key, body, encoding)
+                self.historian.set_export_mark(stream, mark)
+                self._first_seen.pop(stream, None)
+                created += 1
+                if len(rows) < self.batch_size:
+                    break
+        return created
+
+    # --- 送出 ---
+    def _deliver(self) -> int:
+        """依序送出 outbox 中的批次，遇到失敗即停止 (保持順序)；被拒絕的批次移出後繼續"""
+        if self.sink is None:
+            self.sink = self._make_sink()
+        sent = 0
+        for name in self._outbox_files():
+            path = os.path.join(self.outbox, name)
+            stem, encoding = name.rsplit('.', 1)
+            key = stem.split('_', 1)[1]
+            with open(path, 'rb') as f:
+                body = f.read()
+            try:
+                self.sink.send(body, encoding, key)
+            except SinkRejected as e:
+                self._reject(path, name, e)
+                continue
+            os.remove(path)
+            sent += 1
+            self.sent_batches += 1
+        return sent
+
+    def _reject(self, path: str, name: str, error: Exception):
+        os.makedirs(self.failed_path, exist_ok=True)
+        os.replace(path, os.path.join(self.failed_path, name))
+        self.rejected_batches += 1
+        self.last_rejected = f"{name}: {error}"
+        logger.error(f"Export batch {name} rejected by sink ({error}); moved to {self.failed_path}")
+
+    def run_once(self):
+        """執行一輪 (於執行緒中)：組批次 -> 送出"""
+        self._collect()
+        if time.time() < self._retry_at:
+            return
+        try:
+            self._deliver()
+            self._backoff = 0.0
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self._backoff = min(max(self._backoff * 2, self.interval), self.max_backoff)
+            self._retry_at = time.time() + self._backoff
+            self.last_error = str(e)
+            logger.warning(f"Export delivery failed (retry in {self._backoff:.0f}s, "
+                           f"{len(self._outbox_files())} batches buffered): {e}")
+
+    async def run(self):
+        if not self.enabled:
+            return
+        logger.info(f"Exporter started ({self.cfg.get('sink', 'http')}, streams={self.streams})")
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.run_once)
+                except Exception as e:
+                    logger.error(f"Exporter error: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            if self.sink:
+                self.sink.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "buffered_batches": len(self._outbox_files()),
+            "sent_batches": self.sent_batches,
+            "failures": self.failures,
+            "rejected_batches": self.rejected_batches,
+            "last_rejected": self.last_rejected,
+            "last_error": self.last_error,
+            "marks": {s: self.historian.get_export_mark(s) for s in self.streams},
+        }
@@ -0,0 +1,26 @@
+import json
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化為 JSON bytes：有安裝 orjson 時使用 orjson，否則使用標準 json (緊湊格式)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def columns_from_cursor(cursor) -> Dict[str, Any]:
+    """
+    直接由 cursor 的 tuple 轉為欄位式資料 {"col": [...], ...}，
+    不為每一列建立 dict，欄位名稱也只出現一次。
+    """
+    names = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return {name: [] for name in names}
+    return dict(zip(names, zip(*rows)))
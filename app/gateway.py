@@ -6,17 +6,59 @@ from .modbus_client import ModbusClient
 from .historian import Historian
 from .ws_hub import WsHub
 from .parser import TagParser
+from .buckets import bucket_ranges, classify_weight
+from .bucket_monitor import BucketMonitor
+from .waveform import WaveformRecorder
+from .trend import TrendBuffer
+from .deadband import PublishFilter
 
 logger = logging.getLogger("gateway")
 
+
+class PollPlan:
+    """
+    一組輪詢設定 (plc 區段 + 解碼器 + 讀取範圍 + 週期 + 發佈過濾)。
+    重新載入設定時在輪詢之外建立，由 Gateway 在兩次 tick 之間整組替換。
+    """
+    def __init__(self, plc_cfg: dict, publish_cfg: Optional[dict] = None):
+        registers = plc_cfg['registers']
+        self.plc_cfg = plc_cfg
+        self.host = plc_cfg['host']
+        self.port = plc_cfg['port']
+        self.poll_interval = float(plc_cfg['poll_interval'])
+        self.parser = TagParser(registers['map'])
+        self.start_addr = registers['read_start']
+        self.read_count = registers['read_count']
+        # publish 區段有變更時才帶入
+        self.publish_cfg = publish_cfg
+        self.publish_filter = PublishFilter(publish_cfg) if publish_cfg is not None else None
+
+
 class BaseGateway:
-    def __init__(self, config: dict, historian: Historian, ws_hub: WsHub):
+    def __init__(self, config: dict, historian: Historian, ws_hub: WsHub, stats_engine=None, oee=None):
         self.config = config
         self.historian = historian
         self.ws_hub = ws_hub
+        self.stats_engine = stats_engine
+        self.oee = oee
+        self.bucket_monitor = BucketMonitor(historian, ws_hub)
+        self.waveforms = WaveformRecorder(config.get('capture'))
+        self.trend_minutes = config.get('trend', {}).get('minutes', 10)
+        self.trend = TrendBuffer(self.trend_minutes, config['plc']['poll_interval'])
         self.running = False
+        self.poll_interval = config['plc']['poll_interval']
+        # 重新載入設定時待替換的輪詢設定 (下一次 tick 之前套用)
+        self._pending_plan: Optional[PollPlan] = None
+        self._plan_applied: Optional[asyncio.Future] = None
+        # 第一次成功輪詢時呼叫一次 (啟動計時)
+        self.on_first_poll = None
         self.tags: Dict[str, Any] = {}
+        # 經 deadband / 發佈頻率過濾後、客戶端實際看到的值
+        self.published: Dict[str, Any] = {}
+        self.publish_filter = PublishFilter(config.get('publish'))
         self.last_update = 0.0
+        # 本次輪詢中變更的 Tag，輪詢結束後以單一序號發佈
+        self._changes: Dict[str, Any] = {}
         
         # [修改] 用於追蹤重量變化，實現 Event-based Logging
         # 初始化為 -1 確保第一次讀取 0 也會被視為變化（如果需要）
@@ -28,42 +70,95 @@ class BaseGateway:
         self.running = True
         logger.info("Gateway started.")
         while self.running:
+            if self._pending_plan is not None:
+                self._swap_plan()
             start_time = time.time()
             try:
                 await self.tick()
             except Exception as e:
                 logger.error(f"Error in polling loop: {e}")
+            finally:
+                self._publish_changes()
             
             elapsed = time.time() - start_time
-            sleep_time = max(0, self.config['plc']['poll_interval'] - elapsed)
+            sleep_time = max(0, self.poll_interval - elapsed)
             await asyncio.sleep(sleep_time)
 
     async def stop(self):
         self.running = False
         logger.info("Gateway stopped.")
 
+    async def replace_plan(self, plan: PollPlan, timeout: float = 10.0) -> bool:
+        """
+        排入新的輪詢設定並等待在 tick 之間套用 (Gateway 未執行時立即套用)。
+        回傳 False 表示逾時 (tick 仍在進行中，例如重新連線)，設定會在下一次 tick 前套用。
+        """
+        self._pending_plan = plan
+        if not self.running:
+            self._swap_plan()
+            return True
+        if self._plan_applied is None or self._plan_applied.done():
+            self._plan_applied = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._plan_applied), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _swap_plan(self):
+        plan, self._pending_plan = self._pending_plan, None
+        if plan is None:
+            return
+        try:
+            self.apply_plan(plan)
+        except Exception as e:
+            logger.error(f"Applying new poll plan failed: {e}")
+            if self._plan_applied is not None and not self._plan_applied.done():
+                self._plan_applied.set_exception(e)
+            return
+        if self._plan_applied is not None and not self._plan_applied.done():
+            self._plan_applied.set_result(True)
+
+    def apply_plan(self, plan: PollPlan):
+        self.config['plc'] = plan.plc_cfg
+        if plan.poll_interval != self.poll_interval:
+            # 趨勢緩衝區以輪詢週期計算容量，週期變更時重建以維持相同的時間範圍
+            self.trend = self.trend.resized(self.trend_minutes, plan.poll_interval)
+        self.poll_interval = plan.poll_interval
+        if plan.publish_filter is not None:
+            self.config['publish'] = plan.publish_cfg
+            plan.publish_filter.inherit(self.publish_filter)
+            self.publish_filter = plan.publish_filter
+
     async def tick(self):
         raise NotImplementedError
 
     def update_tag(self, name: str, value: Any):
-        # 檢查數值是否真的改變
-        old_value = self.tags.get(name)
-        
-        # 更新 Tags 字典
+        # 更新 Tags 字典 (原始值)
         self.tags[name] = value
         
         # 只要有任何 Tag 更新，就視為 Gateway 活著
         self.last_update = time.time()
         
-        # 只有當數值改變時才廣播 (節省頻寬)
-        if value != old_value:
-            asyncio.create_task(self.ws_hub.broadcast({name: value}))
+        # 只有超過 deadband / 發佈間隔 (或到達心跳時間) 才廣播 (節省頻寬)
+        if self.publish_filter.check(name, value, self.last_update):
+            self.published[name] = value
+            self._changes[name] = value
             
         # [關鍵] 觸發 Event-based Logging
         # 無論數值是否改變，只要是 'weight' 標籤被更新（代表一次 polling 完成），就檢查是否需要紀錄
         # 注意：我們需要在這裡傳入 current value，因為 self.tags['weight'] 已經是新的了
         if name == 'weight':
             self._check_and_log_production(value)
+            # 未啟用高速取樣時，以輪詢值作為波形樣本
+            if self.waveforms.sample_interval <= 0:
+                self.waveforms.feed(value)
+
+    def _publish_changes(self):
+        """將本次輪詢的變更合併為一筆帶序號的差異"""
+        if self._changes:
+            changes, self._changes = self._changes, {}
+            self.ws_hub.publish(changes)
 
     def _check_and_log_production(self, current_weight):
         """
@@ -95,8 +190,20 @@ class BaseGateway:
                 
                 logger.info(f"🐟 [Production Log] New Fish: {log_data}")
                 
-                # 寫入資料庫
-                self.historian.log_data(log_data)
+                # 寫入資料庫 (波形擷取以 history.id 關聯)
+                row_id = self.historian.log_data(log_data)
+                self.waveforms.trigger(row_id)
+
+                # 依目前 PLC 分規設定判斷落入哪一個分規
+                bucket = classify_weight(current_weight, bucket_ranges(self.tags))
+                if self.stats_engine is not None:
+                    self.stats_engine.record(fish_code, current_weight, bucket)
+                # 良品 = 落入任一分規
+                if self.oee is not None:
+                    self.oee.record_piece(fish_code, bucket is not None)
+
+                # 生產事件推播 (訂閱 events 主題的客戶端)
+                self.ws_hub.broadcast({"type": "event", "data": {**log_data, "id": row_id, "bucket": bucket}})
             
             # 更新上一次的重量，供下次比較
             self._prev_weight = current_weight
@@ -105,11 +212,11 @@ class BaseGateway:
             logger.error(f"Logging check failed: {e}")
 
     def get_snapshot(self) -> dict:
-        return self.tags
+        return self.published
 
 class RealGateway(BaseGateway):
-    def __init__(self, config: dict, historian: Historian, ws_hub: WsHub):
-        super().__init__(config, historian, ws_hub)
+    def __init__(self, config: dict, historian: Historian, ws_hub: WsHub, stats_engine=None, oee=None):
+        super().__init__(config, historian, ws_hub, stats_engine, oee)
         self.client = ModbusClient(
             config['plc']['host'], 
             config['plc']['port'],
@@ -122,14 +229,47 @@ class RealGateway(BaseGateway):
         self.read_count = config['plc']['registers']['read_count']
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 10
+        self._sampler_task = None
 
-    async def start(self):
-        if not await self.client.connect():
+    async def start(self, connecting: Optional[asyncio.Task] = None):
+        """connecting: 啟動時提前開始的連線 (與資料庫初始化同時進行)，未提供時在此連線"""
+        connected = await connecting if connecting is not None else await self.client.connect()
+        if not connected:
             logger.error("Failed to connect to PLC. Will retry in polling loop.")
+        self._start_sampler()
         await super().start()
 
+    def _start_sampler(self):
+        if self._sampler_task:
+            self._sampler_task.cancel()
+            self._sampler_task = None
+        if self.waveforms.enabled and self.waveforms.sample_interval > 0:
+            self._sampler_task = asyncio.create_task(
+                self.waveforms.run_sampler(self.client, self.config['plc']['registers']['map']['weight_now']))
+
+    def apply_plan(self, plan: PollPlan):
+        old = self.config['plc']
+        reconnect = (plan.host, plan.port) != (old['host'], old['port'])
+        weight_moved = plan.plc_cfg['registers']['map'].get('weight_now') != old['registers']['map'].get('weight_now')
+        super().apply_plan(plan)
+        self.parser = plan.parser
+        self.start_addr = plan.start_addr
+        self.read_count = plan.read_count
+        if reconnect:
+            # 只有 host / port 變更才重新連線 (下一次 tick 連線)
+            logger.info(f"PLC endpoint changed to {plan.host}:{plan.port}, reconnecting")
+            self.client.close()
+            self.client = ModbusClient(plan.host, plan.port, max_retries=3, retry_delay=2.0)
+            self.reconnect_attempts = 0
+        if reconnect or weight_moved:
+            self._start_sampler()
+        logger.info(f"Poll plan applied: {self.read_count} registers @ {self.start_addr}, "
+                    f"every {self.poll_interval * 1000:.0f} ms")
+
     async def stop(self):
         await super().stop()
+        if self._sampler_task:
+            self._sampler_task.cancel()
         self.client.close()
 
     async def tick(self):
@@ -140,9 +280,13 @@ class RealGateway(BaseGateway):
                 self.reconnect_attempts = 0
             else:
                 self.reconnect_attempts += 1
+                if self.oee is not None:
+                    self.oee.mark_offline()
                 return
         
         if not self.client.connected:
+            if self.oee is not None:
+                self.oee.mark_offline()
             return
             
         # 讀取暫存器
@@ -156,5 +300,21 @@ class RealGateway(BaseGateway):
             # 更新每一個 Tag
             for key, val in parsed_data.items():
                 self.update_tag(key, val)
+
+            # 分規計數器差值 -> 即時產能 / 超重
+            self.bucket_monitor.update(self.tags)
+
+            # 機台狀態區間 / OEE (只有狀態變動時寫入資料庫)
+            if self.oee is not None:
+                self.oee.update(self.tags)
+
+            # 記錄到記憶體趨勢緩衝區 (與推播內容一致)
+            self.trend.record(time.time(), self.published)
+
+            if self.on_first_poll is not None:
+                callback, self.on_first_poll = self.on_first_poll, None
+                callback()
         else:
-            logger.warning("Failed to read from PLC, connection may be lost")
\ No newline at end of file
+            logger.warning("Failed to read from PLC, connection may be lost")
+            if self.oee is not None:
+                self.oee.mark_offline()
\ No newline at end of file
@@ -2,15 +2,37 @@ import sqlite3
 import logging
 import os
 import json
+import threading
 from contextlib import contextmanager
 from typing import Optional, Dict, List
 from datetime import datetime, timedelta
 
+from .query_cache import QueryCache, CachedResult
+from .partitions import PartitionStore, HISTORY_COLUMNS, HISTORY_NAMES, rows_to_columns, run_plan
+
 logger = logging.getLogger("historian")
 
+# 資料庫結構版本 (PRAGMA user_version)；結構變更時遞增，啟動時版本相同即略過 DDL
+SCHEMA_VERSION = 1
+
 class Historian:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, journal=None, cache_size: int = 256, immutable_after: float = 300.0,
+                 partitions: Optional[Dict] = None):
         self.db_path = db_path
+        # history 依月份分區 (history_YYYYMM)，history 為線上分區的檢視；過舊分區封存為壓縮檔
+        self.partitions = PartitionStore(db_path, partitions)
+        self.partitions.on_change = lambda: self.cache.bump('history')
+        # 未使用日誌時由此配發 history.id (分區表不再使用 AUTOINCREMENT)
+        self._next_id = None
+        self._id_lock = threading.Lock()
+        # history 寫入後的通知 (例如班別報表處理遲到事件)，參數為 [(id, timestamp, fish_code, weight, status), ...]
+        self.write_listeners = []
+        # 查詢結果快取：寫入時推進資料表水位使其失效；結束時間早於 immutable_after 秒前
+        # (且沒有落在範圍內的未套用日誌事件) 的範圍永久快取
+        self.cache = QueryCache(cache_size)
+        self.immutable_after = immutable_after
+        # 生產事件日誌 (EventJournal)；設定時 log_data 先寫日誌，再由背景套用到 SQLite
+        self.journal = journal
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
     @contextmanager
@@ -29,84 +51,465 @@ class Historian:
             if conn: conn.close()
 
     def init_db(self):
+        """
+        開啟資料庫：PRAGMA user_version 與 SCHEMA_VERSION 相同時不再執行 CREATE TABLE / INDEX
+        (只載入分區目錄並確保本月分區)，舊版資料庫執行一次 DDL 後寫入版本號。
+        """
         try:
+            self.partitions.enable_incremental_vacuum()
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # 1. 歷史記錄表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        fish_code TEXT,
-                        weight REAL,
-                        status TEXT
-                    )
-                ''')
-                
-                # Indexes
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_ts ON history(timestamp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_code ON history(fish_code)')
-
-                # 2. 魚種對應表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS fish_type (
-                        code TEXT PRIMARY KEY,
-                        name TEXT NOT NULL
-                    )
-                ''')
-
-                # 3. 分規配方表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS fish_recipes (
-                        fish_code TEXT PRIMARY KEY,
-                        params JSON,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-            logger.info(f"Database initialized at {self.db_path}")
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version > SCHEMA_VERSION:
+                    logger.warning(f"Database schema version {version} is newer than this build "
+                                   f"({SCHEMA_VERSION}); skipping schema setup")
+
+                # 1. 歷史記錄 (每月分區表 + history 檢視；舊版單一資料表會在此自動轉換)
+                self.partitions.init(conn, create_schema=version < SCHEMA_VERSION)
+
+                if version < SCHEMA_VERSION:
+                    logger.info(f"Creating database schema (version {version} -> {SCHEMA_VERSION})")
+                    self._create_schema(conn)
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+                self._next_id = self.partitions.max_id(conn) + 1
+
+            logger.info(f"Database initialized at {self.db_path} (schema v{max(version, SCHEMA_VERSION)})")
         except Exception as e:
             logger.error(f"DB Init failed: {e}")
             raise
 
-    def log_data(self, data: dict):
-        """寫入一筆歷史資料 (Time, FishCode, Weight, Status)"""
+    def _create_schema(self, conn: sqlite3.Connection):
+        """資料表與索引 (皆為 IF NOT EXISTS；新增資料表或欄位時請同時遞增 SCHEMA_VERSION)"""
+        cursor = conn.cursor()
+
+        # 2. 魚種對應表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fish_type (
+                code TEXT PRIMARY KEY,
+                name TEXT NOT NULL
+            )
+        ''')
+
+        # 3. 分規配方表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fish_recipes (
+                fish_code TEXT PRIMARY KEY,
+                params JSON,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                version INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        cols = {r['name'] for r in conn.execute('PRAGMA table_info(fish_recipes)')}
+        if 'version' not in cols:
+            cursor.execute('ALTER TABLE fish_recipes ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+        # 4. 分規每分鐘彙總表 (由 PLC 分規計數器差值計算)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bucket_minute (
+                minute TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                fish_code TEXT,
+                count INTEGER,
+                total_weight REAL,
+                giveaway REAL,
+                PRIMARY KEY (minute, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+        # 5. 上游匯出水位 (每個串流一列)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_state (
+                stream TEXT PRIMARY KEY,
+                mark TEXT
+            )
+        ''')
+
+        # 6. 事件日誌套用進度 (單列)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS journal_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                applied_seq INTEGER NOT NULL
+            )
+        ''')
+
+        # 7. 機台狀態區間 (每次狀態 / 魚種 / 警報碼變動一列，end 為 NULL 表示進行中)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS state_intervals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start TEXT NOT NULL,
+                end TEXT,
+                state TEXT NOT NULL,
+                fish_code TEXT,
+                alarm_code TEXT,
+                error_code TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_state_start ON state_intervals(start)')
+
+        # 8. OEE 檢查點 (每個班別 x 魚種的累計值)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS oee_checkpoint (
+                shift TEXT NOT NULL,
+                fish_code TEXT NOT NULL,
+                data JSON,
+                updated_at TEXT,
+                PRIMARY KEY (shift, fish_code)
+            ) WITHOUT ROWID
+        ''')
+
+        # 9. 班別報表 (班別結束時產生一次；data 為回應 JSON，acc 為供遲到事件增量更新的累計值)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shift_reports (
+                shift TEXT PRIMARY KEY,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                generated_at TEXT,
+                revision INTEGER NOT NULL DEFAULT 1,
+                max_id INTEGER,
+                data JSON,
+                acc JSON
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_shift_reports_start ON shift_reports(start)')
+
+    def open_journal(self):
+        """啟動時呼叫 (init_db 之後)：開啟日誌並先套用上次未完成的事件"""
+        if self.journal is None:
+            return
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT applied_seq FROM journal_state WHERE id = 1').fetchone()
+            applied = row[0] if row else 0
+            max_id = self.partitions.max_id(conn)
+        self.journal.open(applied_seq=applied, min_seq=max_id)
+        try:
+            while self.journal.apply_pending(self):
+                pass
+        except Exception as e:
+            logger.error(f"Journal replay deferred: {e}")
+
+    def apply_events(self, events: List[tuple]):
+        """
+        由日誌套用器呼叫: events = [(seq, payload), ...]
+        以序號作為 history.id，INSERT OR IGNORE 使重複套用不會產生重複資料；
+        與套用進度在同一交易中寫入。失敗時拋出例外 (事件保留在日誌中重試)。
+        """
+        rows = [(seq, p.get('timestamp'), p.get('fish_code'), p.get('weight'), p.get('status'))
+                for seq, p in events]
+        with self.get_connection() as conn:
+            self.partitions.insert(conn, rows)
+            conn.execute('INSERT OR REPLACE INTO journal_state (id, applied_seq) VALUES (1, ?)',
+                         (events[-1][0],))
+        self.cache.bump('history')
+        self._notify_written(rows)
+
+    def log_data(self, data: dict) -> Optional[int]:
+        """寫入一筆歷史資料 (Time, FishCode, Weight, Status)，回傳 history.id"""
         try:
             # [修正] 使用 Python 的 datetime.now() 取得系統當前時間 (Local Time)
             # 這能避免 SQLite DEFAULT CURRENT_TIMESTAMP 使用 UTC 導致的時間差
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            if self.journal is not None:
+                # 先寫入日誌 (不受資料庫延遲影響)，序號即為 history.id
+                return self.journal.append({
+                    'timestamp': current_time,
+                    'fish_code': data.get('fish_code'),
+                    'weight': data.get('weight'),
+                    'status': data.get('status'),
+                })
             
-            with self.get_connection() as conn:
-                # 明確寫入 timestamp 欄位
-                conn.execute('INSERT INTO history (timestamp, fish_code, weight, status) VALUES (?, ?, ?, ?)',
-                           (current_time, data.get('fish_code'), data.get('weight'), data.get('status')))
+            with self._id_lock:
+                with self.get_connection() as conn:
+                    if self._next_id is None:
+                        self._next_id = self.partitions.max_id(conn) + 1
+                    row_id = self._next_id
+                    # 明確寫入 timestamp 欄位
+                    self.partitions.insert(conn, [(row_id, current_time, data.get('fish_code'),
+                                                   data.get('weight'), data.get('status'))], ignore=False)
+                self._next_id = row_id + 1
+            self.cache.bump('history')
+            self._notify_written([(row_id, current_time, data.get('fish_code'), data.get('weight'),
+                                   data.get('status'))])
             # logger.debug("Data logged successfully to DB")
+            return row_id
         except Exception as e: 
             logger.error(f"Log data failed: {e}")
+            return None
+
+    def _notify_written(self, rows: List[tuple]):
+        for listener in self.write_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.error(f"History write listener failed: {e}")
+
+    def is_past(self, end_time: Optional[str]) -> bool:
+        """
+        查詢範圍 (timestamp <= end_time) 是否已不會再變動，可永久快取：
+        結束時間早於 immutable_after 秒前，且日誌中沒有落在範圍內的未套用事件
+        (資料庫停滯或重啟後補套用的事件帶有原本較早的時間)。需在讀取資料之前判斷。
+        """
+        if not end_time:
+            return False
+        try:
+            end = datetime.strptime(end_time[:19], '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return False
+        if end >= datetime.now() - timedelta(seconds=self.immutable_after):
+            return False
+        if self.journal is not None:
+            oldest = self.journal.oldest_pending_timestamp()
+            if oldest is not None and oldest <= end_time:
+                return False
+        return True
+
+    @staticmethod
+    def normalize_history_query(start_time=None, end_time=None, fish_code=None, limit=1000,
+                                columnar: bool = False) -> tuple:
+        """正規化查詢參數 (同時作為快取鍵)"""
+        start_time = (start_time or '').replace('T', ' ').strip() or None
+        end_time = (end_time or '').replace('T', ' ').strip() or None
+        fish_code = (fish_code or '').strip() or None
+        return ('history', start_time, end_time, fish_code, int(limit), bool(columnar))
+
+    def history_plan(self, start_time=None, end_time=None, fish_code=None):
+        """
+        /api/history 的跨分區查詢計畫：只涵蓋查詢範圍內的月份，由新到舊；
+        搭配 run_plan(limit) 取滿筆數即停止，較舊的分區 (含封存檔) 不會被讀取。
+        """
+        q, p = self._history_where(start_time, end_time, fish_code)
+        return self.partitions.plan(HISTORY_COLUMNS, q, p, start_time, end_time,
+                                    order='timestamp DESC', descending=True, limit=True)
+
+    @staticmethod
+    def _history_where(start_time=None, end_time=None, fish_code=None):
+        q = '1=1'
+        p = []
+        if start_time: q += ' AND timestamp >= ?'; p.append(start_time)
+        if end_time: q += ' AND timestamp <= ?'; p.append(end_time)
+        if fish_code: q += ' AND fish_code = ?'; p.append(fish_code)
+        return q, p
+
+    def estimate_history_rows(self, start_time=None, end_time=None, fish_code=None, cap: int = 2000) -> int:
+        """
+        /api/history 查詢範圍內的筆數 (最多 cap)：線上分區以索引計數，累計達 cap 即停止；
+        範圍涉及封存檔 (需解壓) 時直接視為 cap。
+        """
+        q, p = self._history_where(start_time, end_time, fish_code)
+        plan = self.partitions.plan('1', q, p, start_time, end_time, limit=True)
+        if any(source is not None for source, _, _ in plan):
+            return cap
+        total = 0
+        with self.get_connection() as conn:
+            for _, sql, params in plan:
+                total += conn.execute(f'SELECT COUNT(*) FROM ({sql})', params + [cap - total]).fetchone()[0]
+                if total >= cap:
+                    break
+        return total
+
+    def get_history_result(self, start_time=None, end_time=None, fish_code=None, limit=1000,
+                           columnar: bool = False) -> CachedResult:
+        """columnar=True 時回傳欄位式 {"timestamp": [...], ...}，直接由 tuple 建立"""
+        key = self.normalize_history_query(start_time, end_time, fish_code, limit, columnar)
+
+        def load():
+            rows = list(run_plan(self.db_path, self.history_plan(*key[1:4]), key[4]))
+            if columnar:
+                return rows_to_columns(rows)
+            return [dict(zip(HISTORY_NAMES, r)) for r in rows]
+
+        return self.cache.get(key, ('history',), load, immutable=self.is_past(key[2]))
 
     def get_history_data(self, start_time=None, end_time=None, fish_code=None, limit=1000):
+        try:
+            return self.get_history_result(start_time, end_time, fish_code, limit).value
+        except Exception as e:
+            logger.error(f"Get history failed: {e}")
+            return []
+
+    def iter_events(self, since: str):
+        """依時間順序逐筆讀取 (timestamp, fish_code, weight)，供統計重建使用 (近期資料，只讀線上分區)"""
+        with self.get_connection() as conn:
+            conn.row_factory = None
+            cursor = conn.execute(
+                'SELECT timestamp, fish_code, weight FROM history WHERE timestamp >= ? ORDER BY timestamp ASC',
+                (since,))
+            for row in cursor:
+                yield row
+
+    def iter_weights(self, fish_code: str, start_time=None, end_time=None):
+        """逐筆讀取重量 (供 What-if 模擬載入為陣列；範圍可涵蓋封存分區)"""
+        q = 'fish_code = ? AND weight IS NOT NULL'
+        p = [fish_code]
+        if start_time: q += ' AND timestamp >= ?'; p.append(start_time)
+        if end_time: q += ' AND timestamp <= ?'; p.append(end_time)
+        for (weight,) in run_plan(self.db_path, self.partitions.plan('weight', q, p, start_time, end_time)):
+            yield weight
+
+    def filter_ids_by_fish_code(self, ids: List[int], fish_code: str) -> List[int]:
+        if not ids:
+            return []
         try:
             with self.get_connection() as conn:
-                q = 'SELECT * FROM history WHERE 1=1'
+                marks = ','.join('?' * len(ids))
+                rows = conn.execute(f'SELECT id FROM history WHERE fish_code = ? AND id IN ({marks})',
+                                    [fish_code, *ids]).fetchall()
+                found = {r['id'] for r in rows}
+                return [i for i in ids if i in found]
+        except Exception as e:
+            logger.error(f"Filter ids failed: {e}")
+            return []
+
+    def save_bucket_minutes(self, rows: List[tuple]):
+        """rows: [(minute, bucket, fish_code, count, total_weight, giveaway), ...]"""
+        try:
+            with self.get_connection() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO bucket_minute (minute, bucket, fish_code, count, total_weight, giveaway) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        except Exception as e:
+            logger.error(f"Save bucket minutes failed: {e}")
+
+    def get_bucket_minutes(self, start_time=None, end_time=None, bucket=None) -> List[Dict]:
+        try:
+            with self.get_connection() as conn:
+                q = 'SELECT * FROM bucket_minute WHERE 1=1'
                 p = []
-                if start_time: q += ' AND timestamp >= ?'; p.append(start_time)
-                if end_time: q += ' AND timestamp <= ?'; p.append(end_time)
-                if fish_code: q += ' AND fish_code = ?'; p.append(fish_code)
-                q += ' ORDER BY timestamp DESC LIMIT ?'; p.append(limit)
-                cursor = conn.execute(q, p)
-                return [dict(r) for r in cursor.fetchall()]
+                if start_time: q += ' AND minute >= ?'; p.append(start_time[:16])
+                if end_time: q += ' AND minute <= ?'; p.append(end_time[:16])
+                if bucket: q += ' AND bucket = ?'; p.append(bucket)
+                q += ' ORDER BY minute ASC, bucket ASC'
+                return [dict(r) for r in conn.execute(q, p).fetchall()]
         except Exception as e:
-            logger.error(f"Get history failed: {e}")
+            logger.error(f"Get bucket minutes failed: {e}")
             return []
 
-    def get_daily_stats(self):
+    def get_history_after(self, last_id: int, limit: int) -> List[Dict]:
+        """依 id 順序讀取 last_id 之後的歷史資料 (供匯出，只讀線上分區)"""
+        with self.get_connection() as conn:
+            rows = conn.execute('SELECT * FROM history WHERE id > ? ORDER BY id ASC LIMIT ?',
+                                (last_id, limit)).fetchall()
+            return [dict(r) for r in rows]
+
+    def get_bucket_minutes_after(self, after_minute: str, before_minute: str, limit: int) -> List[Dict]:
+        """讀取 (after_minute, before_minute) 之間的分規每分鐘彙總 (供匯出)"""
+        with self.get_connection() as conn:
+            rows = conn.execute('SELECT * FROM bucket_minute WHERE minute > ? AND minute < ? '
+                                'ORDER BY minute ASC, bucket ASC LIMIT ?',
+                                (after_minute, before_minute, limit)).fetchall()
+            return [dict(r) for r in rows]
+
+    def get_export_mark(self, stream: str) -> Optional[str]:
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT mark FROM export_state WHERE stream = ?', (stream,)).fetchone()
+            return row['mark'] if row else None
+
+    def set_export_mark(self, stream: str, mark: str):
+        with self.get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO export_state (stream, mark) VALUES (?, ?)', (stream, mark))
+
+    def transition_state(self, prev_id: Optional[int], ts: str, state: Optional[str] = None,
+                         fish_code=None, alarm_code=None, error_code=None) -> Optional[int]:
+        """結束前一個狀態區間並開啟新區間 (同一交易)；state 為 None 時只結束，回傳新區間 id"""
+        with self.get_connection() as conn:
+            if prev_id is not None:
+                conn.execute('UPDATE state_intervals SET end = ? WHERE id = ? AND end IS NULL', (ts, prev_id))
+            if state is None:
+                return None
+            cursor = conn.execute('INSERT INTO state_intervals (start, state, fish_code, alarm_code, error_code) '
+                                  'VALUES (?, ?, ?, ?, ?)', (ts, state, fish_code, alarm_code, error_code))
+            return cursor.lastrowid
+
+    def close_open_state_intervals(self, ts: str) -> int:
+        """啟動時結束上次未關閉的區間 (以最後檢查點時間為結束時間)"""
+        with self.get_connection() as conn:
+            return conn.execute('UPDATE state_intervals SET end = MAX(start, ?) WHERE end IS NULL', (ts,)).rowcount
+
+    def get_state_intervals(self, start_time=None, end_time=None, state=None, limit: int = 1000) -> List[Dict]:
+        try:
+            with self.get_connection() as conn:
+                q = 'SELECT * FROM state_intervals WHERE 1=1'
+                p = []
+                if start_time: q += ' AND (end IS NULL OR end >= ?)'; p.append(start_time)
+                if end_time: q += ' AND start <= ?'; p.append(end_time)
+                if state: q += ' AND state = ?'; p.append(state)
+                q += ' ORDER BY start DESC LIMIT ?'; p.append(limit)
+                return [dict(r) for r in conn.execute(q, p).fetchall()]
+        except Exception as e:
+            logger.error(f"Get state intervals failed: {e}")
+            return []
+
+    def save_oee_checkpoint(self, shift: str, rows: Dict[str, Dict], updated_at: str):
+        with self.get_connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO oee_checkpoint (shift, fish_code, data, updated_at) '
+                             'VALUES (?, ?, ?, ?)',
+                             [(shift, fish, json.dumps(data), updated_at) for fish, data in rows.items()])
+
+    def load_oee_checkpoint(self, shift: str):
+        """回傳 ({fish_code: data}, 最後更新時間)；該班別無資料時時間取所有檢查點中最新者"""
+        with self.get_connection() as conn:
+            rows = conn.execute('SELECT fish_code, data, updated_at FROM oee_checkpoint WHERE shift = ?',
+                                (shift,)).fetchall()
+            if not rows:
+                row = conn.execute('SELECT MAX(updated_at) FROM oee_checkpoint').fetchone()
+                return {}, row[0] if row else None
+            return ({r['fish_code']: json.loads(r['data']) for r in rows},
+                    max(r['updated_at'] for r in rows))
+
+    def shift_production(self, start_time: str, end_time: str):
+        """
+        班別範圍內各魚種的重量累計 (count / sum / sumsq / min / max) 與目前最大 history.id。
+        累計值可直接與遲到事件合併。
+        """
+        with self.get_connection() as conn:
+            # 同一讀取交易：累計值與 max_id 一致 (之後的遲到事件才不會重複計入)
+            conn.execute('BEGIN')
+            rows = conn.execute(
+                'SELECT fish_code, COUNT(weight), SUM(weight), SUM(weight * weight), MIN(weight), MAX(weight) '
+                'FROM history WHERE timestamp >= ? AND timestamp < ? AND weight IS NOT NULL GROUP BY fish_code',
+                (start_time, end_time)).fetchall()
+            max_id = self.partitions.max_id(conn)
+        return {(r[0] or 'UNKNOWN'): {"count": r[1], "sum": r[2], "sumsq": r[3], "min": r[4], "max": r[5]}
+                for r in rows}, max_id
+
+    def bucket_totals(self, start_minute: str, end_minute: str) -> List[Dict]:
+        """分規每分鐘彙總依 (魚種, 分規) 加總，end_minute 不含"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                'SELECT fish_code, bucket, SUM(count) AS count, SUM(total_weight) AS total_weight, '
+                'SUM(giveaway) AS giveaway FROM bucket_minute WHERE minute >= ? AND minute < ? '
+                'GROUP BY fish_code, bucket ORDER BY fish_code, bucket', (start_minute, end_minute)).fetchall()
+            return [dict(r) for r in rows]
+
+    def save_shift_report(self, shift: str, start: str, end: str, revision: int, max_id: int,
+                          data: bytes, acc: Dict):
+        with self.get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO shift_reports (shift, start, end, generated_at, revision, max_id, '
+                         'data, acc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (shift, start, end, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), revision, max_id,
+                          data.decode('utf-8'), json.dumps(acc)))
+        self.cache.bump('shift_reports')
+
+    def get_shift_report(self, shift: str) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT * FROM shift_reports WHERE shift = ?', (shift,)).fetchone()
+            return dict(row) if row else None
+
+    def list_shift_reports(self, limit: int = 30, before: Optional[str] = None) -> List[Dict]:
+        with self.get_connection() as conn:
+            q = 'SELECT shift, start, end, generated_at, revision FROM shift_reports'
+            p = []
+            if before: q += ' WHERE start < ?'; p.append(before)
+            q += ' ORDER BY start DESC LIMIT ?'; p.append(limit)
+            return [dict(r) for r in conn.execute(q, p).fetchall()]
+
+    def get_daily_stats_result(self) -> CachedResult:
         """
         統計「今日」各魚種的生產數量
         """
-        try:
-            today_start = datetime.now().strftime('%Y-%m-%d 00:00:00')
-            
+        today_start = datetime.now().strftime('%Y-%m-%d 00:00:00')
+
+        def load():
             with self.get_connection() as conn:
                 sql = '''
                     SELECT 
@@ -128,50 +531,68 @@ class Historian:
                     data.append(r['count'])
                 
                 return {"labels": labels, "data": data}
-                
+
+        return self.cache.get(('daily_stats', today_start), ('history', 'fish_type'), load)
+
+    def get_daily_stats(self):
+        try:
+            return self.get_daily_stats_result().value
         except Exception as e:
             logger.error(f"Get stats failed: {e}")
             return {"labels": [], "data": []}
 
-    def get_all_fish_types(self) -> List[Dict]:
-        try:
+    def get_fish_types_result(self) -> CachedResult:
+        def load():
             with self.get_connection() as conn:
                 rows = conn.execute('SELECT code, name FROM fish_type ORDER BY code ASC').fetchall()
                 return [dict(r) for r in rows]
+
+        return self.cache.get(('fish_types',), ('fish_type',), load)
+
+    def get_all_fish_types(self) -> List[Dict]:
+        try:
+            return self.get_fish_types_result().value
         except Exception: return []
 
     def upsert_fish_type(self, code: str, name: str) -> bool:
         try:
             with self.get_connection() as conn:
                 conn.execute('INSERT OR REPLACE INTO fish_type (code, name) VALUES (?, ?)', (code, name))
-                return True
+            self.cache.bump('fish_type')
+            return True
         except Exception: return False
 
     def delete_fish_type(self, code: str) -> bool:
         try:
             with self.get_connection() as conn:
                 conn.execute('DELETE FROM fish_type WHERE code = ?', (code,))
-                return True
+            self.cache.bump('fish_type')
+            return True
         except Exception: return False
 
-    def save_recipe(self, fish_code: str, params: dict) -> bool:
+    def save_recipe(self, fish_code: str, params: dict, version: int = 1) -> bool:
         try:
             json_str = json.dumps(params)
             with self.get_connection() as conn:
-                conn.execute('INSERT OR REPLACE INTO fish_recipes (fish_code, params) VALUES (?, ?)', 
-                           (fish_code, json_str))
-                return True
+                conn.execute('INSERT OR REPLACE INTO fish_recipes (fish_code, params, updated_at, version) '
+                             'VALUES (?, ?, ?, ?)',
+                             (fish_code, json_str, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), version))
+            return True
         except Exception as e:
             logger.error(f"Save recipe failed: {e}")
             return False
 
+    def load_recipes(self) -> List[tuple]:
+        """讀取全部配方 [(fish_code, params, version, updated_at), ...] (供 RecipeStore 啟動載入)"""
+        with self.get_connection() as conn:
+            rows = conn.execute('SELECT fish_code, params, version, updated_at FROM fish_recipes').fetchall()
+            return [(r['fish_code'], json.loads(r['params'] or '{}'), r['version'], r['updated_at']) for r in rows]
+
     def get_recipe(self, fish_code: str) -> Dict:
         try:
             with self.get_connection() as conn:
                 row = conn.execute('SELECT params FROM fish_recipes WHERE fish_code = ?', (fish_code,)).fetchone()
-                if row:
-                    return json.loads(row['params'])
-                return {}
+                return json.loads(row['params']) if row else {}
         except Exception as e:
             logger.error(f"Get recipe failed: {e}")
-            return {}
\ No newline at end of file
+            return {}
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional, Any, Tuple
+
+logger = logging.getLogger("journal")
+
+# 紀錄格式 (little-endian): payload 長度, 序號, crc32(序號 + payload)，之後為 JSON payload
+_HEADER = struct.Struct('<IQI')
+_SEQ = struct.Struct('<Q')
+_SEGMENT_EXT = '.jnl'
+
+
+def _crc(seq: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(_SEQ.pack(seq)))
+
+
+class EventJournal:
+    """
+    生產事件的 append-only 日誌 (store-and-forward)。
+
+    log_data 先寫入日誌檔並立即取得序號 (即 history.id)，不等待 SQLite；
+    背景執行緒批次 fsync，背景套用器再將事件批次寫入 SQLite (INSERT OR IGNORE，可重複套用)。
+    資料庫鎖定 / 磁碟忙碌時事件留在日誌中重試，重啟後未套用的事件會重新套用。
+    已全部套用的區段檔會被刪除。
+    """
+    def __init__(self, path: str, fsync_interval: float = 0.05, segment_max_bytes: int = 1024 * 1024,
+                 apply_interval: float = 0.5, apply_batch: int = 500):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.apply_interval = apply_interval
+        self.apply_batch = apply_batch
+
+        self.seq = 0
+        self.applied_seq = 0
+        self._pending: deque = deque()  # (seq, payload)
+        self._segment_last: Dict[int, int] = {}  # 區段編號 -> 最後序號
+        self._seg_no = 0
+        self._fd: Optional[int] = None
+        self._seg_size = 0
+
+        self._lock = threading.Lock()          # 檔案寫入 / fsync
+        # 待套用佇列、區段紀錄與套用進度 (迴圈端 append 與執行緒中的套用器共用)
+        self._state_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = False
+        self._fsync_thread: Optional[threading.Thread] = None
+        self.fsyncs = 0
+        self.apply_failures = 0
+
+    # --- 區段檔 ---
+    def _file(self, seg_no: int) -> str:
+        return os.path.join(self.path, f"{seg_no:06d}{_SEGMENT_EXT}")
+
+    def _segments(self) -> List[int]:
+        nums = []
+        for name in os.listdir(self.path):
+            if name.endswith(_SEGMENT_EXT):
+                try:
+                    nums.append(int(name[:-len(_SEGMENT_EXT)]))
+                except ValueError:
+                    pass
+        return sorted(nums)
+
+    def _scan(self, seg_no: int, last: bool) -> List[Tuple[int, dict]]:
+        """讀取區段內所有完整的紀錄；最後一個區段尾端不完整 (寫到一半當機) 時截斷"""
+        path = self._file(seg_no)
+        with open(path, 'rb') as f:
+            data = f.read()
+        entries = []
+        pos = 0
+        while pos + _HEADER.size <= len(data):
+            length, seq, crc = _HEADER.unpack_from(data, pos)
+            start = pos + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or _crc(seq, payload) != crc:
+                break
+            try:
+                entries.append((seq, json.loads(payload)))
+            except ValueError:
+                break
+            pos = start + length
+        if pos < len(data):
+            if last:
+                logger.warning(f"Journal {path}: truncating {len(data) - pos} bytes of torn tail")
+                with open(path, 'r+b') as f:
+                    f.truncate(pos)
+            else:
+                logger.error(f"Journal {path}: corrupt record at offset {pos}, rest of segment skipped")
+        return entries
+
+    def open(self, applied_seq: int = 0, min_seq: int = 0):
+        """
+        啟動時呼叫：掃描日誌，載入尚未套用 (序號 > applied_seq) 的事件。
+        min_seq 為資料庫中已存在的最大 ID，新序號一律大於此值。
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self.applied_seq = applied_seq
+        segments = self._segments()
+        last_seq = 0
+        for i, seg_no in enumerate(segments):
+            entries = self._scan(seg_no, last=(i == len(segments) - 1))
+            if entries:
+                self._segment_last[seg_no] = entries[-1][0]
+                last_seq = max(last_seq, entries[-1][0])
+            for seq, payload in entries:
+                if seq > applied_seq:
+                    self._pending.append((seq, payload))
+        self.seq = max(last_seq, applied_seq, min_seq)
+        self._seg_no = segments[-1] if segments else 1
+        self._open_segment()
+        with self._state_lock:
+            self._prune()
+
+        self._stop = False
+        self._fsync_thread = threading.Thread(target=self._fsync_loop, name="journal-fsync", daemon=True)
+        self._fsync_thread.start()
+        if self._pending:
+            logger.warning(f"Journal: {len(self._pending)} unapplied events to replay")
+        logger.info(f"Journal opened at {self.path} (seq {self.seq}, applied {self.applied_seq})")
+
+    def _open_segment(self):
+        self._fd = os.open(self._file(self._seg_no), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._seg_size = os.fstat(self._fd).st_size
+
+    def _rotate(self):
+        with self._lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._seg_no += 1
+            self._open_segment()
+
+    def _prune(self):
+        """刪除所有事件皆已套用的舊區段 (目前寫入中的區段除外)；需持有 _state_lock"""
+        for seg_no, last in list(self._segment_last.items()):
+            if seg_no != self._seg_no and last <= self.applied_seq:
+                try:
+                    os.remove(self._file(seg_no))
+                except OSError as e:
+                    logger.warning(f"Journal prune failed: {e}")
+                del self._segment_last[seg_no]
+
+    # --- 寫入 ---
+    def append(self, payload: Dict[str, Any]) -> int:
+        """寫入一筆事件並回傳序號 (只寫入 OS 快取，fsync 由背景執行緒批次進行)"""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        with self._state_lock:
+            if self._seg_size >= self.segment_max_bytes:
+                self._rotate()
+            self.seq += 1
+            seq = self.seq
+            record = _HEADER.pack(len(body), seq, _crc(seq, body)) + body
+            with self._lock:
+                os.write(self._fd, record)
+            self._seg_size += len(record)
+            self._segment_last[self._seg_no] = seq
+            self._pending.append((seq, payload))
+        self._dirty.set()
+        return seq
+
+    def _fsync_loop(self):
+        while not self._stop:
+            self._dirty.wait()
+            # 等待一小段時間，讓同一批寫入共用一次 fsync
+            time.sleep(self.fsync_interval)
+            self._dirty.clear()
+            try:
+                with self._lock:
+                    if self._fd is not None:
+                        os.fsync(self._fd)
+                self.fsyncs += 1
+            except OSError as e:
+                logger.error(f"Journal fsync failed: {e}")
+
+    # --- 套用到 SQLite ---
+    def apply_pending(self, historian) -> int:
+        """將一批待套用事件寫入 SQLite，成功時回傳筆數 (失敗則拋出例外，事件保留)"""
+        with self._state_lock:
+            batch = list(islice(self._pending, self.apply_batch))
+        if not batch:
+            return 0
+        # 寫入資料庫時不持有鎖 (append 不受資料庫延遲影響)；只有套用器會移除待套用事件
+        historian.apply_events(batch)
+        with self._state_lock:
+            for _ in batch:
+                self._pending.popleft()
+            self.applied_seq = batch[-1][0]
+            self._prune()
+        return len(batch)
+
+    def oldest_pending_timestamp(self) -> Optional[str]:
+        """最舊的未套用事件時間 (沒有待套用事件時為 None)"""
+        with self._state_lock:
+            return self._pending[0][1].get('timestamp') if self._pending else None
+
+    async def run_applier(self, historian):
+        """背景套用器：資料庫失敗時以指數退避重試，事件不會遺失"""
+        delay = self.apply_interval
+        while True:
+            await asyncio.sleep(delay)
+            if not self._pending:
+                continue
+            try:
+                # 在執行緒中寫入資料庫，避免阻塞輪詢迴圈 (只有套用器會移除待套用事件)
+                while self._pending:
+                    await asyncio.to_thread(self.apply_pending, historian)
+                delay = self.apply_interval
+            except Exception as e:
+                self.apply_failures += 1
+                delay = min(delay * 2, 10.0)
+                logger.error(f"Journal apply failed ({len(self._pending)} pending, retry in {delay:.1f}s): {e}")
+
+    def close(self):
+        self._stop = True
+        self._dirty.set()
+        if self._fsync_thread:
+            self._fsync_thread.join(timeout=1.0)
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "applied_seq": self.applied_seq, "pending": len(self._pending),
+                "fsyncs": self.fsyncs, "apply_failures": self.apply_failures}
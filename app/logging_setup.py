@@ -0,0 +1,162 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """一行一筆 JSON (ts / level / logger / msg，另含 suppressed、exc)"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    依呼叫位置 (logger + 檔案 + 行號) 限流：每個位置在 window 秒內最多輸出 burst 筆，其餘丟棄並計數；
+    下一個視窗的第一筆附上被略過的筆數 (record.suppressed)。
+    在呼叫端執行緒中過濾，被略過的紀錄不會進入佇列。
+    """
+    def __init__(self, burst: int = 10, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._sites: Dict[tuple, list] = {}     # (name, path, lineno) -> [window_start, emitted, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                self._sites[key] = [now, 1, 0]
+                return True
+            if now - site[0] >= self.window:
+                if site[2]:
+                    record.suppressed = site[2]
+                    record.msg = f"{record.msg} (suppressed {site[2]} similar in last {self.window:g}s)"
+                site[0], site[1], site[2] = now, 1, 0
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            self.suppressed_total += 1
+            return False
+
+    def top(self, n: int = 5):
+        with self._lock:
+            items = sorted(((k, v[2]) for k, v in self._sites.items() if v[2]), key=lambda x: -x[1])[:n]
+        return [{"site": f"{name} {os.path.basename(path)}:{line}", "suppressed": count}
+                for (name, path, line), count in items]
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """佇列滿時直接丟棄並計數 (記錄日誌永遠不阻塞事件迴圈)"""
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 訊息在呼叫端先合併 (args 可能不可序列化 / 之後被修改)；例外堆疊另存於 exc_text
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    非阻塞日誌：各執行緒 (含事件迴圈) 只把紀錄放入有上限的佇列，
+    由背景 QueueListener 執行緒寫入依大小輪替的檔案 (JSON lines) 與主控台。
+    檔案總大小上限約 max_bytes x (backup_count + 1)。
+    """
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.level = getattr(logging, str(cfg.get('level', 'INFO')).upper(), logging.INFO)
+        self.path = cfg.get('file', 'logs/app.log')
+        self.fmt = cfg.get('format', 'json')
+        self.max_bytes = int(float(cfg.get('max_bytes_mb', 5)) * 1024 * 1024)
+        self.backup_count = int(cfg.get('backup_count', 5))
+        self.console = cfg.get('console', True)
+        rate_cfg = cfg.get('rate_limit', {})
+        self.rate_filter = RateLimitFilter(int(rate_cfg.get('burst', 10)), float(rate_cfg.get('window', 60)))
+        self.queue: queue.Queue = queue.Queue(maxsize=int(cfg.get('queue_size', 10000)))
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.rate_filter)
+        self.listener: Optional[logging.handlers.QueueListener] = None
+
+    def start(self) -> 'LogPipeline':
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter() if self.fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+        handlers = [file_handler]
+        if self.console:
+            console = logging.StreamHandler()
+            console.setFormatter(logging.Formatter(TEXT_FORMAT))
+            handlers.append(console)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """送出佇列中剩餘的紀錄並關閉檔案"""
+        if self.listener is None:
+            return
+        listener, self.listener = self.listener, None
+        listener.stop()
+        for h in listener.handlers:
+            h.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_filter.suppressed_total,
+            "top_suppressed": self.rate_filter.top(),
+        }
+
+
+def setup_logging(cfg: Optional[Dict] = None) -> LogPipeline:
+    return LogPipeline(cfg).start()
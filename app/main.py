@@ -1,234 +1,591 @@
 import asyncio
+import json
 import logging
-import os
+import signal
 import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect, HTTPException
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-import yaml
-
-# ... (Logging設定) ...
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('logs/app.log')
-    ]
-)
+from functools import cached_property
+from typing import TYPE_CHECKING, Optional
+
+from .startup import StartupTimer
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
 logger = logging.getLogger(__name__)
 
-from .gateway import RealGateway
-from .historian import Historian
-from .ws_hub import WsHub
-from .write_controller import WriteController
+# 匯入本模組沒有副作用 (不讀設定、不建立元件、不載入 FastAPI / pymodbus)；
+# 由 create_app(config) 建立應用程式。uvicorn app.main:app 第一次取用 app 時才以 config.yaml 建立。
+CONFIG_PATH = "config/config.yaml"
 
-# 載入設定
-try:
-    with open("config/config.yaml", "r") as f:
-        config = yaml.safe_load(f)
-    logger.info("Configuration loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load configuration: {e}")
-    raise
-
-# 初始化元件
-ws_hub = WsHub()
-historian = Historian(config['database']['path'])
-
-# 強制使用真實模式 (Real Mode)
-logger.info("Starting in REAL mode - connecting to PLC")
-gateway = RealGateway(config, historian, ws_hub)
-write_controller = WriteController(gateway)
-
-# --- 資料模型定義 ---
-class FishTypeItem(BaseModel):
-    code: str
-    name: str
-
-class RecipeItem(BaseModel):
-    fish_code: str
-    params: dict 
-
-# --- FastAPI 生命周期 ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    import yaml
     try:
-        logger.info("Initializing database...")
-        historian.init_db()
-        logger.info("Starting gateway...")
-        asyncio.create_task(gateway.start())
-        logger.info("Application startup complete")
-        yield
+        with open(path, "r") as f:
+            return yaml.safe_load(f)
     except Exception as e:
-        logger.error(f"Startup error: {e}")
+        logger.error(f"Failed to load configuration: {e}")
         raise
-    finally:
-        logger.info("Shutting down gateway...")
-        await gateway.stop()
-        logger.info("Application shutdown complete")
 
-app = FastAPI(lifespan=lifespan)
 
-app.mount("/static", StaticFiles(directory="web/static"), name="static")
-templates = Jinja2Templates(directory="web/templates")
-templates.env.globals['v'] = "2.9.0"
+class Services:
+    """
+    應用程式的所有元件。建構時只建立物件 (不連線 PLC、不開啟資料庫)，
+    資料庫初始化、PLC 連線與背景工作在 lifespan 中啟動；模板與靜態檔雜湊在第一次使用時建立。
+    """
+    def __init__(self, config: dict, config_path: str = CONFIG_PATH, log_pipeline=None,
+                 timer: Optional[StartupTimer] = None):
+        from .gateway import RealGateway
+        from .historian import Historian
+        from .ws_hub import WsHub
+        from .write_controller import WriteController
+        from .recipe_store import RecipeStore
+        from .stats_engine import StatsEngine
+        from .analytics import AnalyticsPool
+        from .journal import EventJournal
+        from .exporter import Exporter
+        from .oee import OeeTracker
+        from .reports import ShiftReporter
+        from .watchdog import LoopWatchdog
+        from .config_reload import ConfigReloader
 
-# --- Page Routes ---
-@app.get("/")
-async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+        self.config = config
+        self.log_pipeline = log_pipeline
+        self.timer = timer or StartupTimer()
+        self.ws_hub = WsHub(delta_log_size=config.get('websocket', {}).get('delta_log_size', 2000))
+        journal_cfg = config['database'].get('journal', {})
+        self.journal = None
+        if journal_cfg.get('enabled', True):
+            self.journal = EventJournal(
+                journal_cfg.get('path', 'data/journal'),
+                fsync_interval=journal_cfg.get('fsync_interval', 0.05),
+                segment_max_bytes=int(journal_cfg.get('segment_max_mb', 1) * 1024 * 1024),
+                apply_interval=journal_cfg.get('apply_interval', 0.5),
+                apply_batch=journal_cfg.get('apply_batch', 500)
+            )
+        cache_cfg = config['database'].get('cache', {})
+        self.historian = Historian(
+            config['database']['path'],
+            journal=self.journal,
+            cache_size=cache_cfg.get('max_entries', 256),
+            immutable_after=cache_cfg.get('immutable_after', 300),
+            partitions=config['database'].get('partitions')
+        )
+        self.recipe_store = RecipeStore(self.historian)
+        self.stats_cfg = config.get('stats', {})
+        self.stats_engine = StatsEngine(
+            shifts=config.get('shifts'),
+            relative_accuracy=self.stats_cfg.get('relative_accuracy', 0.01)
+        )
 
-@app.get("/ui/categories")
-async def categories_page(request: Request):
-    return templates.TemplateResponse("categories.html", {"request": request})
+        # 強制使用真實模式 (Real Mode)
+        logger.info("Starting in REAL mode - connecting to PLC")
+        self.oee_tracker = OeeTracker(self.historian, shifts=config.get('shifts'), cfg=config.get('oee'))
+        self.gateway = RealGateway(config, self.historian, self.ws_hub,
+                                   stats_engine=self.stats_engine, oee=self.oee_tracker)
+        self.gateway.on_first_poll = self.timer.first_poll
+        self.reporter = ShiftReporter(self.historian, self.oee_tracker, shifts=config.get('shifts'),
+                                      cfg=config.get('reports'))
+        self.write_controller = WriteController(self.gateway)
+        self.analytics = AnalyticsPool(config.get('analytics'))
+        self.exporter = Exporter(self.historian, config.get('export'))
+        self.trend_cfg = config.get('trend', {})
+        self.watchdog = LoopWatchdog(config.get('watchdog'))
+        # 設定重新載入 (kill -HUP 或 POST /api/admin/config/reload)
+        self.config_reloader = ConfigReloader(config_path, config, self.gateway)
 
-@app.get("/ui/history")
-async def history_page(request: Request):
-    return templates.TemplateResponse("history.html", {"request": request})
+    @cached_property
+    def assets(self):
+        # 靜態檔：內容雜湊網址 + 預先壓縮，雜湊網址永久快取 (/static 保留給舊網址)
+        # build() 在 lifespan 中於背景執行緒進行；完成前 asset() 退回 /static 網址
+        from .assets import AssetPipeline
+        return AssetPipeline('web/static', cache_dir=self.config.get('assets', {}).get('cache_dir', 'data/assets'))
 
-@app.get("/ui/buckets")
-async def buckets_page(request: Request):
-    return templates.TemplateResponse("buckets.html", {"request": request})
+    @cached_property
+    def templates(self):
+        from fastapi.templating import Jinja2Templates
+        templates = Jinja2Templates(directory="web/templates")
+        templates.env.globals['v'] = "2.9.0"
+        templates.env.globals['asset'] = self.assets.url
+        templates.env.globals['asset_importmap'] = self.assets.importmap
+        return templates
 
-@app.get("/ui/system")
-async def system_page(request: Request):
-    return templates.TemplateResponse("system.html", {"request": request})
+    def prepare_storage(self):
+        """資料庫初始化與狀態還原 (同步；lifespan 中於執行緒執行，同時進行 PLC 連線)"""
+        logger.info("Initializing database...")
+        self.historian.init_db()
+        self.historian.open_journal()
+        self.historian.partitions.start()
+        self.recipe_store.load()
+        self.timer.mark("database")
+        logger.info("Rebuilding live statistics...")
+        self.stats_engine.rebuild(self.historian)
+        self.oee_tracker.restore()
+        self.timer.mark("restore")
 
-# --- Data API Routes ---
-@app.get("/api/status")
-async def get_system_status():
-    return gateway.get_snapshot()
 
-@app.get("/status")
-async def health_check():
-    try:
-        if not gateway.running:
-            raise HTTPException(status_code=503, detail="Gateway not running")
-        
-        if hasattr(gateway, 'last_update'):
-            time_since_update = time.time() - gateway.last_update
-            if time_since_update > 30:
-                raise HTTPException(status_code=503, detail="No recent data from PLC")
-        
-        return {
-            "status": "healthy",
-            "gateway_running": gateway.running,
-            "timestamp": time.time()
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        raise HTTPException(status_code=503, detail="System unhealthy")
-
-@app.get("/api/history/stats")
-async def get_daily_stats():
-    return historian.get_daily_stats()
-
-@app.get("/api/history")
-async def get_history(
-    start_time: str = None,
-    end_time: str = None,
-    fish_code: str = None,
-    limit: int = 1000
-):
-    if limit > 10000:
-        raise HTTPException(status_code=400, detail="Limit cannot exceed 10000")
-    
-    data = historian.get_history_data(
-        start_time=start_time,
-        end_time=end_time,
-        fish_code=fish_code,
-        limit=limit
-    )
-    return data
-
-# --- Fish Type Management ---
-@app.get("/api/fish-types")
-async def get_fish_types():
-    return historian.get_all_fish_types()
-
-@app.post("/api/fish-types")
-async def save_fish_type(item: FishTypeItem):
-    code = item.code.strip().upper()
-    name = item.name.strip()
-    
-    if not code or len(code) != 4 or not code.isalnum():
-        raise HTTPException(status_code=400, detail="Code must be exactly 4 alphanumeric characters")
-    if not name or len(name) > 100:
-        raise HTTPException(status_code=400, detail="Name must be between 1 and 100 characters")
-    
-    success = historian.upsert_fish_type(code, name)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to save to database")
-    return {"status": "ok", "code": code, "name": name}
-
-@app.delete("/api/fish-types/{code}")
-async def delete_fish_type(code: str):
-    if not code or len(code) > 10:
-        raise HTTPException(status_code=400, detail="Invalid code")
-    
-    success = historian.delete_fish_type(code)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to delete")
-    return {"status": "ok", "code": code}
-
-# --- Control APIs (寫入控制) ---
-
-@app.post("/api/control/category")
-async def set_category(data: dict):
-    code = data.get("code", "").strip().upper()
-    if not code or len(code) != 4 or not code.isalnum():
-        raise HTTPException(status_code=400, detail="Invalid code format")
-    
-    success = await write_controller.set_fish_type(code)
-    if not success:
-        raise HTTPException(status_code=503, detail="Failed to write to PLC (Check connection)")
-    return {"success": True, "code": code}
-
-@app.get("/api/recipes/{code}")
-async def get_recipe(code: str):
-    return historian.get_recipe(code)
-
-@app.post("/api/recipes")
-async def save_recipe(item: RecipeItem):
-    if not historian.save_recipe(item.fish_code, item.params):
-        raise HTTPException(status_code=500, detail="Failed to save recipe")
-    return {"status": "ok"}
-
-@app.post("/api/control/write-recipe")
-async def write_recipe_plc(item: RecipeItem):
-    if not item.params:
-        raise HTTPException(status_code=400, detail="No parameters to write")
-
-    success = await write_controller.write_recipe(item.params)
-    if not success:
-        raise HTTPException(status_code=503, detail="Failed to write recipe to PLC (Partial or Total Failure)")
-    return {"success": True}
-
-# --- WebSocket ---
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await ws_hub.connect(websocket)
-    
-    # 建立連線時發送初始快照
-    try:
-        current_data = gateway.get_snapshot()
-        if current_data:
-            await websocket.send_json(current_data)
-    except Exception as e:
-        logger.error(f"Error sending initial snapshot: {e}")
+def _lifespan(s: Services):
+    @asynccontextmanager
+    async def lifespan(app):
+        from .enum_loader import enum_loader
+        gateway, journal, watchdog = s.gateway, s.journal, s.watchdog
+        try:
+            watchdog_task = asyncio.create_task(s.watchdog.run(s.ws_hub)) if watchdog.enabled else None
+            # PLC 連線 (含重試) 與資料庫初始化同時進行，縮短第一次輪詢前的等待
+            connect_task = asyncio.create_task(gateway.client.connect())
+            try:
+                await asyncio.to_thread(s.prepare_storage)
+            except BaseException:
+                connect_task.cancel()
+                raise
+            journal_task = asyncio.create_task(journal.run_applier(s.historian)) if journal else None
+            enum_task = asyncio.create_task(enum_loader.run())
+            try:
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGHUP, lambda: asyncio.create_task(s.config_reloader.reload()))
+            except (NotImplementedError, AttributeError, RuntimeError):
+                pass  # Windows 無 SIGHUP / 非主執行緒 (例如 TestClient)，改用管理 API
+            logger.info("Starting gateway...")
+            asyncio.create_task(gateway.start(connect_task))
+            stats_task = asyncio.create_task(
+                s.stats_engine.run_publisher(s.ws_hub, s.stats_cfg.get('publish_interval', 5.0)))
+            export_task = asyncio.create_task(s.exporter.run()) if s.exporter.enabled else None
+            oee_task = asyncio.create_task(s.oee_tracker.run(s.ws_hub))
+            report_task = asyncio.create_task(s.reporter.run()) if s.reporter.enabled else None
+            assets_task = asyncio.create_task(asyncio.to_thread(s.assets.build))
+            s.timer.mark("lifespan")
+            logger.info("Application startup complete")
+            yield
+            stats_task.cancel()
+            oee_task.cancel()
+            assets_task.cancel()
+            enum_task.cancel()
+            if report_task:
+                report_task.cancel()
+            if watchdog_task:
+                watchdog_task.cancel()
+            if export_task:
+                export_task.cancel()
+            if journal_task:
+                journal_task.cancel()
+        except Exception as e:
+            logger.error(f"Startup error: {e}")
+            raise
+        finally:
+            logger.info("Shutting down gateway...")
+            await gateway.stop()
+            s.oee_tracker.close()
+            s.historian.partitions.stop()
+            s.analytics.shutdown()
+            if journal:
+                # 尚未套用的事件留在日誌中，下次啟動時套用
+                journal.close()
+            logger.info("Application shutdown complete")
+    return lifespan
 
-    try:
-        while True:
-            data = await websocket.receive_text()
-            if data == "ping":
-                await websocket.send_text("pong")
-    except WebSocketDisconnect:
-        ws_hub.disconnect(websocket)
-    except Exception as e:
-        logger.error(f"WebSocket error: {e}")
-        ws_hub.disconnect(websocket)
\ No newline at end of file
+
+def create_app(config: Optional[dict] = None, config_path: str = CONFIG_PATH) -> "FastAPI":
+    """建立應用程式；config 為 None 時讀取 config_path"""
+    from fastapi import FastAPI
+    from fastapi.staticfiles import StaticFiles
+    from .logging_setup import setup_logging
+
+    timer = StartupTimer()
+    timer.mark("import")
+    if config is None:
+        config = load_config(config_path)
+    # 日誌：事件迴圈只放入佇列，由背景執行緒寫入輪替檔案 (JSON lines)；重複訊息依呼叫位置限流
+    log_pipeline = setup_logging(config.get('logging'))
+    logger.info("Configuration loaded successfully")
+    timer.mark("config")
+
+    s = Services(config, config_path, log_pipeline, timer)
+    app = FastAPI(lifespan=_lifespan(s))
+    app.state.services = s
+    app.mount("/static", StaticFiles(directory="web/static"), name="static")
+    _register_routes(app, s)
+    timer.mark("create_app")
+    return app
+
+
+def __getattr__(name: str):
+    # uvicorn app.main:app：第一次取用時才建立 (之後即為一般模組屬性)
+    if name == "app":
+        application = globals()["app"] = create_app()
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _client_id(request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def _split_param(value: Optional[str]):
+    return [v.strip() for v in value.split(',') if v.strip()] if value else None
+
+
+def _register_routes(app: "FastAPI", s: Services):
+    from fastapi import WebSocket, Request, WebSocketDisconnect, HTTPException, Response
+    from .enum_loader import enum_loader
+    from .stats_engine import WINDOWS
+    from .analytics import AdmissionRejected, simulate_recipe as simulate_recipe_worker
+    from .schemas import FishTypeItem, RecipeItem, RecipeSimItem
+
+    gateway, historian, journal, ws_hub = s.gateway, s.historian, s.journal, s.ws_hub
+    recipe_store, stats_engine, oee_tracker = s.recipe_store, s.stats_engine, s.oee_tracker
+    reporter, write_controller, analytics, exporter = s.reporter, s.write_controller, s.analytics, s.exporter
+    watchdog, config_reloader, log_pipeline, trend_cfg = s.watchdog, s.config_reloader, s.log_pipeline, s.trend_cfg
+
+    @app.get("/assets/{path:path}")
+    async def get_asset(request: Request, path: str):
+        asset = s.assets.lookup(path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Asset not found")
+        # 雜湊網址內容永不變動；未帶雜湊的網址 (模組相對 import 的備援) 每次驗證
+        cache = "public, max-age=31536000, immutable" if path == asset.hashed else "no-cache"
+        headers = {"ETag": asset.etag, "Cache-Control": cache, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == asset.etag:
+            return Response(status_code=304, headers=headers)
+        encoding = s.assets.negotiate(asset, request.headers.get("accept-encoding", ""))
+        if encoding != 'identity':
+            headers["Content-Encoding"] = encoding
+        return Response(content=asset.variants[encoding], media_type=asset.content_type, headers=headers)
+
+    # --- Page Routes ---
+    @app.get("/")
+    async def index(request: Request):
+        return s.templates.TemplateResponse(request, "index.html")
+
+    @app.get("/ui/categories")
+    async def categories_page(request: Request):
+        return s.templates.TemplateResponse(request, "categories.html")
+
+    @app.get("/ui/history")
+    async def history_page(request: Request):
+        return s.templates.TemplateResponse(request, "history.html")
+
+    @app.get("/ui/buckets")
+    async def buckets_page(request: Request):
+        return s.templates.TemplateResponse(request, "buckets.html")
+
+    @app.get("/ui/system")
+    async def system_page(request: Request):
+        return s.templates.TemplateResponse(request, "system.html")
+
+    # --- Data API Routes ---
+    def _cached_response(request: Request, result) -> Response:
+        """快取的查詢結果：If-None-Match 相同時回傳 304，否則直接送出已序列化的內容"""
+        headers = {"ETag": result.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == result.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=result.body, media_type="application/json", headers=headers)
+
+
+    @app.get("/api/status")
+    async def get_system_status():
+        return gateway.get_snapshot()
+
+    @app.get("/status")
+    async def health_check():
+        try:
+            if not gateway.running:
+                raise HTTPException(status_code=503, detail="Gateway not running")
+
+            if hasattr(gateway, 'last_update'):
+                time_since_update = time.time() - gateway.last_update
+                if time_since_update > 30:
+                    raise HTTPException(status_code=503, detail="No recent data from PLC")
+
+            return {
+                "status": "healthy",
+                "gateway_running": gateway.running,
+                "publish": gateway.publish_filter.stats(),
+                "journal": journal.stats() if journal else None,
+                "export": exporter.stats() if exporter.enabled else None,
+                "query_cache": historian.cache.stats(),
+                "partitions": historian.partitions.stats(),
+                "reports": reporter.stats(),
+                "logging": log_pipeline.stats(),
+                "loop": watchdog.summary(),
+                "config": config_reloader.stats(),
+                "analytics": analytics.stats(),
+                "startup": s.timer.stats(),
+                "timestamp": time.time()
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+            raise HTTPException(status_code=503, detail="System unhealthy")
+
+    @app.get("/enums")
+    async def get_enums(request: Request):
+        # 全部 enum 合併回應；JSON 檔變動時版本號與 ETag 隨之更新
+        return _cached_response(request, enum_loader.result())
+
+    @app.get("/api/oee")
+    async def get_oee(shift: Optional[str] = None):
+        """目前班別 (或指定班別，例如 2026-10-19_A) 的稼動率 / 效率 / 良率 / OEE"""
+        if not shift:
+            return oee_tracker.snapshot()
+        result = oee_tracker.get_shift(shift)
+        if result is None:
+            raise HTTPException(status_code=404, detail="No OEE data for this shift")
+        return result
+
+    @app.get("/api/oee/intervals")
+    async def get_state_intervals(start_time: Optional[str] = None, end_time: Optional[str] = None,
+                                  state: Optional[str] = None, limit: int = 1000):
+        return historian.get_state_intervals(start_time, end_time, state, limit)
+
+    @app.post("/api/admin/config/reload")
+    async def reload_config(dry_run: bool = False):
+        """重新載入 config.yaml：回傳差異、已套用 / 需重啟的設定；驗證失敗時維持目前設定 (400)"""
+        result = await config_reloader.reload(dry_run)
+        if not result['ok']:
+            raise HTTPException(status_code=400, detail=result)
+        return result
+
+    @app.get("/api/admin/loop")
+    async def get_loop_watchdog(stacks: bool = True):
+        """事件迴圈延遲直方圖與最嚴重的卡住紀錄 (含當時迴圈執行緒的堆疊與 task 名稱)"""
+        return watchdog.report(stacks)
+
+    @app.get("/api/reports")
+    async def list_shift_reports(limit: int = 30, before: Optional[str] = None):
+        """已產生的班別報表 (新到舊)；before 為開始時間上限，用於分頁"""
+        return historian.list_shift_reports(min(max(limit, 1), 500), before)
+
+    @app.get("/api/reports/{shift}")
+    async def get_shift_report(shift: str, request: Request, format: str = "json", table: str = "production"):
+        """班別報表：json 直接回傳已儲存的內容；csv 輸出指定表格 (production / buckets / downtime / alarms)"""
+        if format == "csv":
+            try:
+                body = reporter.to_csv(shift, table)
+            except KeyError:
+                raise HTTPException(status_code=400, detail=f"Unknown table: {table}")
+            if body is None:
+                raise HTTPException(status_code=404, detail="Report not found")
+            return Response(content=body, media_type="text/csv; charset=utf-8",
+                            headers={"Content-Disposition": f'attachment; filename="{shift}_{table}.csv"'})
+        result = reporter.result(shift)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Report not found")
+        return _cached_response(request, result)
+
+    @app.post("/api/reports/{shift}/rebuild")
+    async def rebuild_shift_report(shift: str):
+        if reporter.bounds(shift) is None:
+            raise HTTPException(status_code=400, detail="Invalid shift key")
+        report = await asyncio.to_thread(reporter.build, shift)
+        return {"shift": shift, "revision": report['revision']}
+
+    @app.get("/api/history/stats")
+    async def get_daily_stats(request: Request):
+        try:
+            return _cached_response(request, historian.get_daily_stats_result())
+        except Exception as e:
+            logger.error(f"Get stats failed: {e}")
+            return {"labels": [], "data": []}
+
+    @app.get("/api/stats/live")
+    async def get_live_stats(window: str = None):
+        if window is None:
+            return stats_engine.snapshot_all()
+        if window not in WINDOWS:
+            raise HTTPException(status_code=400, detail=f"window must be one of {', '.join(WINDOWS)}")
+        return stats_engine.snapshot(window)
+
+    @app.get("/api/trend")
+    async def get_trend(tags: str = None, minutes: float = None, points: int = None):
+        tag_list = [t.strip() for t in tags.split(',') if t.strip()] if tags else None
+        if points is None:
+            points = trend_cfg.get('max_points', 600)
+        seconds = minutes * 60 if minutes else None
+        return gateway.trend.snapshot(tags=tag_list, seconds=seconds, points=points or None)
+
+    @app.get("/api/buckets/live")
+    async def get_bucket_live():
+        return gateway.bucket_monitor.snapshot()
+
+    @app.get("/api/buckets/minutes")
+    async def get_bucket_minutes(start_time: str = None, end_time: str = None, bucket: int = None):
+        return historian.get_bucket_minutes(start_time=start_time, end_time=end_time, bucket=bucket)
+
+    @app.get("/api/history")
+    async def get_history(
+        request: Request,
+        start_time: str = None,
+        end_time: str = None,
+        fish_code: str = None,
+        limit: int = 1000,
+        format: str = None
+    ):
+        if limit > 10000:
+            raise HTTPException(status_code=400, detail="Limit cannot exceed 10000")
+        if format not in (None, 'rows', 'columnar'):
+            raise HTTPException(status_code=400, detail="format must be 'rows' or 'columnar'")
+
+        try:
+            # 筆數較多的查詢在分析行程池中執行 (不影響輪詢迴圈)
+            result = await analytics.history(
+                _client_id(request), historian,
+                start_time=start_time,
+                end_time=end_time,
+                fish_code=fish_code,
+                limit=limit,
+                columnar=(format == 'columnar')
+            )
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        except Exception as e:
+            logger.error(f"Get history failed: {e}")
+            return []
+        return _cached_response(request, result)
+
+    # --- Waveform Capture ---
+    @app.get("/api/waveforms/overlay")
+    async def get_waveform_overlay(n: int = 20, fish_code: str = None):
+        if n < 1 or n > 200:
+            raise HTTPException(status_code=400, detail="n must be between 1 and 200")
+        store = gateway.waveforms.store
+        if fish_code:
+            ids = historian.filter_ids_by_fish_code(store.latest_ids(n * 10), fish_code)[:n]
+        else:
+            ids = store.latest_ids(n)
+        waves = [w for w in (store.get(i) for i in ids) if w]
+        return {"capture": gateway.waveforms.stats(), "waveforms": waves}
+
+    @app.get("/api/waveforms/{history_id}")
+    async def get_waveform(history_id: int):
+        wave = gateway.waveforms.store.get(history_id)
+        if not wave:
+            raise HTTPException(status_code=404, detail="No waveform captured for this event")
+        return wave
+
+    # --- Fish Type Management ---
+    @app.get("/api/fish-types")
+    async def get_fish_types(request: Request):
+        try:
+            return _cached_response(request, historian.get_fish_types_result())
+        except Exception:
+            return []
+
+    @app.post("/api/fish-types")
+    async def save_fish_type(item: FishTypeItem):
+        code = item.code.strip().upper()
+        name = item.name.strip()
+
+        if not code or len(code) != 4 or not code.isalnum():
+            raise HTTPException(status_code=400, detail="Code must be exactly 4 alphanumeric characters")
+        if not name or len(name) > 100:
+            raise HTTPException(status_code=400, detail="Name must be between 1 and 100 characters")
+
+        success = historian.upsert_fish_type(code, name)
+        if not success:
+            raise HTTPException(status_code=500, detail="Failed to save to database")
+        return {"status": "ok", "code": code, "name": name}
+
+    @app.delete("/api/fish-types/{code}")
+    async def delete_fish_type(code: str):
+        if not code or len(code) > 10:
+            raise HTTPException(status_code=400, detail="Invalid code")
+
+        success = historian.delete_fish_type(code)
+        if not success:
+            raise HTTPException(status_code=500, detail="Failed to delete")
+        return {"status": "ok", "code": code}
+
+    # --- Control APIs (寫入控制) ---
+
+    @app.post("/api/control/category")
+    async def set_category(data: dict):
+        code = data.get("code", "").strip().upper()
+        if not code or len(code) != 4 or not code.isalnum():
+            raise HTTPException(status_code=400, detail="Invalid code format")
+
+        success = await write_controller.set_fish_type(code)
+        if not success:
+            raise HTTPException(status_code=503, detail="Failed to write to PLC (Check connection)")
+        return {"success": True, "code": code}
+
+    @app.get("/api/recipes/{code}")
+    async def get_recipe(request: Request, code: str):
+        try:
+            return _cached_response(request, recipe_store.get_result(code))
+        except Exception as e:
+            logger.error(f"Get recipe failed: {e}")
+            return {}
+
+    @app.post("/api/recipes")
+    async def save_recipe(item: RecipeItem):
+        version = recipe_store.save(item.fish_code, item.params)
+        if version is None:
+            raise HTTPException(status_code=500, detail="Failed to save recipe")
+        return {"status": "ok", "version": version}
+
+    @app.post("/api/recipes/simulate")
+    async def simulate_recipe(request: Request, item: RecipeSimItem):
+        if not item.params:
+            raise HTTPException(status_code=400, detail="No parameters to simulate")
+        try:
+            return await analytics.run(_client_id(request), simulate_recipe_worker, historian.db_path,
+                                       item.fish_code, item.params, item.start_time, item.end_time)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+    @app.post("/api/control/write-recipe")
+    async def write_recipe_plc(item: RecipeItem):
+        if not item.params:
+            raise HTTPException(status_code=400, detail="No parameters to write")
+
+        # 只寫入與 PLC 目前值不同的欄位，並讀回逐欄位驗證
+        report = await write_controller.download_recipe(item.params)
+        if report is None:
+            raise HTTPException(status_code=503, detail="Failed to write recipe to PLC (Check connection)")
+        report["fish_code"] = item.fish_code
+        report["version"] = recipe_store.version(item.fish_code)
+        return report
+
+    # --- WebSocket ---
+    def _send_initial(client, epoch=None, since=None):
+        # 同步 Tag 狀態：可補送則只送遺漏的差異，否則送完整快照
+        ws_hub.sync_client(client, gateway.get_snapshot(), epoch=epoch, since=since)
+        # 近期趨勢 (記憶體緩衝區)，圖表不必再查詢資料庫
+        if client.wants_topic('trend'):
+            trend = gateway.trend.snapshot(
+                tags=trend_cfg.get('connect_tags', ['weight']),
+                points=trend_cfg.get('max_points', 600))
+            ws_hub.send(client, {"type": "trend", "data": trend})
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket, epoch: str = None, since: int = None,
+                                 topics: str = None, tags: str = None, enc: str = None):
+        client = await ws_hub.connect(websocket, encoding=enc)
+        ws_hub.subscribe(client, _split_param(topics), _split_param(tags))
+
+        try:
+            _send_initial(client, epoch=epoch, since=since)
+        except Exception as e:
+            logger.error(f"Error sending initial snapshot: {e}")
+
+        try:
+            while True:
+                data = await websocket.receive_text()
+                if data == "ping":
+                    # 經由佇列送出，與寫入工作的其他訊息保持順序、不同時寫入
+                    ws_hub.send(client, "pong")
+                    continue
+                # 執行中變更訂閱: {"type": "subscribe", "topics": [...], "tags": [...]}
+                try:
+                    msg = json.loads(data)
+                except ValueError:
+                    continue
+                if isinstance(msg, dict) and msg.get('type') == 'subscribe':
+                    ws_hub.subscribe(client, msg.get('topics'), msg.get('tags'))
+                    _send_initial(client)
+        except WebSocketDisconnect:
+            ws_hub.disconnect(websocket)
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}")
+            ws_hub.disconnect(websocket)
@@ -138,4 +138,22 @@ class ModbusClient:
         except Exception as e:
             logger.error(f"Write Exception at address {address}: {e}")
             self.connected = False
-            return False
\ No newline at end of file
+            return False
+
+    async def write_registers(self, address: int, values: list):
+        """連續寫入多個暫存器 (FC16，一次請求) with error handling"""
+        if not self.connected:
+            logger.warning("Cannot write: not connected to PLC")
+            return False
+        try:
+            rr = await self._execute_command(self.client.write_registers, address, values=list(values))
+
+            if rr.isError():
+                logger.error(f"Modbus Write Error at {address} (x{len(values)}): {rr}")
+                return False
+            logger.info(f"Successfully wrote {len(values)} registers at {address}")
+            return True
+        except Exception as e:
+            logger.error(f"Write Exception at address {address}: {e}")
+            self.connected = False
+            return False
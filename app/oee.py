@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .shifts import normalize_shifts, shift_at, shift_key
+
+logger = logging.getLogger("oee")
+
+STATE_RUN = 'RUN'
+STATE_UNKNOWN = 'UNKNOWN'
+
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class OeeCounter:
+    """單一 (班別, 魚種) 的累計值：各狀態秒數、生產數、良品數"""
+    __slots__ = ('seconds', 'count', 'good')
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.count = 0
+        self.good = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"seconds": self.seconds, "count": self.count, "good": self.good}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'OeeCounter':
+        c = cls()
+        c.seconds = {k: float(v) for k, v in (data.get('seconds') or {}).items()}
+        c.count = int(data.get('count', 0))
+        c.good = int(data.get('good', 0))
+        return c
+
+
+def oee_metrics(seconds: Dict[str, float], count: int, good: int, ideal_seconds: float,
+                planned_stop_states) -> Dict[str, Any]:
+    """
+    Availability = 運轉時間 / 計畫生產時間 (總時間扣除計畫停機)
+    Performance  = 理想週期時間 × 生產數 / 運轉時間
+    Quality      = 良品數 (落入任一分規) / 生產數
+    """
+    total = sum(seconds.values())
+    planned = total - sum(seconds.get(s, 0.0) for s in planned_stop_states)
+    run = seconds.get(STATE_RUN, 0.0)
+    availability = run / planned if planned > 0 else None
+    performance = ideal_seconds / run if run > 0 else None
+    quality = good / count if count else None
+    oee = availability * performance * quality \
+        if None not in (availability, performance, quality) else None
+
+    def r(x):
+        return round(x, 4) if x is not None else None
+
+    return {
+        "availability": r(availability), "performance": r(performance), "quality": r(quality), "oee": r(oee),
+        "run_seconds": round(run, 1), "planned_seconds": round(planned, 1),
+        "downtime_seconds": round(planned - run, 1),
+        "states": {k: round(v, 1) for k, v in seconds.items()},
+        "count": count, "good": good,
+    }
+
+
+class OeeTracker:
+    """
+    機台狀態日誌 + 增量 OEE。
+
+    - 每次 status / 魚種 / 警報碼 / 錯誤碼變動即結束前一個狀態區間並開啟新區間 (state_intervals)
+    - 各狀態時間、生產數、良品數依 (班別, 魚種) 在記憶體中累加，查詢不需掃描歷史
+    - 定期將目前班別的累計值寫入 oee_checkpoint，重啟後由檢查點接續；過去班別直接讀取檢查點
+    """
+    def __init__(self, historian, shifts: Optional[List[Dict]] = None, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.historian = historian
+        self.shifts = normalize_shifts(shifts)
+        self.ideal_rate = float(cfg.get('ideal_rate', 120))           # 隻 / 分鐘
+        self.ideal_rates = {str(k): float(v) for k, v in (cfg.get('ideal_rates') or {}).items()}
+        self.planned_stop_states = tuple(cfg.get('planned_stop_states', ['STOP']))
+        self.checkpoint_interval = float(cfg.get('checkpoint_interval', 30))
+        self.publish_interval = float(cfg.get('publish_interval', 5))
+
+        self._shift_key: Optional[str] = None
+        self._shift_start = 0.0
+        self._shift_end = 0.0
+        self._counters: Dict[str, OeeCounter] = {}
+
+        # 目前狀態區間
+        self._current: Optional[tuple] = None      # (state, fish_code, alarm_code, error_code)
+        self._since: Optional[float] = None        # 已累加到的時間點
+        self._interval_start: Optional[float] = None
+        self._interval_id: Optional[int] = None
+
+    # --- 班別 ---
+    def _enter_shift(self, ts: float):
+        name, start, end = shift_at(datetime.fromtimestamp(ts), self.shifts)
+        self._shift_key = shift_key(name, start)
+        self._shift_start = start.timestamp()
+        self._shift_end = end.timestamp()
+        self._counters = {}
+
+    def _counter(self, fish_code: Optional[str]) -> OeeCounter:
+        key = fish_code or '----'
+        c = self._counters.get(key)
+        if c is None:
+            c = self._counters[key] = OeeCounter()
+        return c
+
+    def _advance(self, now: float):
+        """把 [since, now) 的時間累加到目前狀態；跨班別時在班別交界切開並寫入前一班檢查點"""
+        if self._shift_key is None:
+            self._enter_shift(now)
+        while True:
+            if self._since is not None and self._current is not None:
+                seg_end = min(now, self._shift_end)
+                if seg_end > self._since:
+                    state, fish_code = self._current[0], self._current[1]
+                    c = self._counter(fish_code)
+                    c.seconds[state] = c.seconds.get(state, 0.0) + (seg_end - self._since)
+                    self._since = seg_end
+            if now < self._shift_end:
+                return
+            boundary = self._shift_end
+            self.checkpoint(boundary)
+            self._enter_shift(boundary)
+            if self._since is not None:
+                self._since = boundary
+
+    # --- 輸入 ---
+    def restore(self):
+        """
+        啟動時：結束上次未關閉的狀態區間，並由檢查點載入目前班別的累計值。
+        停機期間 (最後檢查點 ~ 現在) 記為 UNKNOWN 區間，落在目前班別內的部分計入累計值；
+        第一次輪詢時由 update() 結束此區間。
+        """
+        now = time.time()
+        self._enter_shift(now)
+        try:
+            rows, updated_at = self.historian.load_oee_checkpoint(self._shift_key)
+            self._counters = {fish: OeeCounter.from_dict(data) for fish, data in rows.items()}
+            latest = self.historian.get_state_intervals(limit=1)
+            closed = self.historian.close_open_state_intervals(updated_at or _fmt(now))
+            outage = 0.0
+            if updated_at:
+                # 檢查點之後若還有狀態變動，未知區間從最後一個區間開始時算起 (不重疊)
+                since = max(updated_at, latest[0]['start']) if latest else updated_at
+                fish_code = latest[0]['fish_code'] if latest else None
+                self._interval_id = self.historian.transition_state(None, since, STATE_UNKNOWN, fish_code)
+                self._current = (STATE_UNKNOWN, fish_code, None, None)
+                self._interval_start = datetime.strptime(since, '%Y-%m-%d %H:%M:%S').timestamp()
+                self._since = min(max(self._interval_start, self._shift_start), now)
+                outage = now - self._since
+                self._advance(now)
+            if rows or closed:
+                logger.info(f"OEE restored for shift {self._shift_key} ({len(rows)} fish codes, "
+                            f"{closed} open intervals closed, {outage:.0f} s outage as {STATE_UNKNOWN})")
+        except Exception as e:
+            logger.error(f"OEE restore failed: {e}")
+
+    def update(self, tags: Dict[str, Any], now: Optional[float] = None):
+        """每次輪詢呼叫 (只有變動時才寫入資料庫)"""
+        state = tags.get('status')
+        if state is None:
+            return
+        now = now or time.time()
+        self._advance(now)
+        current = (state, tags.get('fish_code'), tags.get('alarm_code'), tags.get('error_code'))
+        if current == self._current:
+            return
+        ts = _fmt(now)
+        try:
+            self._interval_id = self.historian.transition_state(self._interval_id, ts, *current)
+        except Exception as e:
+            logger.error(f"State interval write failed: {e}")
+            self._interval_id = None
+        if self._current is None or current[0] != self._current[0]:
+            logger.info(f"Machine state: {self._current[0] if self._current else '-'} -> {state}"
+                        + (f" ({current[2]})" if current[2] not in (None, 'NO_ALARM') else ''))
+        self._current = current
+        self._since = now
+        self._interval_start = now
+
+    def mark_offline(self, now: Optional[float] = None):
+        """PLC 斷線：狀態視為 UNKNOWN (計入非計畫停機)"""
+        fish_code = self._current[1] if self._current else None
+        self.update({'status': STATE_UNKNOWN, 'fish_code': fish_code}, now)
+
+    def record_piece(self, fish_code: Optional[str], good: bool, now: Optional[float] = None):
+        self._advance(now or time.time())
+        c = self._counter(fish_code)
+        c.count += 1
+        if good:
+            c.good += 1
+
+    def close(self):
+        """正常關閉：累加到目前為止、結束狀態區間並寫入檢查點"""
+        now = time.time()
+        self._advance(now)
+        try:
+            if self._interval_id is not None:
+                self.historian.transition_state(self._interval_id, _fmt(now), None)
+        except Exception as e:
+            logger.error(f"State interval close failed: {e}")
+        self.checkpoint(now)
+
+    # --- 輸出 ---
+    def _ideal_seconds(self, fish_code: str, count: int) -> float:
+        rate = self.ideal_rates.get(fish_code, self.ideal_rate)
+        return count * 60.0 / rate if rate > 0 else 0.0
+
+    def _summarize(self, counters: Dict[str, OeeCounter]) -> Dict[str, Any]:
+        fish, total_seconds = {}, {}
+        total_count = total_good = 0
+        ideal_total = 0.0
+        for code, c in counters.items():
+            ideal = self._ideal_seconds(code, c.count)
+            fish[code] = oee_metrics(c.seconds, c.count, c.good, ideal, self.planned_stop_states)
+            for state, sec in c.seconds.items():
+                total_seconds[state] = total_seconds.get(state, 0.0) + sec
+            total_count += c.count
+            total_good += c.good
+            ideal_total += ideal
+        total = oee_metrics(total_seconds, total_count, total_good, ideal_total, self.planned_stop_states)
+        return {"total": total, "fish": fish}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """目前班別的 OEE (記憶體累計值，O(魚種數))"""
+        now = time.time()
+        self._advance(now)
+        result = {
+            "shift": self._shift_key,
+            "start": _fmt(self._shift_start),
+            "end": _fmt(self._shift_end),
+            "state": self._current[0] if self._current else None,
+            "alarm_code": self._current[2] if self._current else None,
+            "error_code": self._current[3] if self._current else None,
+            "state_since": _fmt(self._interval_start) if self._interval_start else None,
+        }
+        result.update(self._summarize(self._counters))
+        return result
+
+    def get_shift(self, key: str) -> Optional[Dict[str, Any]]:
+        """指定班別：目前班別取記憶體，過去班別取檢查點"""
+        if key == self._shift_key:
+            return self.snapshot()
+        rows, updated_at = self.historian.load_oee_checkpoint(key)
+        if not rows:
+            return None
+        result = {"shift": key, "updated_at": updated_at}
+        result.update(self._summarize({fish: OeeCounter.from_dict(d) for fish, d in rows.items()}))
+        return result
+
+    def checkpoint(self, now: Optional[float] = None):
+        if self._shift_key is None:
+            return
+        try:
+            self.historian.save_oee_checkpoint(
+                self._shift_key, {fish: c.to_dict() for fish, c in self._counters.items()}, _fmt(now or time.time()))
+        except Exception as e:
+            logger.error(f"OEE checkpoint failed: {e}")
+
+    async def run(self, ws_hub):
+        """定期推播 OEE 到 WebSocket 並寫入檢查點"""
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            try:
+                if ws_hub.clients:
+                    ws_hub.broadcast({"type": "oee", "data": self.snapshot()})
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    self._advance(time.time())
+                    self.checkpoint()
+                    last_checkpoint = time.monotonic()
+            except Exception as e:
+                logger.error(f"OEE publish failed: {e}")
@@ -2,12 +2,16 @@ import struct
 import logging
 from typing import List, Dict, Any
 
+from .enum_loader import enum_loader
+
 # 設定 Logger
 logger = logging.getLogger("parser")
 
 class TagParser:
-    def __init__(self, addr_map: dict):
+    def __init__(self, addr_map: dict, enums=None):
         self.map = addr_map
+        # 狀態 / 警報 / 錯誤碼解碼使用 config/enums/*.json 預先編譯的查表 (檔案變動時自動更新)
+        self.enums = enums or enum_loader
 
     def parse_block(self, registers: List[int], start_address: int) -> Dict[str, Any]:
         data = {}
@@ -54,9 +58,18 @@ class TagParser:
             if 'status' in self.map:
                 idx = get_idx(self.map['status'])
                 if 0 <= idx < len(registers):
-                    val = registers[idx]
-                    status_map = {1: 'RUN', 2: 'IDLE', 3: 'ALARM', 4: 'STOP'}
-                    data['status'] = status_map.get(val, 'UNKNOWN')
+                    data['status'] = self.enums.table('machine_status').code(registers[idx])
+
+            # 選用：警報碼 / 錯誤碼 (Word)
+            if 'alarm_code' in self.map:
+                idx = get_idx(self.map['alarm_code'])
+                if 0 <= idx < len(registers):
+                    data['alarm_code'] = self.enums.table('machine_alarm').code(registers[idx])
+
+            if 'error_code' in self.map:
+                idx = get_idx(self.map['error_code'])
+                if 0 <= idx < len(registers):
+                    data['error_code'] = self.enums.table('machine_error').code(registers[idx])
 
             # [新增] 2. 分規設定值讀取 (加強除錯)
             if 'bucket_settings_start' in self.map:
@@ -90,6 +103,16 @@ class TagParser:
                     b_min = parse_dword(addr)
                     if b_min is not None: data[f'cfg_b{i}_min'] = b_min
 
+            # [新增] 4. 分規統計區塊 (每個分規: 累計重量 Dword + 累計數量 Dword)
+            if 'bucket_data_start' in self.map:
+                base_stats = self.map['bucket_data_start'] # 40015
+                for i in range(1, 8):
+                    addr = base_stats + (i-1)*4
+                    total = parse_dword(addr)
+                    count = parse_dword(addr + 2)
+                    if total is not None: data[f'bkt_b{i}_total'] = total
+                    if count is not None: data[f'bkt_b{i}_count'] = count
+
         except Exception as e:
             logger.error(f"Parser Error: {e}", exc_info=True)
             pass
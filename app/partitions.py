@@ -0,0 +1,477 @@
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("partitions")
+
+# 每月一個分區資料表 history_YYYYMM，主資料庫中的 history 為所有「線上」分區的 UNION ALL 檢視
+PARTITION_PREFIX = 'history_'
+_MONTH_RE = re.compile(r'^\d{6}$')
+_UNKNOWN_MONTH = '000000'
+
+HISTORY_NAMES = ('id', 'timestamp', 'fish_code', 'weight', 'status')
+HISTORY_COLUMNS = ', '.join(HISTORY_NAMES)
+
+# 查詢計畫: [(來源, SQL, 參數), ...]，依序執行
+#   來源 None = 主資料庫；(封存檔 .gz, 解壓路徑) = 封存分區 (執行到時才解壓)
+Plan = List[Tuple[Optional[Tuple[str, str]], str, list]]
+
+
+def month_of(ts: Optional[str]) -> str:
+    """'YYYY-mm-dd HH:MM:SS' -> 'YYYYMM'"""
+    if ts and len(ts) >= 7 and ts[4] == '-':
+        month = ts[0:4] + ts[5:7]
+        if _MONTH_RE.match(month):
+            return month
+    return _UNKNOWN_MONTH
+
+
+def table_name(month: str) -> str:
+    return f"{PARTITION_PREFIX}{month}"
+
+
+def _create_table_sql(table: str, schema: str = '') -> List[str]:
+    return [
+        f'''CREATE TABLE IF NOT EXISTS {schema}{table} (
+                id INTEGER PRIMARY KEY,
+                timestamp DATETIME,
+                fish_code TEXT,
+                weight REAL,
+                status TEXT
+            )''',
+        f'CREATE INDEX IF NOT EXISTS {schema}idx_{table}_ts ON {table}(timestamp)',
+        f'CREATE INDEX IF NOT EXISTS {schema}idx_{table}_code ON {table}(fish_code, timestamp)',
+    ]
+
+
+def _open_source(db_path: str, source: Optional[Tuple[str, str]]) -> sqlite3.Connection:
+    if source is None:
+        return sqlite3.connect(db_path)
+    archive, extracted = source
+    if os.path.exists(extracted):
+        try:
+            os.utime(extracted)
+        except OSError:
+            pass
+    else:
+        os.makedirs(os.path.dirname(extracted) or '.', exist_ok=True)
+        # 以行程 id 區分暫存檔 (分析子行程也可能同時解壓)
+        tmp = f"{extracted}.{os.getpid()}.tmp"
+        with gzip.open(archive, 'rb') as src, open(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp, extracted)
+    return sqlite3.connect(f"file:{extracted}?mode=ro&immutable=1", uri=True)
+
+
+def run_plan(db_path: str, plan: Plan, limit: Optional[int] = None) -> Iterator[tuple]:
+    """
+    依序執行查詢計畫並逐列回傳 (tuple)，達到 limit 即停止 (後面的分區不再開啟或解壓)。
+    模組層級函式，分析子行程也直接使用。
+    """
+    remaining = limit
+    for source, sql, params in plan:
+        if remaining is not None and remaining <= 0:
+            return
+        conn = _open_source(db_path, source)
+        try:
+            p = list(params)
+            if remaining is not None:
+                p.append(remaining)
+            for row in conn.execute(sql, p):
+                yield row
+                if remaining is not None:
+                    remaining -= 1
+        finally:
+            conn.close()
+
+
+def rows_to_columns(rows: List[tuple], names=HISTORY_NAMES) -> Dict[str, list]:
+    """tuple 列 -> 欄位式 {"col": [...], ...} (與 fastjson.columns_from_cursor 相同格式)"""
+    if not rows:
+        return {name: [] for name in names}
+    return dict(zip(names, zip(*rows)))
+
+
+class PartitionStore:
+    """
+    history 依月份分區。
+
+    - 寫入: 依事件時間寫入 history_YYYYMM (需要時自動建立)。
+    - 查詢: 依查詢的時間範圍只讀取涵蓋的分區 (查詢成本取決於範圍，與總資料量無關)。
+    - 封存: 超過 live_months 的分區匯出為獨立 SQLite 檔並以 gzip 壓縮，自主資料庫移除；
+            查詢涵蓋該月份時解壓到快取目錄並以唯讀方式開啟。
+    - 維護: 低優先權背景執行緒定期封存、刪除過期封存檔並執行 incremental_vacuum。
+    """
+    def __init__(self, db_path: str, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.db_path = db_path
+        self.live_months = max(1, int(cfg.get('live_months', 3)))
+        self.archive_path = cfg.get('archive_path', 'data/archive')
+        self.archive_keep_months = int(cfg.get('archive_keep_months', 0))
+        self.extract_cache = cfg.get('extract_cache', os.path.join(self.archive_path, 'cache'))
+        self.max_extracted = int(cfg.get('max_extracted', 4))
+        self.maintenance_interval = float(cfg.get('maintenance_interval', 3600))
+        self.vacuum_pages = int(cfg.get('vacuum_pages', 256))
+        self.nice = int(cfg.get('nice', 10))
+
+        # month -> {"live": bool, "archive": path or None}
+        self._catalog: Dict[str, Dict] = {}
+        self._owner = False     # init() 後為 True：此行程負責寫入與維護，目錄以記憶體為準
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.on_change = None  # 分區異動 (封存) 時呼叫，Historian 用來使快取失效
+        self.archived = 0
+        self.vacuumed_pages = 0
+        self.last_maintenance: Optional[str] = None
+
+    # --- 結構 ---
+    def enable_incremental_vacuum(self):
+        """
+        確保資料庫為 auto_vacuum=INCREMENTAL (既有資料庫需 VACUUM 一次才會生效)。
+        需在沒有其他連線開啟交易時呼叫 (init_db 之前)。
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                logger.warning("Converting database to auto_vacuum=INCREMENTAL (one-time VACUUM)...")
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+    def init(self, conn: sqlite3.Connection, create_schema: bool = True):
+        """
+        於 init_db 中呼叫：建立目錄表、轉換舊版單一 history 表、確保本月分區。
+        create_schema=False (資料庫結構版本已是最新) 時略過 DDL；檢視只在定義與線上分區不符時重建。
+        """
+        if create_schema:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS history_partition (
+                    month TEXT PRIMARY KEY,
+                    live INTEGER NOT NULL DEFAULT 1,
+                    archive TEXT,
+                    rows INTEGER,
+                    min_id INTEGER,
+                    max_id INTEGER
+                )
+            ''')
+        self._load_catalog(conn)
+        row = conn.execute("SELECT type, sql FROM sqlite_master WHERE name = 'history'").fetchone()
+        if row and row[0] == 'table':
+            self._migrate_legacy(conn)
+            row = None
+        # ensure 建立新月份時會自行重建檢視
+        self.ensure(conn, month_of(datetime.now().strftime('%Y-%m-%d')), rebuild_view=False)
+        if row is None or row[1] != self._view_sql():
+            self.rebuild_view(conn)
+        self._owner = True
+
+    def _load_catalog(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._catalog = {
+                month: {"live": bool(live), "archive": archive}
+                for month, live, archive in conn.execute('SELECT month, live, archive FROM history_partition')
+            }
+
+    def _migrate_legacy(self, conn: sqlite3.Connection):
+        """將舊版 history 資料表依月份搬移到分區表 (只在升級時執行一次)"""
+        logger.warning("Migrating legacy history table into monthly partitions...")
+        months = [m for (m,) in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 4) || substr(timestamp, 6, 2) FROM history")]
+        for raw in months:
+            month = raw if raw and _MONTH_RE.match(raw) else _UNKNOWN_MONTH
+            self.ensure(conn, month, rebuild_view=False)
+            where = "substr(timestamp, 1, 4) || substr(timestamp, 6, 2) = ?" if month != _UNKNOWN_MONTH \
+                else "timestamp IS NULL OR NOT (substr(timestamp, 1, 4) || substr(timestamp, 6, 2) GLOB '[0-9][0-9][0-9][0-9][0-9][0-9]')"
+            params = (month,) if month != _UNKNOWN_MONTH else ()
+            conn.execute(f'INSERT OR IGNORE INTO {table_name(month)} ({HISTORY_COLUMNS}) '
+                         f'SELECT {HISTORY_COLUMNS} FROM history WHERE {where}', params)
+        count = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+        conn.execute('DROP TABLE history')
+        logger.warning(f"Migrated {count} history rows into {len(months)} partitions")
+
+    def ensure(self, conn: sqlite3.Connection, month: str, rebuild_view: bool = True):
+        """確保該月份有線上分區表 (寫入前呼叫)"""
+        with self._lock:
+            info = self._catalog.get(month)
+            if info and info['live']:
+                return
+        for sql in _create_table_sql(table_name(month)):
+            conn.execute(sql)
+        conn.execute('INSERT INTO history_partition (month, live) VALUES (?, 1) '
+                     'ON CONFLICT(month) DO UPDATE SET live = 1', (month,))
+        with self._lock:
+            self._catalog.setdefault(month, {"archive": None})['live'] = True
+        if rebuild_view:
+            self.rebuild_view(conn)
+
+    def rebuild_view(self, conn: sqlite3.Connection):
+        """history 檢視 = 所有線上分區 (供近期資料查詢與相容既有 SQL)"""
+        conn.execute('DROP VIEW IF EXISTS history')
+        conn.execute(self._view_sql())
+
+    def _view_sql(self) -> str:
+        months = self.live_months_list()
+        if months:
+            union = ' UNION ALL '.join(f'SELECT {HISTORY_COLUMNS} FROM {table_name(m)}' for m in months)
+        else:
+            union = (f'SELECT CAST(NULL AS INTEGER) AS id, NULL AS timestamp, NULL AS fish_code, '
+                     f'NULL AS weight, NULL AS status WHERE 0')
+        return f'CREATE VIEW history AS {union}'
+
+    def live_months_list(self) -> List[str]:
+        with self._lock:
+            return sorted(m for m, info in self._catalog.items() if info['live'])
+
+    def max_id(self, conn: sqlite3.Connection) -> int:
+        """各線上分區的 MAX(id) (INTEGER PRIMARY KEY，只讀 B-tree 最後一列) 與封存分區記錄的 max_id 取大者"""
+        archived = conn.execute('SELECT COALESCE(MAX(max_id), 0) FROM history_partition').fetchone()[0] or 0
+        live = [conn.execute(f'SELECT MAX(id) FROM {table_name(m)}').fetchone()[0] or 0
+                for m in self.live_months_list()]
+        return max([archived] + live)
+
+    # --- 寫入 ---
+    def insert(self, conn: sqlite3.Connection, rows: List[tuple], ignore: bool = True):
+        """rows: [(id, timestamp, fish_code, weight, status), ...]，依月份寫入各分區"""
+        by_month: Dict[str, List[tuple]] = {}
+        for row in rows:
+            by_month.setdefault(month_of(row[1]), []).append(row)
+        verb = 'INSERT OR IGNORE' if ignore else 'INSERT'
+        for month, items in by_month.items():
+            self.ensure(conn, month)
+            sql = f'{verb} INTO {table_name(month)} ({HISTORY_COLUMNS}) VALUES (?, ?, ?, ?, ?)'
+            try:
+                conn.executemany(sql, items)
+            except sqlite3.OperationalError as e:
+                if 'no such table' not in str(e):
+                    raise
+                # 等待寫入鎖期間該月份剛被封存 (目錄已標示為非線上)：
+                # 重新建立線上分區後寫入，下次維護再併入封存檔
+                logger.info(f"Partition {month} was archived during write, reopening live partition")
+                self.ensure(conn, month)
+                conn.executemany(sql, items)
+
+    # --- 查詢路由 ---
+    def _months_in_range(self, start: Optional[str], end: Optional[str]) -> List[str]:
+        lo = month_of(start) if start else None
+        hi = month_of(end) if end else None
+        with self._lock:
+            months = sorted(self._catalog)
+        return [m for m in months
+                if (lo is None or m >= lo) and (hi is None or m <= hi)
+                and (m != _UNKNOWN_MONTH or not (start or end))]
+
+    def plan(self, select: str, where: str, params: list, start: Optional[str], end: Optional[str],
+             order: str = '', descending: bool = False, limit: bool = False) -> Plan:
+        """
+        建立跨分區查詢計畫：只包含與 [start, end] 重疊的月份。
+        select / where / order 不含資料表名稱，每個分區各一條 SQL；
+        limit=True 時每條 SQL 結尾加上 LIMIT ? (由 run_plan 帶入剩餘筆數)。
+        """
+        if not self._owner:
+            # 非擁有者 (分析子行程)：目錄可能已被主行程的維護變更，每次重新讀取
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            try:
+                self._load_catalog(conn)
+            finally:
+                conn.close()
+        else:
+            self._trim_extract_cache()
+        months = self._months_in_range(start, end)
+        if descending:
+            months.reverse()
+        tail = (f' ORDER BY {order}' if order else '') + (' LIMIT ?' if limit else '')
+        plan: Plan = []
+        for month in months:
+            info = self._catalog.get(month, {})
+            sources = []
+            if info.get('live'):
+                sources.append((None, table_name(month)))
+            if info.get('archive'):
+                extracted = os.path.join(self.extract_cache, f"{table_name(month)}.db")
+                sources.append(((info['archive'], extracted), 'history'))
+            for source, table in sources:
+                plan.append((source, f'SELECT {select} FROM {table} WHERE {where}{tail}', list(params)))
+        return plan
+
+    # --- 封存檔 ---
+    def _trim_extract_cache(self):
+        """解壓快取只保留最近使用的 max_extracted 個檔案"""
+        try:
+            names = [n for n in os.listdir(self.extract_cache) if n.endswith('.db')]
+        except FileNotFoundError:
+            return
+        if len(names) <= self.max_extracted:
+            return
+        files = sorted((os.path.join(self.extract_cache, n) for n in names),
+                       key=os.path.getmtime, reverse=True)
+        for old in files[self.max_extracted:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _archive_month(self, month: str, existing: Optional[str] = None):
+        table = table_name(month)
+        os.makedirs(self.archive_path, exist_ok=True)
+        os.makedirs(self.extract_cache, exist_ok=True)
+        db_tmp = os.path.join(self.extract_cache, f"{table}.db.building")
+        gz_path = os.path.join(self.archive_path, f"{table}.db.gz")
+        if os.path.exists(db_tmp):
+            os.remove(db_tmp)
+        if existing and os.path.exists(existing):
+            # 已封存的月份又收到遲到事件：與原封存內容合併後重新封存
+            with gzip.open(existing, 'rb') as src, open(db_tmp, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        # 1. 匯出為獨立資料庫 (不持有主資料庫寫入鎖)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('ATTACH DATABASE ? AS arc', (db_tmp,))
+            for sql in _create_table_sql('history', schema='arc.'):
+                conn.execute(sql)
+            conn.execute(f'INSERT OR IGNORE INTO arc.history ({HISTORY_COLUMNS}) SELECT {HISTORY_COLUMNS} FROM {table}')
+            rows, min_id, max_id = conn.execute(
+                'SELECT COUNT(*), MIN(id), MAX(id) FROM arc.history').fetchone()
+            conn.commit()
+            conn.execute('DETACH DATABASE arc')
+        finally:
+            conn.close()
+
+        # 2. 壓縮並確實寫入磁碟
+        gz_tmp = gz_path + '.tmp'
+        with open(db_tmp, 'rb') as src, gzip.open(gz_tmp, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        with open(gz_tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(gz_tmp, gz_path)
+        os.replace(db_tmp, os.path.join(self.extract_cache, f"{table}.db"))
+
+        # 3. 更新目錄並移除線上分區 (同一交易；先取得寫入鎖，檢查到 DROP 之間不會再有寫入)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # 匯出期間若有遲到的事件寫入，一併保留在線上分區，下次維護再處理
+            late = self._late_rows(conn, table, max_id)
+            if late:
+                logger.warning(f"Partition {month} received {late} late rows during archive, retrying later")
+                conn.rollback()
+                return
+            conn.execute('UPDATE history_partition SET live = 0, archive = ?, rows = ?, min_id = ?, max_id = ? '
+                         'WHERE month = ?', (gz_path, rows, min_id, max_id, month))
+            with self._lock:
+                self._catalog[month] = {"live": False, "archive": gz_path}
+            conn.execute(f'DROP TABLE {table}')
+            self.rebuild_view(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._load_catalog(conn)
+            raise
+        finally:
+            conn.close()
+        self.archived += 1
+        logger.info(f"Archived history partition {month}: {rows} rows -> {gz_path} "
+                    f"({os.path.getsize(gz_path) / 1024:.0f} KB)")
+
+    def _late_rows(self, conn: sqlite3.Connection, table: str, max_id: Optional[int]) -> int:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE id > ?', (max_id or 0,)).fetchone()[0]
+
+    def _purge_month(self, month: str, archive: str):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('DELETE FROM history_partition WHERE month = ? AND live = 0', (month,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._catalog.pop(month, None)
+        for path in (archive, os.path.join(self.extract_cache, f"{table_name(month)}.db")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        logger.info(f"Purged archived history partition {month}")
+
+    def _incremental_vacuum(self):
+        """分批回收空頁 (每批後短暫讓出，避免長時間鎖住資料庫)"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            while not self._stop.is_set():
+                free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not free:
+                    break
+                conn.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})').fetchall()
+                self.vacuumed_pages += min(free, self.vacuum_pages)
+                time.sleep(0.05)
+        finally:
+            conn.close()
+
+    # --- 背景維護 ---
+    @staticmethod
+    def _shift_month(month: str, delta: int) -> str:
+        y, m = int(month[:4]), int(month[4:])
+        total = y * 12 + (m - 1) + delta
+        return f"{total // 12:04d}{total % 12 + 1:02d}"
+
+    def maintain(self):
+        """執行一次維護：封存過舊分區 -> 刪除過期封存 -> incremental_vacuum"""
+        current = month_of(datetime.now().strftime('%Y-%m-%d'))
+        live_cutoff = self._shift_month(current, -(self.live_months - 1))
+        with self._lock:
+            catalog = {m: dict(info) for m, info in self._catalog.items()}
+        changed = False
+        for month in sorted(catalog):
+            info = catalog[month]
+            if info['live'] and month < live_cutoff:
+                try:
+                    self._archive_month(month, existing=info.get('archive'))
+                    changed = True
+                except Exception as e:
+                    logger.error(f"Archive of partition {month} failed: {e}")
+        if self.archive_keep_months > 0:
+            purge_cutoff = self._shift_month(live_cutoff, -self.archive_keep_months)
+            for month, info in catalog.items():
+                if not info['live'] and info.get('archive') and month < purge_cutoff:
+                    self._purge_month(month, info['archive'])
+                    changed = True
+        if changed and self.on_change:
+            self.on_change()
+        self._incremental_vacuum()
+        self.last_maintenance = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def _run(self):
+        # 僅降低此執行緒的排程優先權 (Linux)，不影響其他執行緒
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.wait(5.0 if self.last_maintenance is None else self.maintenance_interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"History maintenance failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="history-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            live = sorted(m for m, i in self._catalog.items() if i['live'])
+            archived = sorted(m for m, i in self._catalog.items() if i.get('archive') and not i['live'])
+        return {"live": live, "archived": archived, "archived_this_run": self.archived,
+                "vacuumed_pages": self.vacuumed_pages, "last_maintenance": self.last_maintenance}
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from . import fastjson
+
+
+class CachedResult:
+    """查詢結果 + ETag；JSON 內容只在第一次需要時序列化一次"""
+    __slots__ = ('value', 'etag', '_body')
+
+    def __init__(self, value: Any, etag: str, body: Optional[bytes] = None):
+        self.value = value
+        self.etag = etag
+        self._body = body
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = fastjson.dumps(self.value)
+        return self._body
+
+
+class QueryCache:
+    """
+    查詢結果快取 (LRU)。
+
+    每個資料表有一個寫入水位，寫入後由 Historian 呼叫 bump() 推進；
+    快取項目記錄建立時所依賴資料表的水位，水位不同即視為過期。
+    immutable=True 的項目 (查詢範圍已完全在過去) 不受水位影響，直到被 LRU 淘汰。
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[CachedResult, Optional[tuple]]]" = OrderedDict()
+        self._watermarks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 行程啟動識別，避免重啟後水位歸零造成 ETag 重複
+        self._instance = str(int(time.time() * 1000))
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *tables: str):
+        with self._lock:
+            for t in tables:
+                self._watermarks[t] = self._watermarks.get(t, 0) + 1
+
+    def marks(self, deps: Iterable[str]) -> tuple:
+        with self._lock:
+            return tuple(self._watermarks.get(t, 0) for t in deps)
+
+    def lookup(self, key: tuple, deps: Tuple[str, ...]) -> Optional[CachedResult]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                version = cached[1]
+                if version is None or version == tuple(self._watermarks.get(t, 0) for t in deps):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached[0]
+        self.misses += 1
+        return None
+
+    def store(self, key: tuple, marks: tuple, value: Any = None, body: Optional[bytes] = None,
+              immutable: bool = False) -> CachedResult:
+        """marks 必須是查詢「開始前」取得的水位：查詢期間若有寫入，此結果會帶舊水位，下次即視為過期"""
+        version = None if immutable else marks
+        digest = hashlib.sha1(repr((self._instance, key, version)).encode('utf-8')).hexdigest()[:20]
+        result = CachedResult(value, f'"{digest}"', body)
+        with self._lock:
+            self._entries[key] = (result, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def get(self, key: tuple, deps: Tuple[str, ...], loader: Callable[[], Any],
+            immutable: bool = False) -> CachedResult:
+        cached = self.lookup(key, deps)
+        if cached is not None:
+            return cached
+        marks = self.marks(deps)
+        return self.store(key, marks, loader(), immutable=immutable)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "watermarks": dict(self._watermarks)}
@@ -0,0 +1,117 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from .buckets import bucket_ranges
+
+logger = logging.getLogger("recipe_sim")
+
+# 比較配方時通常重複使用同一段歷史資料，保留最近幾組重量陣列
+_CACHE_SIZE = 4
+# 結束時間未定 (或在未來) 的區間仍會有新資料，快取只保留短時間
+_OPEN_RANGE_TTL = 30.0
+HISTOGRAM_BINS = 50
+
+
+class RecipeSimulator:
+    """
+    以歷史重量模擬候選配方 (What-if)。
+    重量以 NumPy 陣列載入，使用 searchsorted 一次分配到所有分規區間。
+    """
+    def __init__(self, historian):
+        self.historian = historian
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def load_weights(self, fish_code: str, start_time: Optional[str] = None, end_time: Optional[str] = None) -> np.ndarray:
+        key = (fish_code, start_time, end_time)
+        cached = self._cache.get(key)
+        if cached is not None:
+            loaded_at, weights, closed = cached
+            if closed or time.time() - loaded_at < _OPEN_RANGE_TTL:
+                self._cache.move_to_end(key)
+                return weights
+
+        weights = np.fromiter(self.historian.iter_weights(fish_code, start_time, end_time), dtype=np.float64)
+        closed = bool(end_time) and end_time < datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._cache[key] = (time.time(), weights, closed)
+        self._cache.move_to_end(key)
+        while len(self._cache) > _CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return weights
+
+    @staticmethod
+    def simulate(weights: np.ndarray, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        依配方 (cfg_bN_min / max / target) 將重量分配到分規。
+        與 PLC 相同採用 min <= w < max，區間重疊時以編號小的分規優先。
+        """
+        ranges = bucket_ranges(params)
+        total = int(weights.size)
+
+        # 將所有區間端點切成互不重疊的小段，每段歸屬第一個涵蓋它的分規
+        edges = np.unique(np.array([v for _, lo, hi, _ in ranges for v in (lo, hi)], dtype=np.float64))
+        owner = np.zeros(max(len(edges) - 1, 0), dtype=np.int64)
+        for seg in range(len(edges) - 1):
+            lo, hi = edges[seg], edges[seg + 1]
+            for bucket_id, b_min, b_max, _ in ranges:
+                if b_min <= lo and hi <= b_max:
+                    owner[seg] = bucket_id
+                    break
+
+        buckets = {}
+        assigned = 0
+        if len(edges) >= 2 and total:
+            seg_idx = np.searchsorted(edges, weights, side='right') - 1
+            inside = (seg_idx >= 0) & (seg_idx < len(owner))
+            bucket_of = np.zeros(total, dtype=np.int64)
+            bucket_of[inside] = owner[seg_idx[inside]]
+            counts = np.bincount(bucket_of, minlength=8)
+            sums = np.bincount(bucket_of, weights=weights, minlength=8)
+        else:
+            counts = np.zeros(8, dtype=np.int64)
+            sums = np.zeros(8, dtype=np.float64)
+
+        for bucket_id, b_min, b_max, target in ranges:
+            count = int(counts[bucket_id])
+            weight_sum = float(sums[bucket_id])
+            assigned += count
+            mean = weight_sum / count if count else None
+            giveaway = weight_sum - count * target if (target and count) else None
+            buckets[str(bucket_id)] = {
+                "min": b_min,
+                "max": b_max,
+                "target": target,
+                "count": count,
+                "share": round(count / total, 4) if total else 0.0,
+                "mean": round(mean, 1) if mean is not None else None,
+                "giveaway_total": round(giveaway, 1) if giveaway is not None else None,
+                "giveaway_per_fish": round(giveaway / count, 2) if giveaway is not None else None,
+            }
+
+        distribution = {"edges": [], "counts": []}
+        if total:
+            hist, hist_edges = np.histogram(weights, bins=HISTOGRAM_BINS)
+            distribution = {"edges": np.round(hist_edges, 1).tolist(), "counts": hist.tolist()}
+
+        return {
+            "total": total,
+            "assigned": assigned,
+            "unassigned": total - assigned,
+            "buckets": buckets,
+            "distribution": distribution,
+        }
+
+    def run(self, fish_code: str, params: Dict[str, Any], start_time=None, end_time=None) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        weights = self.load_weights(fish_code, start_time, end_time)
+        t1 = time.perf_counter()
+        result = self.simulate(weights, params)
+        t2 = time.perf_counter()
+        result["fish_code"] = fish_code
+        result["load_ms"] = round((t1 - t0) * 1000, 1)
+        result["compute_ms"] = round((t2 - t1) * 1000, 1)
+        return result
@@ -0,0 +1,71 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .query_cache import CachedResult
+
+logger = logging.getLogger("recipes")
+
+
+class RecipeStore:
+    """
+    分規配方的記憶體快取 (write-through)。
+
+    啟動時由 fish_recipes 載入全部配方，之後讀取不再查詢 SQLite 或解析 JSON；
+    儲存時先寫入 SQLite，成功後才更新記憶體並將版本號 +1。
+    每個版本的回應 (含 JSON 與 ETag) 只建立一次。
+    """
+    def __init__(self, historian):
+        self.historian = historian
+        self._recipes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            self._recipes = {}
+            for code, params, version, updated_at in self.historian.load_recipes():
+                self._recipes[code] = self._entry(code, params, version or 1, updated_at)
+        logger.info(f"Loaded {len(self._recipes)} recipes")
+
+    @staticmethod
+    def _entry(code: str, params: dict, version: int, updated_at: Optional[str]) -> Dict:
+        return {"params": params, "version": version, "updated_at": updated_at,
+                "result": CachedResult(params, f'"recipe-{code}-v{version}"')}
+
+    def get(self, fish_code: str) -> Dict:
+        entry = self._recipes.get(fish_code)
+        return dict(entry['params']) if entry else {}
+
+    def version(self, fish_code: str) -> int:
+        entry = self._recipes.get(fish_code)
+        return entry['version'] if entry else 0
+
+    def get_result(self, fish_code: str) -> CachedResult:
+        """API 回應 (ETag 以版本號表示)"""
+        entry = self._recipes.get(fish_code)
+        if entry is None:
+            return CachedResult({}, f'"recipe-{fish_code}-v0"')
+        return entry['result']
+
+    def save(self, fish_code: str, params: dict) -> Optional[int]:
+        """寫入 SQLite 後更新記憶體，回傳新版本號 (失敗回傳 None)"""
+        params = dict(params)
+        with self._lock:
+            entry = self._recipes.get(fish_code)
+            if entry is not None and entry['params'] == params:
+                return entry['version']
+            version = (entry['version'] if entry else 0) + 1
+            if not self.historian.save_recipe(fish_code, params, version):
+                return None
+            self._recipes[fish_code] = self._entry(
+                fish_code, params, version, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        logger.info(f"Recipe {fish_code} saved as v{version}")
+        return version
+
+    def codes(self) -> List[str]:
+        return sorted(self._recipes)
+
+    def stats(self) -> Dict:
+        return {"recipes": len(self._recipes),
+                "versions": {code: e['version'] for code, e in self._recipes.items()}}
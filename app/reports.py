@@ -0,0 +1,328 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import fastjson
+from .query_cache import CachedResult
+from .shifts import normalize_shifts, shift_at, shift_key
+
+logger = logging.getLogger("reports")
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+NO_ALARM = (None, '', 'NO_ALARM', 'NO_ERROR')
+
+# 報表中可輸出為 CSV 的表格與欄位
+TABLE_COLUMNS = {
+    "production": ["fish_code", "count", "mean", "std", "min", "max", "total_weight"],
+    "buckets": ["fish_code", "bucket", "count", "total_weight", "giveaway"],
+    "downtime": ["fish_code", "state", "seconds", "intervals"],
+    "alarms": ["code", "kind", "count", "seconds"],
+}
+
+
+def _fmt(dt: datetime) -> str:
+    return dt.strftime(TS_FORMAT)
+
+
+def _parse(ts: str) -> datetime:
+    return datetime.strptime(ts[:19], TS_FORMAT)
+
+
+def merge_acc(acc: Dict[str, Dict], fish_code: Optional[str], weight: float):
+    """把一筆重量併入 (魚種) 累計值 {count, sum, sumsq, min, max}"""
+    a = acc.get(fish_code or 'UNKNOWN')
+    if a is None:
+        acc[fish_code or 'UNKNOWN'] = {"count": 1, "sum": weight, "sumsq": weight * weight,
+                                       "min": weight, "max": weight}
+        return
+    a['count'] += 1
+    a['sum'] += weight
+    a['sumsq'] += weight * weight
+    a['min'] = weight if a['min'] is None else min(a['min'], weight)
+    a['max'] = weight if a['max'] is None else max(a['max'], weight)
+
+
+def production_rows(acc: Dict[str, Dict]) -> List[Dict]:
+    rows = []
+    for code in sorted(acc):
+        a = acc[code]
+        n = a['count'] or 0
+        mean = a['sum'] / n if n else None
+        std = math.sqrt(max(a['sumsq'] / n - mean * mean, 0.0)) if n else None
+        rows.append({"fish_code": code, "count": n,
+                     "mean": round(mean, 2) if mean is not None else None,
+                     "std": round(std, 2) if std is not None else None,
+                     "min": a['min'], "max": a['max'], "total_weight": round(a['sum'] or 0.0, 1)})
+    return rows
+
+
+def _table(name: str, rows: List[Dict]) -> Dict[str, Any]:
+    columns = TABLE_COLUMNS[name]
+    return {"columns": columns, "rows": [[r.get(c) for c in columns] for r in rows]}
+
+
+class ShiftReporter:
+    """
+    班別報表 (物化)。
+
+    - 每個班別結束後 delay 秒由彙總資料計算一次報表：生產 (重量累計)、分規 (bucket_minute)、
+      停機 (state_intervals)、警報、OEE (檢查點)，整份 JSON 寫入 shift_reports，之後查詢直接回傳
+    - 生產區段另存累計值 (acc) 與當時的 max history.id；之後才寫入、時間落在已結束班別的
+      遲到事件只併入累計值並重寫該區段 (revision + 1)，不重新掃描整個班別
+    - 啟動時補算最近 backfill_shifts 個缺少報表的班別
+    - 報表內各表格為 {columns, rows}，可直接輸出 CSV 或交給 PDF 產生器
+    """
+    def __init__(self, historian, oee_tracker=None, shifts: Optional[List[Dict]] = None,
+                 cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.historian = historian
+        self.oee_tracker = oee_tracker
+        self.shifts = normalize_shifts(shifts)
+        self.enabled = cfg.get('enabled', True)
+        self.delay = float(cfg.get('delay', 60))
+        self.backfill_shifts = int(cfg.get('backfill_shifts', 6))
+        self.max_cached = int(cfg.get('max_cached', 64))
+        self._lock = threading.Lock()
+        # 回應快取另用一把鎖 (build 持有 _lock 的時間很長，查詢不應等待)；
+        # _saved 於每次寫入報表時遞增，讀取期間有寫入的結果不放入快取
+        self._results_lock = threading.Lock()
+        self._results: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._saved = 0
+        self._current_start: Optional[str] = None
+        self._current_end: Optional[str] = None
+        self.built = 0
+        self.late_updates = 0
+        self.late_rows = 0
+
+    # --- 班別 ---
+    def bounds(self, key: str) -> Optional[Tuple[datetime, datetime]]:
+        """班別鍵 (2026-10-19_A) -> (start, end)"""
+        try:
+            day, name = key.split('_', 1)
+            minute = dict(self.shifts)[name]
+            start = datetime.strptime(day, '%Y-%m-%d') + timedelta(minutes=minute)
+        except (ValueError, KeyError):
+            return None
+        _, start, end = shift_at(start, self.shifts)
+        return start, end
+
+    def key_at(self, ts: datetime) -> str:
+        name, start, _ = shift_at(ts, self.shifts)
+        return shift_key(name, start)
+
+    def ended_shifts(self, now: datetime, count: int) -> List[Tuple[str, datetime, datetime]]:
+        """now 之前已結束的最近 count 個班別 (新到舊)"""
+        out = []
+        _, start, _ = shift_at(now, self.shifts)
+        for _ in range(count):
+            name, prev_start, prev_end = shift_at(start - timedelta(seconds=1), self.shifts)
+            out.append((shift_key(name, prev_start), prev_start, prev_end))
+            start = prev_start
+        return out
+
+    # --- 產生 ---
+    def build(self, key: str) -> Optional[Dict[str, Any]]:
+        """計算並儲存報表 (已存在時整份重算，revision + 1)"""
+        span = self.bounds(key)
+        if span is None:
+            return None
+        start, end = _fmt(span[0]), _fmt(span[1])
+        with self._lock:
+            t0 = time.perf_counter()
+            acc, max_id = self.historian.shift_production(start, end)
+            existing = self.historian.get_shift_report(key)
+            revision = existing['revision'] + 1 if existing else 1
+            report = {
+                "shift": key, "start": start, "end": end,
+                "generated_at": _fmt(datetime.now()), "revision": revision,
+                "production": production_rows(acc),
+                "buckets": self.historian.bucket_totals(start[:16], end[:16]),
+            }
+            report.update(self._downtime(start, end))
+            report["oee"] = self._oee(key)
+            report["tables"] = {name: _table(name, report[name]) for name in TABLE_COLUMNS}
+            self._save(report, max_id, acc)
+            self.built += 1
+        logger.info(f"Shift report {key} r{revision} built in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        return report
+
+    def _downtime(self, start: str, end: str) -> Dict[str, List[Dict]]:
+        """狀態區間裁切到班別範圍內，依 (魚種, 狀態) 與警報碼 / 錯誤碼加總"""
+        t_start, t_end = _parse(start), _parse(end)
+        states: Dict[tuple, List] = {}
+        alarms: Dict[tuple, List] = {}
+        for r in self.historian.get_state_intervals(start, end, limit=1_000_000):
+            s = max(_parse(r['start']), t_start)
+            e = min(_parse(r['end']) if r['end'] else t_end, t_end)
+            seconds = max((e - s).total_seconds(), 0.0)
+            k = (r['fish_code'] or '----', r['state'])
+            agg = states.setdefault(k, [0.0, 0])
+            agg[0] += seconds
+            agg[1] += 1
+            for kind in ('alarm', 'error'):
+                code = r[f'{kind}_code']
+                if code in NO_ALARM:
+                    continue
+                agg = alarms.setdefault((code, kind), [0, 0.0])
+                agg[0] += 1
+                agg[1] += seconds
+        return {
+            "downtime": [{"fish_code": f, "state": s, "seconds": round(v[0], 1), "intervals": v[1]}
+                         for (f, s), v in sorted(states.items())],
+            "alarms": [{"code": c, "kind": k, "count": v[0], "seconds": round(v[1], 1)}
+                       for (c, k), v in sorted(alarms.items(), key=lambda x: -x[1][1])],
+        }
+
+    def _oee(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.oee_tracker is None:
+            return None
+        try:
+            return self.oee_tracker.get_shift(key)
+        except Exception as e:
+            logger.error(f"OEE for report {key} failed: {e}")
+            return None
+
+    def _save(self, report: Dict[str, Any], max_id: int, acc: Dict[str, Dict]):
+        self.historian.save_shift_report(report['shift'], report['start'], report['end'], report['revision'],
+                                         max_id, fastjson.dumps(report), acc)
+        with self._results_lock:
+            self._saved += 1
+            self._results.pop(report['shift'], None)
+
+    # --- 遲到事件 ---
+    def on_history_written(self, rows: List[tuple]):
+        """
+        Historian 寫入通知 (日誌套用器執行緒)：rows = [(id, timestamp, fish_code, weight, status), ...]。
+        只處理時間早於目前班別的列；其班別已有報表時增量併入。
+        """
+        if self._current_start is None or rows[-1][1] and rows[-1][1] >= self._current_end:
+            self._refresh_current()
+        current = self._current_start
+        late: Dict[str, List[tuple]] = {}
+        for row in rows:
+            ts, weight = row[1], row[3]
+            if not ts or ts >= current or weight is None:
+                continue
+            try:
+                late.setdefault(self.key_at(_parse(ts)), []).append(row)
+            except ValueError:
+                continue
+        for key, items in late.items():
+            try:
+                self._merge_late(key, items)
+            except Exception as e:
+                logger.error(f"Late event merge for {key} failed: {e}")
+
+    def _refresh_current(self):
+        _, start, end = shift_at(datetime.now(), self.shifts)
+        self._current_start, self._current_end = _fmt(start), _fmt(end)
+
+    def _merge_late(self, key: str, rows: List[tuple]):
+        with self._lock:
+            existing = self.historian.get_shift_report(key)
+            if existing is None:
+                # 尚未產生 (班別剛結束)：排程產生時即包含這些列
+                return
+            max_id = existing['max_id'] or 0
+            rows = [r for r in rows if r[0] > max_id]
+            if not rows:
+                return
+            acc = json.loads(existing['acc'] or '{}')
+            for _, _, fish_code, weight, _ in rows:
+                merge_acc(acc, fish_code, float(weight))
+            report = json.loads(existing['data'])
+            report['revision'] = existing['revision'] + 1
+            report['updated_at'] = _fmt(datetime.now())
+            report['late_rows'] = report.get('late_rows', 0) + len(rows)
+            report['production'] = production_rows(acc)
+            report['tables']['production'] = _table('production', report['production'])
+            self._save(report, max(max_id, max(r[0] for r in rows)), acc)
+            self.late_updates += 1
+            self.late_rows += len(rows)
+        logger.info(f"Shift report {key} r{report['revision']}: merged {len(rows)} late rows")
+
+    # --- 查詢 ---
+    def result(self, key: str) -> Optional[CachedResult]:
+        """已儲存的報表 JSON (不重新序列化)，ETag 隨 revision 變動"""
+        with self._results_lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                return cached
+            saved = self._saved
+        row = self.historian.get_shift_report(key)
+        if row is None:
+            return None
+        cached = CachedResult(None, f'"report-{key}-r{row["revision"]}"', row['data'].encode('utf-8'))
+        with self._results_lock:
+            # 讀取後若有新的 revision 寫入 (遲到事件合併 / 重算)，此結果可能已過期
+            if self._saved == saved:
+                self._results[key] = cached
+                while len(self._results) > self.max_cached:
+                    self._results.popitem(last=False)
+        return cached
+
+    def to_csv(self, key: str, table: str) -> Optional[str]:
+        row = self.historian.get_shift_report(key)
+        if row is None:
+            return None
+        data = json.loads(row['data'])['tables'].get(table)
+        if data is None:
+            raise KeyError(table)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(data['columns'])
+        writer.writerows(data['rows'])
+        return out.getvalue()
+
+    def list_reports(self, limit: int = 30, before: Optional[str] = None) -> List[Dict]:
+        return self.historian.list_shift_reports(limit, before)
+
+    # --- 排程 ---
+    def backfill(self, now: Optional[datetime] = None) -> int:
+        built = 0
+        for key, _, end in self.ended_shifts(now or datetime.now(), self.backfill_shifts):
+            if (datetime.now() - end).total_seconds() < self.delay:
+                continue
+            if self.historian.get_shift_report(key) is None and self.build(key):
+                built += 1
+        return built
+
+    async def run(self):
+        if not self.enabled:
+            return
+        self.historian.write_listeners.append(self.on_history_written)
+        try:
+            built = await asyncio.to_thread(self.backfill)
+            logger.info(f"Shift reporter started (delay {self.delay:.0f}s, backfilled {built})")
+            last = None
+            while True:
+                now = datetime.now()
+                _, start, end = shift_at(now, self.shifts)
+                # 上一班尚在延遲期間內時先等它，否則等目前班別結束
+                due = start + timedelta(seconds=self.delay)
+                if due <= now:
+                    due = end + timedelta(seconds=self.delay)
+                await asyncio.sleep(max((due - now).total_seconds(), 1.0))
+                key = self.key_at(datetime.now() - timedelta(seconds=self.delay + 1))
+                if key == last:
+                    continue
+                last = key
+                try:
+                    await asyncio.to_thread(self.build, key)
+                except Exception as e:
+                    logger.error(f"Shift report {key} failed: {e}")
+        finally:
+            if self.on_history_written in self.historian.write_listeners:
+                self.historian.write_listeners.remove(self.on_history_written)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "built": self.built, "late_updates": self.late_updates,
+                "late_rows": self.late_rows}
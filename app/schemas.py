@@ -0,0 +1,19 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# --- 資料模型定義 ---
+class FishTypeItem(BaseModel):
+    code: str
+    name: str
+
+class RecipeItem(BaseModel):
+    fish_code: str
+    params: dict
+
+class RecipeSimItem(BaseModel):
+    fish_code: str
+    params: dict
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
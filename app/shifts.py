@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+
+# 預設三班制 (可於 config.yaml 的 shifts 區段覆寫)
+DEFAULT_SHIFTS = [
+    {"name": "A", "start": "06:00"},
+    {"name": "B", "start": "14:00"},
+    {"name": "C", "start": "22:00"},
+]
+
+
+def _parse_hhmm(text: str) -> int:
+    h, m = str(text).split(':')
+    return int(h) * 60 + int(m)
+
+
+def normalize_shifts(shifts: Optional[List[Dict]]) -> List[Tuple[str, int]]:
+    """轉換為依開始時間排序的 (name, start_minute) 列表"""
+    items = shifts or DEFAULT_SHIFTS
+    return sorted(((str(s['name']), _parse_hhmm(s['start'])) for s in items), key=lambda x: x[1])
+
+
+def shift_at(ts: datetime, shifts: List[Tuple[str, int]]) -> Tuple[str, datetime, datetime]:
+    """
+    回傳 ts 所在班別 (name, start, end)。
+    跨日班別 (例如 22:00 ~ 06:00) 以開始時間所在日期為準。
+    """
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    # 從前一天開始列出所有班別起點，找出最後一個 <= ts 的
+    starts = []
+    for offset in (-1, 0, 1):
+        base = day + timedelta(days=offset)
+        for name, minute in shifts:
+            starts.append((base + timedelta(minutes=minute), name))
+
+    current = None
+    for i, (start, name) in enumerate(starts):
+        if start <= ts:
+            current = i
+    start, name = starts[current]
+    end = starts[current + 1][0]
+    return name, start, end
+
+
+def shift_key(name: str, start: datetime) -> str:
+    """班別唯一鍵，例如 2026-10-19_A"""
+    return f"{start.strftime('%Y-%m-%d')}_{name}"
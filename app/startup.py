@@ -0,0 +1,52 @@
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("startup")
+
+
+def process_started() -> float:
+    """行程啟動時間 (time.monotonic 基準)；無 /proc 時以目前時間代替 (只少算直譯器啟動)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # comm 可能含空白，從最後一個 ')' 之後開始算欄位；starttime 為第 22 欄 (開機後的 clock ticks)
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.monotonic() - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+class StartupTimer:
+    """
+    啟動各階段耗時：每個階段記錄距離行程啟動的時間與本階段耗時，
+    第一次成功輪詢時結束計時並寫入日誌 (/status 的 startup)。
+    """
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = process_started() if t0 is None else t0
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.phases: List[Dict[str, Any]] = []
+        self._last = self.t0
+        self.first_poll_ms: Optional[float] = None
+
+    def mark(self, phase: str):
+        now = time.monotonic()
+        self.phases.append({"phase": phase, "at_ms": round((now - self.t0) * 1000, 1),
+                            "took_ms": round((now - self._last) * 1000, 1)})
+        self._last = now
+
+    def first_poll(self):
+        """Gateway 第一次成功讀取 PLC 時呼叫"""
+        if self.first_poll_ms is not None:
+            return
+        self.mark("first_poll")
+        self.first_poll_ms = self.phases[-1]['at_ms']
+        logger.info(f"Cold start to first successful poll: {self.first_poll_ms:.0f} ms ("
+                    + ", ".join(f"{p['phase']} {p['took_ms']:.0f}" for p in self.phases) + ")")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"started_at": self.started_at, "first_poll_ms": self.first_poll_ms, "phases": self.phases}
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional, Any, List
+
+from .buckets import bucket_ranges, classify_weight
+from .shifts import normalize_shifts, shift_at
+
+logger = logging.getLogger("stats")
+
+WINDOW_5M = '5m'
+WINDOW_SHIFT = 'shift'
+WINDOW_DAY = 'day'
+WINDOWS = (WINDOW_5M, WINDOW_SHIFT, WINDOW_DAY)
+
+# 5 分鐘視窗以 10 秒為一格，查詢時合併最多 30 格
+SLOT_SECONDS = 10
+ROLLING_SECONDS = 300
+
+
+class RunningStats:
+    """Welford 單次更新的平均數 / 變異數，可用 Chan 公式合併"""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min: self.min = x
+        if self.max is None or x > self.max: self.max = x
+
+    def merge(self, other: 'RunningStats'):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class QuantileSketch:
+    """
+    對數分桶的分位數草圖 (DDSketch 做法)。
+    每個值 O(1) 更新，誤差為相對誤差 relative_accuracy，桶計數直接相加即可合併。
+    """
+    __slots__ = ('gamma', 'log_gamma', 'bins', 'zero_count', 'count')
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, x: float):
+        self.count += 1
+        if x <= 0:
+            self.zero_count += 1
+            return
+        k = math.ceil(math.log(x) / self.log_gamma)
+        self.bins[k] = self.bins.get(k, 0) + 1
+
+    def merge(self, other: 'QuantileSketch'):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + c
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                return 2 * self.gamma ** k / (self.gamma + 1)
+        return None
+
+
+class Aggregate:
+    __slots__ = ('stats', 'sketch')
+
+    def __init__(self, relative_accuracy: float):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, x: float):
+        self.stats.add(x)
+        self.sketch.add(x)
+
+    def merge(self, other: 'Aggregate'):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, elapsed_seconds: float) -> dict:
+        s = self.stats
+        minutes = max(elapsed_seconds, 1.0) / 60.0
+        return {
+            "count": s.count,
+            "mean": round(s.mean, 2),
+            "std": round(s.std, 2),
+            "min": s.min,
+            "max": s.max,
+            "p10": _round(self.sketch.quantile(0.10)),
+            "p50": _round(self.sketch.quantile(0.50)),
+            "p90": _round(self.sketch.quantile(0.90)),
+            "p99": _round(self.sketch.quantile(0.99)),
+            "rate_per_min": round(s.count / minutes, 2),
+        }
+
+
+def _round(v):
+    return round(v, 1) if v is not None else None
+
+
+class StatsEngine:
+    """
+    即時生產統計 (每個魚種 / 每個分規)。
+    每筆生產事件 O(1) 更新，視窗: 最近 5 分鐘、當班、當日。
+    """
+    def __init__(self, shifts: Optional[List[Dict]] = None, relative_accuracy: float = 0.01):
+        self.shifts = normalize_shifts(shifts)
+        self.relative_accuracy = relative_accuracy
+        self._slots: deque = deque()  # (slot_id, {key: Aggregate})
+        self._shift_key = None
+        self._shift_start: Optional[datetime] = None
+        self._shift: Dict[tuple, Aggregate] = {}
+        self._day_key = None
+        self._day_start: Optional[datetime] = None
+        self._day: Dict[tuple, Aggregate] = {}
+
+    def _keys(self, fish_code: str, bucket: Optional[int]):
+        keys = [('fish', fish_code)]
+        if bucket is not None:
+            keys.append(('bucket', bucket))
+        return keys
+
+    def _add(self, table: Dict[tuple, Aggregate], keys, weight: float):
+        for key in keys:
+            agg = table.get(key)
+            if agg is None:
+                agg = table[key] = Aggregate(self.relative_accuracy)
+            agg.add(weight)
+
+    def _roll(self, ts: datetime):
+        """必要時切換班別 / 日期 (重置累計)"""
+        name, start, _ = shift_at(ts, self.shifts)
+        if (name, start) != self._shift_key:
+            if self._shift_start is None or start > self._shift_start:
+                self._shift_key = (name, start)
+                self._shift_start = start
+                self._shift = {}
+        day = ts.date()
+        if day != self._day_key:
+            if self._day_key is None or day > self._day_key:
+                self._day_key = day
+                self._day_start = datetime(day.year, day.month, day.day)
+                self._day = {}
+
+    def record(self, fish_code: str, weight: float, bucket: Optional[int] = None, ts: Optional[datetime] = None):
+        """由 Gateway 在每筆生產事件後呼叫"""
+        ts = ts or datetime.now()
+        self._roll(ts)
+        keys = self._keys(fish_code or 'UNKNOWN', bucket)
+
+        # 早於當班 / 當日起點的事件 (例如重建時的舊資料) 不納入該視窗
+        if self._shift_start and ts >= self._shift_start:
+            self._add(self._shift, keys, weight)
+        if self._day_start and ts >= self._day_start:
+            self._add(self._day, keys, weight)
+
+        slot_id = int(ts.timestamp()) // SLOT_SECONDS
+        if not self._slots or self._slots[-1][0] != slot_id:
+            if self._slots and slot_id < self._slots[-1][0]:
+                return  # 亂序的舊事件不進入滾動視窗
+            self._slots.append((slot_id, {}))
+        self._add(self._slots[-1][1], keys, weight)
+        self._evict(time.time())
+
+    def _evict(self, now: float):
+        oldest = int(now - ROLLING_SECONDS) // SLOT_SECONDS
+        while self._slots and self._slots[0][0] <= oldest:
+            self._slots.popleft()
+
+    def rebuild(self, historian):
+        """啟動時由歷史資料重建當日 / 當班統計"""
+        now = datetime.now()
+        self._roll(now)
+        since = min(self._day_start, self._shift_start)
+        recipes = {}
+        count = 0
+        try:
+            for ts_text, fish_code, weight in historian.iter_events(since.strftime('%Y-%m-%d %H:%M:%S')):
+                if weight is None:
+                    continue
+                if fish_code not in recipes:
+                    recipes[fish_code] = bucket_ranges(historian.get_recipe(fish_code) if fish_code else {})
+                ts = datetime.strptime(ts_text, '%Y-%m-%d %H:%M:%S')
+                bucket = classify_weight(weight, recipes[fish_code])
+                self.record(fish_code, weight, bucket, ts)
+                count += 1
+            logger.info(f"Stats rebuilt from {count} history rows since {since}")
+        except Exception as e:
+            logger.error(f"Stats rebuild failed: {e}")
+
+    def _window(self, window: str):
+        now = datetime.now()
+        self._roll(now)
+        if window == WINDOW_5M:
+            self._evict(now.timestamp())
+            table: Dict[tuple, Aggregate] = {}
+            for _, slot in self._slots:
+                for key, agg in slot.items():
+                    merged = table.get(key)
+                    if merged is None:
+                        merged = table[key] = Aggregate(self.relative_accuracy)
+                    merged.merge(agg)
+            return table, ROLLING_SECONDS, now.timestamp() - ROLLING_SECONDS
+        if window == WINDOW_SHIFT:
+            return self._shift, (now - self._shift_start).total_seconds(), self._shift_start.timestamp()
+        return self._day, (now - self._day_start).total_seconds(), self._day_start.timestamp()
+
+    def snapshot(self, window: str = WINDOW_5M) -> Dict[str, Any]:
+        table, elapsed, start = self._window(window)
+        fish, buckets = {}, {}
+        for (kind, key), agg in table.items():
+            target = fish if kind == 'fish' else buckets
+            target[str(key)] = agg.summary(elapsed)
+        result = {
+            "window": window,
+            "start": datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+            "fish": fish,
+            "buckets": buckets,
+        }
+        if window == WINDOW_SHIFT and self._shift_key:
+            result["shift"] = self._shift_key[0]
+        return result
+
+    def snapshot_all(self) -> Dict[str, Any]:
+        return {w: self.snapshot(w) for w in WINDOWS}
+
+    async def run_publisher(self, ws_hub, interval: float = 5.0):
+        """定期推播統計結果到 WebSocket"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if ws_hub.clients:
+                    ws_hub.broadcast({"type": "stats", "data": self.snapshot_all()})
+            except Exception as e:
+                logger.error(f"Stats publish failed: {e}")
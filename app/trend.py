@@ -0,0 +1,96 @@
+import math
+from typing import Dict, Any, Optional, Iterable
+
+import numpy as np
+
+
+class TrendBuffer:
+    """
+    每個數值 Tag 一個固定長度的環形陣列 (輪詢解析度)，共用同一條時間軸。
+    Dashboard 連線或重新整理時直接由記憶體取得近期趨勢，不需查詢資料庫。
+    """
+    def __init__(self, minutes: float = 10.0, interval: float = 0.1):
+        self.capacity = max(1, int(minutes * 60 / max(interval, 0.001)))
+        self._ts = np.zeros(self.capacity, dtype=np.float64)
+        self._series: Dict[str, np.ndarray] = {}
+        self._pos = 0
+        self._size = 0
+
+    def record(self, ts: float, values: Dict[str, Any]):
+        """寫入一個時間點 (只保留 int / float 型態的 Tag)"""
+        pos = self._pos
+        self._ts[pos] = ts
+        for name, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            arr = self._series.get(name)
+            if arr is None:
+                arr = self._series[name] = np.full(self.capacity, np.nan)
+            arr[pos] = value
+        # 本次沒有數值的 Tag 記為 NaN，避免沿用舊資料
+        for name, arr in self._series.items():
+            if name not in values:
+                arr[pos] = np.nan
+        self._pos = (pos + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def resized(self, minutes: float, interval: float) -> 'TrendBuffer':
+        """依新的輪詢週期建立緩衝區 (保持 minutes 分鐘)，沿用最近的資料；超出新容量的較舊資料捨棄"""
+        new = TrendBuffer(minutes, interval)
+        idx = self._ordered_index(None)[-new.capacity:]
+        n = idx.size
+        new._ts[:n] = self._ts[idx]
+        for name, arr in self._series.items():
+            col = new._series[name] = np.full(new.capacity, np.nan)
+            col[:n] = arr[idx]
+        new._pos = n % new.capacity
+        new._size = n
+        return new
+
+    def tags(self):
+        return sorted(self._series)
+
+    def _ordered_index(self, since: Optional[float]) -> np.ndarray:
+        start = (self._pos - self._size) % self.capacity
+        idx = (np.arange(self._size) + start) % self.capacity
+        if since is not None and idx.size:
+            idx = idx[self._ts[idx] >= since]
+        return idx
+
+    def snapshot(self, tags: Optional[Iterable[str]] = None, seconds: Optional[float] = None,
+                 points: Optional[int] = None) -> Dict[str, Any]:
+        """
+        回傳欄位式資料 {"t": [...], "series": {tag: [...]}}。
+        points 有設定且資料較多時，以 min/max 抽樣 (每組輸出最小與最大值各一點)。
+        """
+        since = None
+        if seconds and self._size:
+            since = self._ts[(self._pos - 1) % self.capacity] - seconds
+        idx = self._ordered_index(since)
+        names = [t for t in (tags or self._series.keys()) if t in self._series]
+
+        t = self._ts[idx]
+        columns = {name: self._series[name][idx] for name in names}
+        decimated = False
+
+        if points and idx.size > points and points >= 2:
+            groups = points // 2
+            edges = np.linspace(0, idx.size, groups + 1).astype(np.int64)
+            starts, ends = edges[:-1], edges[1:] - 1
+            t = np.column_stack((t[starts], t[ends])).ravel()
+            for name, col in columns.items():
+                with np.errstate(all='ignore'):
+                    mins = np.fmin.reduceat(col, starts)
+                    maxs = np.fmax.reduceat(col, starts)
+                columns[name] = np.column_stack((mins, maxs)).ravel()
+            decimated = True
+
+        return {
+            "t": np.round(t, 3).tolist(),
+            "series": {name: _to_list(col) for name, col in columns.items()},
+            "decimated": decimated,
+        }
+
+
+def _to_list(col: np.ndarray):
+    return [None if math.isnan(v) else v for v in col.tolist()]
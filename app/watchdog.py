@@ -0,0 +1,184 @@
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("watchdog")
+
+# 延遲直方圖的桶上限 (毫秒)，最後一桶為 +Inf
+LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class LagHistogram:
+    """固定桶的事件迴圈延遲直方圖 (累計)"""
+    def __init__(self, bounds=LAG_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, lag_ms: float):
+        self.counts[bisect.bisect_left(self.bounds, lag_ms)] += 1
+        self.total += 1
+        self.sum_ms += lag_ms
+        if lag_ms > self.max_ms:
+            self.max_ms = lag_ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """回傳包含第 q 分位的桶上限 (毫秒)"""
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds + (None,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, round(self.max_ms, 1)) if bound is not None else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "buckets_ms": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 2) if self.total else None,
+            "p50_ms": self.quantile(0.5), "p99_ms": self.quantile(0.99), "p999_ms": self.quantile(0.999),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class LoopWatchdog:
+    """
+    事件迴圈延遲監控與卡住偵測。
+
+    - 迴圈上的心跳協程每 interval 秒醒來一次，實際醒來時間與預期的差即為延遲，記入直方圖
+    - 背景執行緒檢查心跳：超過 stall_threshold 秒未更新時，以 sys._current_frames()
+      擷取迴圈執行緒當下的堆疊與正在執行的 task 名稱並寫入日誌 (每次卡住只擷取一次)
+    - 迴圈恢復後補上卡住的總時間；保留最嚴重的 keep_worst 筆與最近的 keep_recent 筆
+    """
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.enabled = cfg.get('enabled', True)
+        self.interval = float(cfg.get('interval', 0.1))
+        self.stall_threshold = float(cfg.get('stall_threshold', 0.5))
+        self.keep_worst = int(cfg.get('keep_worst', 10))
+        self.keep_recent = int(cfg.get('keep_recent', 20))
+        self.publish_interval = float(cfg.get('publish_interval', 10))
+        self.histogram = LagHistogram()
+        self.stalls = 0
+        self.worst: List[Dict[str, Any]] = []
+        self.recent: List[Dict[str, Any]] = []
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._stall: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- 迴圈端 ---
+    async def run(self, ws_hub=None):
+        if not self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (interval {self.interval * 1000:.0f} ms, "
+                    f"stall threshold {self.stall_threshold * 1000:.0f} ms)")
+        last_publish = time.monotonic()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = max(now - expected, 0.0)
+                self.histogram.add(lag * 1000)
+                with self._lock:
+                    self._beat = now
+                    stall, self._stall = self._stall, None
+                if stall is not None:
+                    self._finish_stall(stall, lag)
+                if ws_hub is not None and ws_hub.clients and now - last_publish >= self.publish_interval:
+                    ws_hub.broadcast({"type": "loop", "data": self.summary()})
+                    last_publish = now
+        finally:
+            self._stop.set()
+
+    def _finish_stall(self, stall: Dict[str, Any], lag: float):
+        stall['duration_ms'] = round(lag * 1000, 1)
+        logger.warning(f"Event loop stall ended after {stall['duration_ms']:.0f} ms (task: {stall['task']})")
+        with self._lock:
+            self.recent.append(stall)
+            del self.recent[:-self.keep_recent]
+            self.worst.append(stall)
+            self.worst.sort(key=lambda s: -s['duration_ms'])
+            del self.worst[self.keep_worst:]
+
+    # --- 監控執行緒 ---
+    def _monitor(self):
+        check = min(self.interval, self.stall_threshold / 4)
+        while not self._stop.wait(check):
+            with self._lock:
+                blocked = time.monotonic() - self._beat - self.interval
+                if blocked < self.stall_threshold or self._stall is not None:
+                    continue
+                stall = self._stall = self._capture(blocked)
+            self.stalls += 1
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f} ms in task {stall['task']}:\n"
+                           + ''.join(stall['stack']))
+
+    def _capture(self, blocked: float) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        # 去掉事件迴圈本身的框架，從被執行的回呼 / 協程開始
+        for i in range(len(stack) - 1, -1, -1):
+            if 'asyncio' in stack[i] and 'events.py' in stack[i]:
+                stack = stack[i + 1:]
+                break
+        return {
+            "at": datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            "detected_ms": round(blocked * 1000, 1),
+            "duration_ms": None,
+            "task": self._task_name(),
+            "where": stack[-1].strip().splitlines()[0] if stack else None,
+            "stack": stack,
+        }
+
+    def _task_name(self) -> Optional[str]:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            return None
+        if task is None:
+            return None  # 不在 task 中 (例如 call_soon 回呼)
+        coro = task.get_coro()
+        return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    # --- 查詢 ---
+    def summary(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "stalls": self.stalls, "lag": self.histogram.to_dict(),
+                "worst_ms": self.worst[0]['duration_ms'] if self.worst else None}
+
+    def report(self, stacks: bool = True) -> Dict[str, Any]:
+        """管理端點：直方圖 + 最嚴重 / 最近的卡住紀錄 (含堆疊)"""
+        with self._lock:
+            worst, recent = list(self.worst), list(self.recent)
+            current = dict(self._stall) if self._stall else None
+        if not stacks:
+            worst = [{k: v for k, v in s.items() if k != 'stack'} for s in worst]
+            recent = [{k: v for k, v in s.items() if k != 'stack'} for s in recent]
+        result = self.summary()
+        result.update({
+            "interval_ms": self.interval * 1000, "stall_threshold_ms": self.stall_threshold * 1000,
+            "current_stall": current, "worst": worst, "recent": recent,
+        })
+        return result
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger("waveform")
+
+# 紀錄格式 (little-endian):
+#   header: magic 'WF', 樣本數, 歷史 ID, 第一個樣本時間, 取樣間隔, 觸發點索引, 第一個樣本值 (unsigned DWORD), 差值區長度
+#   body:   其餘樣本與前一個樣本的差值 (zigzag varint)
+_HEADER = struct.Struct('<2sHQdfHII')
+_MAGIC = b'WF'
+# 索引檔: 每筆固定 16 bytes (歷史 ID, 在區段檔中的位移)，ID 遞增可二分搜尋
+_INDEX = struct.Struct('<QQ')
+_SEGMENT_EXT = '.wf'
+_INDEX_EXT = '.idx'
+
+
+def _encode_deltas(samples: List[int]) -> bytes:
+    out = bytearray()
+    prev = samples[0]
+    for v in samples[1:]:
+        d = v - prev
+        prev = v
+        z = (d << 1) ^ (d >> 63)  # zigzag
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+    return bytes(out)
+
+
+def _decode_deltas(first: int, buf, count: int) -> List[int]:
+    samples = [first]
+    value = first
+    pos = 0
+    for _ in range(count - 1):
+        z = 0
+        shift = 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            z |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        value += (z >> 1) ^ -(z & 1)
+        samples.append(value)
+    return samples
+
+
+class WaveformStore:
+    """
+    波形區段檔 (append-only)。
+    超過 segment_max_bytes 換新檔，超過 max_segments 刪除最舊的區段，儲存空間有上限。
+    """
+    def __init__(self, path: str, segment_max_bytes: int = 4 * 1024 * 1024, max_segments: int = 16):
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max_segments
+        self._seg_file = None
+        self._idx_file = None
+        self._seg_size = 0
+        self._seg_no = None
+
+    def _segments(self) -> List[int]:
+        if not os.path.isdir(self.path):
+            return []
+        nums = []
+        for name in os.listdir(self.path):
+            if name.endswith(_SEGMENT_EXT):
+                try:
+                    nums.append(int(name[:-len(_SEGMENT_EXT)]))
+                except ValueError:
+                    pass
+        return sorted(nums)
+
+    def _file(self, seg_no: int, ext: str) -> str:
+        return os.path.join(self.path, f"{seg_no:06d}{ext}")
+
+    def _open_segment(self):
+        os.makedirs(self.path, exist_ok=True)
+        segments = self._segments()
+        seg_no = segments[-1] if segments else 1
+        if segments and os.path.getsize(self._file(seg_no, _SEGMENT_EXT)) >= self.segment_max_bytes:
+            seg_no += 1
+        self._close()
+        self._seg_no = seg_no
+        self._seg_file = open(self._file(seg_no, _SEGMENT_EXT), 'ab')
+        self._idx_file = open(self._file(seg_no, _INDEX_EXT), 'ab')
+        self._seg_size = self._seg_file.tell()
+
+        # 保留區段數上限
+        for old in self._segments()[:-self.max_segments]:
+            for ext in (_SEGMENT_EXT, _INDEX_EXT):
+                try:
+                    os.remove(self._file(old, ext))
+                except OSError:
+                    pass
+
+    def _close(self):
+        for f in (self._seg_file, self._idx_file):
+            if f:
+                f.close()
+        self._seg_file = self._idx_file = None
+
+    def append(self, row_id: int, t0: float, dt: float, trigger_index: int, samples: List[int]):
+        if self._seg_file is None or self._seg_size >= self.segment_max_bytes:
+            self._open_segment()
+        body = _encode_deltas(samples)
+        record = _HEADER.pack(_MAGIC, len(samples), row_id, t0, dt, trigger_index, samples[0], len(body)) + body
+        offset = self._seg_size
+        self._seg_file.write(record)
+        self._seg_file.flush()
+        self._idx_file.write(_INDEX.pack(row_id, offset))
+        self._idx_file.flush()
+        self._seg_size += len(record)
+
+    def _read_index(self, seg_no: int):
+        path = self._file(seg_no, _INDEX_EXT)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return [], []
+        n = len(data) // _INDEX.size
+        flat = struct.unpack(f'<{n * 2}Q', data[:n * _INDEX.size])
+        return list(flat[0::2]), list(flat[1::2])
+
+    def _read_record(self, seg_no: int, offset: int) -> Optional[Dict[str, Any]]:
+        with open(self._file(seg_no, _SEGMENT_EXT), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, n, row_id, t0, dt, trig, first, body_len = _HEADER.unpack_from(mm, offset)
+                if magic != _MAGIC:
+                    return None
+                start = offset + _HEADER.size
+                samples = _decode_deltas(first, mm[start:start + body_len], n)
+        return {"id": row_id, "t0": t0, "dt": round(dt, 5), "trigger_index": trig, "samples": samples}
+
+    def get(self, row_id: int) -> Optional[Dict[str, Any]]:
+        for seg_no in reversed(self._segments()):
+            ids, offsets = self._read_index(seg_no)
+            if not ids or row_id < ids[0]:
+                continue
+            i = bisect_left(ids, row_id)
+            if i < len(ids) and ids[i] == row_id:
+                return self._read_record(seg_no, offsets[i])
+            return None
+        return None
+
+    def latest_ids(self, limit: int) -> List[int]:
+        """由新到舊列出已擷取的歷史 ID"""
+        result = []
+        for seg_no in reversed(self._segments()):
+            ids, _ = self._read_index(seg_no)
+            result.extend(reversed(ids))
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+
+class WaveformRecorder:
+    """
+    每次偵測到新魚時，擷取觸發前後的 weight_now 原始樣本並寫入 WaveformStore。
+    同時進行的擷取數量有上限，超過時捨棄並計數，確保滿線速時 CPU 有上限。
+    """
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.enabled = bool(cfg.get('enabled', False))
+        self.sample_interval = float(cfg.get('sample_interval', 0))
+        self.pre_samples = int(cfg.get('pre_samples', 25))
+        self.post_samples = int(cfg.get('post_samples', 75))
+        self.max_active = int(cfg.get('max_active', 4))
+        self.store = WaveformStore(
+            cfg.get('path', 'data/waveforms'),
+            segment_max_bytes=int(cfg.get('segment_max_mb', 4) * 1024 * 1024),
+            max_segments=int(cfg.get('max_segments', 16))
+        )
+        self._ring = deque(maxlen=self.pre_samples)
+        self._active: List[dict] = []
+        self.captured = 0
+        self.dropped = 0
+
+    def feed(self, value, ts: Optional[float] = None):
+        """送入一個 weight_now 樣本"""
+        if not self.enabled or not isinstance(value, (int, float)):
+            return
+        ts = ts or time.time()
+        sample = (ts, int(value))
+        if self._active:
+            done = []
+            for cap in self._active:
+                cap['samples'].append(sample)
+                if len(cap['samples']) - cap['trigger_index'] >= self.post_samples:
+                    done.append(cap)
+            for cap in done:
+                self._active.remove(cap)
+                self._finish(cap)
+        self._ring.append(sample)
+
+    def trigger(self, row_id: Optional[int]):
+        """由 Gateway 在寫入歷史資料後呼叫 (row_id 為 history.id)"""
+        if not self.enabled or row_id is None:
+            return
+        if len(self._active) >= self.max_active:
+            self.dropped += 1
+            return
+        pre = list(self._ring)
+        self._active.append({"row_id": row_id, "samples": pre, "trigger_index": len(pre)})
+
+    def _finish(self, cap: dict):
+        samples = cap['samples']
+        if len(samples) < 2:
+            return
+        t0 = samples[0][0]
+        dt = (samples[-1][0] - t0) / (len(samples) - 1)
+        try:
+            self.store.append(cap['row_id'], t0, dt, cap['trigger_index'], [v for _, v in samples])
+            self.captured += 1
+        except Exception as e:
+            logger.error(f"Waveform write failed: {e}")
+
+    async def run_sampler(self, client, address: int):
+        """高速取樣模式：只讀取 weight_now 兩個暫存器"""
+        logger.info(f"Waveform sampler started ({self.sample_interval * 1000:.0f} ms)")
+        while True:
+            start = time.time()
+            if client.connected:
+                regs = await client.read_holding_registers(address, 2)
+                if regs and len(regs) == 2:
+                    self.feed((regs[0] << 16) | regs[1], start)
+            await asyncio.sleep(max(0, self.sample_interval - (time.time() - start)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "captured": self.captured, "dropped": self.dropped,
+                "active": len(self._active)}
@@ -1,4 +1,7 @@
 import logging
+from typing import Any, Dict, List, Optional
+
+from .parser import TagParser
 
 logger = logging.getLogger("control")
 
@@ -46,27 +49,14 @@ class WriteController:
              return False
 
         try:
-            base = self.gateway.config['plc']['registers']['map']['bucket_settings_start']
-            target_addr = 0
-
-            # === 位址計算邏輯 ===
-            if bucket_id == 1:
-                if field == 'min': target_addr = base
-                elif field == 'max': target_addr = base + 2
-                elif field == 'target': target_addr = base + 4
-            elif 2 <= bucket_id <= 7:
-                # 計算偏移量
-                offset = 6 + (bucket_id - 2) * 4
-                
-                if field == 'min':
-                    # [修改] 針對唯讀欄位，回傳 True (假裝成功) 以避免中斷批次寫入流程
-                    # 因為前端可能會傳來所有欄位，我們只需忽略唯讀的即可
-                    logger.debug(f"Skipping Read-Only field: Bucket {bucket_id} Min")
-                    return True 
-                elif field == 'max': target_addr = base + offset
-                elif field == 'target': target_addr = base + offset + 2
-            
-            if target_addr == 0:
+            target_addr, writable = self.setting_address(bucket_id, field)
+            if target_addr is not None and not writable:
+                # [修改] 針對唯讀欄位，回傳 True (假裝成功) 以避免中斷批次寫入流程
+                # 因為前端可能會傳來所有欄位，我們只需忽略唯讀的即可
+                logger.debug(f"Skipping Read-Only field: Bucket {bucket_id} {field}")
+                return True
+
+            if not target_addr:
                 logger.error(f"Invalid bucket write target: Bucket {bucket_id}, Field {field}")
                 return False
 
@@ -85,38 +75,131 @@ class WriteController:
             logger.error(f"Write bucket setting failed: {e}")
             return False
 
-    async def write_recipe(self, params: dict) -> bool:
+    def setting_address(self, bucket_id: int, field: str):
         """
-        批次寫入所有分規設定 (Recipe)
+        分規設定欄位的 Dword 位址 -> (address, writable)；無此欄位回傳 (None, False)
+        Bucket 1: min / max / target 位於 40101~；Bucket 2~7: max / target 位於 40107~ (每組 4 words)，
+        min 位於唯讀區 40043~ (每組 2 words)
         """
-        # [修改] 預設 success 為 True，只有發生「嚴重錯誤」才設為 False
-        # 這樣個別非關鍵寫入失敗不會導致整個 API 回傳 503
-        overall_success = True
-        error_count = 0
-        
-        logger.info(f"Starting batch write recipe with {len(params)} items")
-        
+        reg_map = self.gateway.config['plc']['registers']['map']
+        base = reg_map['bucket_settings_start']
+        if bucket_id == 1:
+            offsets = {'min': 0, 'max': 2, 'target': 4}
+            if field in offsets:
+                return base + offsets[field], True
+        elif 2 <= bucket_id <= 7:
+            offset = 6 + (bucket_id - 2) * 4
+            if field == 'max':
+                return base + offset, True
+            if field == 'target':
+                return base + offset + 2, True
+            if field == 'min' and 'bucket_ro_min_start' in reg_map:
+                return reg_map['bucket_ro_min_start'] + (bucket_id - 2) * 2, False
+        return None, False
+
+    def verify_range(self):
+        """配方讀回驗證的區塊 (唯讀最小值 40043~ 到設定區 40101~ 結尾，一次讀取)"""
+        reg_map = self.gateway.config['plc']['registers']['map']
+        base = reg_map['bucket_settings_start']
+        end = base + 6 + 6 * 4
+        start = min(reg_map.get('bucket_ro_min_start', base), base)
+        return start, end - start
+
+    @staticmethod
+    def _parse_key(key: str):
+        parts = key.split('_')
+        if len(parts) == 3 and parts[0] == 'cfg' and parts[1].startswith('b') and parts[1][1:].isdigit():
+            return int(parts[1][1:]), parts[2]
+        return None
+
+    async def download_recipe(self, params: dict) -> Optional[Dict[str, Any]]:
+        """
+        下載配方到 PLC：
+        1. 與最近一次輪詢的 cfg_b* Tag 比對，只寫入有變動的欄位 (相鄰的 Dword 合併為一次 FC16 寫入)
+        2. 以一次區塊讀取讀回設定區與唯讀最小值，逐欄位驗證
+        回傳逐欄位報告；PLC 未連線時回傳 None。
+        status: ok / unchanged / read_only / mismatch / write_failed / unverified / invalid
+        """
+        client = self.gateway.client
+        if not client.connected:
+            logger.warning("Write rejected: PLC disconnected")
+            return None
+
+        tags = self.gateway.tags
+        fields: Dict[str, Dict[str, Any]] = {}
+        changes: Dict[int, tuple] = {}   # address -> (key, value)
+
         for key, value in params.items():
-            parts = key.split('_')
-            if len(parts) == 3 and parts[0] == 'cfg' and parts[1].startswith('b'):
-                try:
-                    bucket_id = int(parts[1][1:]) 
-                    field = parts[2]
-                    
-                    if not await self.write_bucket_setting(bucket_id, field, int(value)):
-                        error_count += 1
-                        # 這裡我們不立即將 overall_success 設為 False，除非錯誤比例過高
-                        # 或者我們可以選擇忽略單一寫入失敗
-                except Exception as e:
-                    logger.error(f"Error processing key {key}: {e}")
-                    error_count += 1
-        
-        if error_count > 0:
-            logger.warning(f"Batch write completed with {error_count} errors (ignored)")
-            
-        # 只要不是全部失敗，我們都視為成功，讓前端顯示綠色勾勾
-        # 如果 PLC 斷線，write_bucket_setting 會在第一步就 return False，那時 error_count 會等於 params 數量
-        if error_count == len(params) and len(params) > 0:
-             return False
-             
-        return True
\ No newline at end of file
+            parsed = self._parse_key(key)
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                parsed = None
+            addr, writable = self.setting_address(*parsed) if parsed else (None, False)
+            if addr is None:
+                fields[key] = {"requested": value, "status": "invalid"}
+                continue
+            before = tags.get(key)
+            entry = fields[key] = {"requested": value, "before": before, "address": addr, "written": False}
+            if not writable:
+                entry['status'] = 'read_only'
+            elif before == value:
+                entry['status'] = 'unchanged'
+            else:
+                entry['status'] = 'pending'
+                changes[addr] = (key, value)
+
+        # 相鄰位址合併為連續區段，每段一次寫入
+        runs: List[List[int]] = []
+        for addr in sorted(changes):
+            if runs and runs[-1][-1] + 2 == addr:
+                runs[-1].append(addr)
+            else:
+                runs.append([addr])
+        for run in runs:
+            values = []
+            for addr in run:
+                v = changes[addr][1]
+                values += [(v >> 16) & 0xFFFF, v & 0xFFFF]
+            ok = await client.write_registers(run[0], values)
+            for addr in run:
+                entry = fields[changes[addr][0]]
+                entry['written'] = ok
+                if not ok:
+                    entry['status'] = 'write_failed'
+        logger.info(f"Recipe download: {len(changes)} changed fields in {len(runs)} writes, "
+                    f"{sum(1 for f in fields.values() if f['status'] == 'unchanged')} unchanged")
+
+        # 一次讀回驗證
+        start, count = self.verify_range()
+        registers = await client.read_holding_registers(start, count)
+        readback = TagParser({k: v for k, v in self.gateway.config['plc']['registers']['map'].items()
+                              if k in ('bucket_settings_start', 'bucket_ro_min_start')}
+                             ).parse_block(registers, start) if registers else {}
+        for key, entry in fields.items():
+            if entry['status'] == 'invalid':
+                continue
+            rb = readback.get(key)
+            entry['readback'] = rb
+            if rb is None:
+                if entry['status'] in ('pending', 'unchanged'):
+                    entry['status'] = 'unverified'
+            elif entry['status'] == 'read_only':
+                entry['matches'] = rb == entry['requested']
+            elif entry['status'] in ('pending', 'unchanged'):
+                if rb != entry['requested']:
+                    entry['status'] = 'mismatch'
+                elif entry['status'] == 'pending':
+                    entry['status'] = 'ok'
+
+        bad = [k for k, f in fields.items() if f['status'] not in ('ok', 'unchanged', 'read_only')]
+        if bad:
+            logger.warning(f"Recipe verification failed for: {', '.join(bad)}")
+        return {
+            "success": not bad,
+            "written": sum(1 for f in fields.values() if f.get('written')),
+            "unchanged": sum(1 for f in fields.values() if f['status'] == 'unchanged'),
+            "writes": len(runs),
+            "failed": bad,
+            "fields": fields,
+        }
@@ -1,38 +1,317 @@
 import logging
 import asyncio
-from typing import List
+import json
+import struct
+import time
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Union
 from fastapi import WebSocket
 
 logger = logging.getLogger("ws_hub")
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 每個客戶端的待送訊息上限，超過代表連線過慢，直接斷線讓其重連後重新同步
+CLIENT_QUEUE_SIZE = 500
+
+# 訂閱主題 -> Tag 名稱樣式
+TOPIC_TAGS = {
+    'live': ['weight'],
+    'status': ['status', 'fish_code', 'alarm_*', 'error_*'],
+    'time': ['start_time'],
+    'bucket_config': ['cfg_b*'],
+    'bucket_stats': ['bkt_b*'],
+}
+# 非 Tag 訊息 (type) -> 主題
+FRAME_TOPICS = {
+    'stats': 'stats',
+    'bucket_stats': 'bucket_stats',
+    'event': 'events',
+    'trend': 'trend',
+    'oee': 'oee',
+    'loop': 'loop',
+}
+TOPICS = sorted(set(TOPIC_TAGS) | set(FRAME_TOPICS.values()))
+
+# 差異編碼方式: json (預設) / bin (自訂二進位) / msgpack (需安裝 msgpack)
+ENC_JSON = 'json'
+ENC_BIN = 'bin'
+ENC_MSGPACK = 'msgpack'
+
+# 二進位差異格式 (little-endian):
+#   header: u8 frame type (1 = delta), u32 seq, u16 筆數
+#   entry:  u16 tag id, u8 value type, value
+_BIN_DELTA = 1
+_BIN_HEADER = struct.Struct('<BIH')
+_V_NULL, _V_INT32, _V_FLOAT64, _V_STR, _V_INT64 = 0, 1, 2, 3, 4
+_E_NULL = struct.Struct('<HB')
+_E_INT32 = struct.Struct('<HBi')
+_E_INT64 = struct.Struct('<HBq')
+_E_FLOAT64 = struct.Struct('<HBd')
+_E_STR = struct.Struct('<HBH')
+
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    if requested == ENC_MSGPACK:
+        return ENC_MSGPACK if msgpack is not None else ENC_BIN
+    if requested == ENC_BIN:
+        return ENC_BIN
+    return ENC_JSON
+
+
+class WsClient:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        self.encoding = ENC_JSON
+        # None 代表訂閱全部
+        self.topics: Optional[set] = None
+        self.patterns: Tuple[str, ...] = ()
+
+    @property
+    def subscribes_all(self) -> bool:
+        return self.topics is None
+
+    def set_subscription(self, topics: Optional[Iterable[str]], tags: Optional[Iterable[str]]):
+        topics = [t for t in (topics or []) if t]
+        tags = [t for t in (tags or []) if t]
+        if not topics and not tags:
+            self.topics, self.patterns = None, ()
+            return
+        self.topics = set(topics)
+        patterns = list(tags)
+        for topic in self.topics:
+            patterns.extend(TOPIC_TAGS.get(topic, []))
+        self.patterns = tuple(patterns)
+
+    def wants_tag(self, name: str) -> bool:
+        if self.topics is None:
+            return True
+        return any(fnmatchcase(name, p) for p in self.patterns)
+
+    def wants_topic(self, topic: Optional[str]) -> bool:
+        return self.topics is None or topic is None or topic in self.topics
+
+
 class WsHub:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, delta_log_size: int = 2000):
+        self.clients: List[WsClient] = []
+        # Tag -> 有訂閱該 Tag 的「部分訂閱」客戶端 (訂閱全部者不列入，直接送完整差異)
+        self._tag_index: Dict[str, Tuple[WsClient, ...]] = {}
+        # 序號與差異紀錄 (斷線重連時補送遺漏的變更)
+        self.epoch = str(int(time.time() * 1000))
+        self.seq = 0
+        self._log: deque = deque(maxlen=delta_log_size)
+        # 二進位編碼用的 Tag 名稱 -> 整數 ID (全域共用，只增不減)
+        self._tag_ids: Dict[str, int] = {}
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return [c.websocket for c in self.clients]
 
-    async def connect(self, websocket: WebSocket):
-        """接受並儲存新的 WebSocket 連線"""
+    async def connect(self, websocket: WebSocket, encoding: Optional[str] = None) -> WsClient:
+        """
+        接受並儲存新的 WebSocket 連線。
+        回傳後到呼叫端送出初始資料之前不會讓出事件迴圈，因此初始資料與後續差異的順序一致。
+        """
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"Client connected. Total: {len(self.active_connections)}")
+        client = WsClient(websocket)
+        client.encoding = negotiate_encoding(encoding)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients.append(client)
+        logger.info(f"Client connected. Total: {len(self.clients)}")
+        return client
+
+    def subscribe(self, client: WsClient, topics: Optional[Iterable[str]] = None,
+                  tags: Optional[Iterable[str]] = None):
+        """設定客戶端訂閱 (主題 + Tag 樣式)，皆為空代表全部"""
+        client.set_subscription(topics, tags)
+        self._tag_index.clear()
+
+    def _subscribers(self, name: str) -> Tuple[WsClient, ...]:
+        subs = self._tag_index.get(name)
+        if subs is None:
+            subs = tuple(c for c in self.clients if not c.subscribes_all and c.wants_tag(name))
+            self._tag_index[name] = subs
+        return subs
 
     def disconnect(self, websocket: WebSocket):
         """移除斷開的連線"""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(f"Client disconnected. Total: {len(self.active_connections)}")
+        for client in self.clients:
+            if client.websocket is websocket:
+                self.clients.remove(client)
+                self._tag_index.clear()
+                if client.task and client.task is not asyncio.current_task():
+                    client.task.cancel()
+                logger.info(f"Client disconnected. Total: {len(self.clients)}")
+                return
+
+    async def _writer(self, client: WsClient):
+        """依序送出該客戶端佇列中的訊息"""
+        ws = client.websocket
+        try:
+            while True:
+                frame = await client.queue.get()
+                if isinstance(frame, bytes):
+                    await ws.send_bytes(frame)
+                else:
+                    await ws.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Error sending to client (removing): {e}")
+            self.disconnect(ws)
 
-    async def broadcast(self, message: dict):
+    def _enqueue(self, client: WsClient, frame):
+        try:
+            client.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            logger.warning("Client too slow, dropping connection for resync")
+            self.disconnect(client.websocket)
+            asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def send(self, client: WsClient, message: Union[Dict[str, Any], str]):
+        """經由該客戶端的佇列送出 (str 視為已編碼的文字訊息，例如 pong)"""
+        self._enqueue(client, message if isinstance(message, str) else json.dumps(message))
+
+    def broadcast(self, message: dict):
+        """
+        將 JSON 訊息推播給有訂閱該類訊息的客戶端 (只編碼一次)
+        """
+        if not self.clients:
+            return
+        topic = FRAME_TOPICS.get(message.get('type'))
+        text = None
+        for client in self.clients[:]:
+            if not client.wants_topic(topic):
+                continue
+            if text is None:
+                text = json.dumps(message)
+            self._enqueue(client, text)
+
+    # --- 差異編碼 ---
+    def _ensure_tag_ids(self, names, skip: Optional[WsClient] = None):
+        """為新的 Tag 配發 ID，並先通知所有二進位客戶端 (在任何使用該 ID 的訊框之前)"""
+        new = {}
+        for name in names:
+            if name not in self._tag_ids:
+                self._tag_ids[name] = new[name] = len(self._tag_ids)
+        if new:
+            text = None
+            for client in self.clients[:]:
+                if client.encoding != ENC_JSON and client is not skip:
+                    if text is None:
+                        text = json.dumps({"type": "dict", "tags": new})
+                    self._enqueue(client, text)
+
+    def _pack_binary(self, seq: int, data: Dict[str, Any]) -> bytes:
+        ids = self._tag_ids
+        parts = [_BIN_HEADER.pack(_BIN_DELTA, seq & 0xFFFFFFFF, len(data))]
+        for name, value in data.items():
+            tid = ids[name]
+            if value is None:
+                parts.append(_E_NULL.pack(tid, _V_NULL))
+            elif isinstance(value, int):
+                if -0x80000000 <= value <= 0x7FFFFFFF:
+                    parts.append(_E_INT32.pack(tid, _V_INT32, value))
+                else:
+                    parts.append(_E_INT64.pack(tid, _V_INT64, value))
+            elif isinstance(value, float):
+                parts.append(_E_FLOAT64.pack(tid, _V_FLOAT64, value))
+            else:
+                raw = str(value).encode('utf-8')[:0xFFFF]
+                parts.append(_E_STR.pack(tid, _V_STR, len(raw)))
+                parts.append(raw)
+        return b''.join(parts)
+
+    def _encode_delta(self, seq: int, data: Dict[str, Any], encoding: str):
+        if encoding == ENC_BIN:
+            return self._pack_binary(seq, data)
+        if encoding == ENC_MSGPACK:
+            ids = self._tag_ids
+            return msgpack.packb({"t": "delta", "s": seq, "d": {ids[k]: v for k, v in data.items()}})
+        return json.dumps({"type": "delta", "seq": seq, "data": data})
+
+    def _send_delta(self, client: WsClient, seq: int, data: Dict[str, Any]):
+        self._enqueue(client, self._encode_delta(seq, data, client.encoding))
+
+    def publish(self, changes: Dict[str, Any]):
+        """發佈一次 Tag 變更 (帶遞增序號)，並記錄以供重連補送"""
+        if not changes:
+            return
+        self.seq += 1
+        self._log.append((self.seq, changes))
+        if not self.clients:
+            return
+        self._ensure_tag_ids(changes)
+
+        # 依 Tag 索引組出每個部分訂閱客戶端要收到的內容
+        partial: Dict[WsClient, Dict[str, Any]] = {}
+        for name, value in changes.items():
+            for client in self._subscribers(name):
+                partial.setdefault(client, {})[name] = value
+
+        # 每次輪詢相同內容 + 相同編碼只編碼一次，與客戶端數量無關
+        encoded: Dict[tuple, Any] = {}
+
+        def encode(data: Dict[str, Any], encoding: str):
+            key = (frozenset(data), encoding)
+            frame = encoded.get(key)
+            if frame is None:
+                frame = encoded[key] = self._encode_delta(self.seq, data, encoding)
+            return frame
+
+        for client in self.clients[:]:
+            if client.subscribes_all:
+                self._enqueue(client, encode(changes, client.encoding))
+            elif client in partial:
+                self._enqueue(client, encode(partial[client], client.encoding))
+
+    def deltas_since(self, epoch: Optional[str], since: Optional[int]):
         """
-        將 JSON 訊息推播給所有已連線的客戶端
-        包含自動清除失效連線的機制
+        回傳 since 之後的差異列表；無法補送 (伺服器重啟或紀錄已淘汰) 時回傳 None。
         """
-        if not self.active_connections:
+        if since is None or epoch != self.epoch or since > self.seq:
+            return None
+        if since == self.seq:
+            return []
+        if not self._log or self._log[0][0] > since + 1:
+            return None
+        return [(seq, changes) for seq, changes in self._log if seq > since]
+
+    def sync_client(self, client: WsClient, snapshot: Dict[str, Any],
+                    epoch: Optional[str] = None, since: Optional[int] = None):
+        """新連線的初始同步：能補送則只送遺漏的差異，否則送完整快照"""
+        deltas = self.deltas_since(epoch, since)
+        if client.encoding != ENC_JSON:
+            # 二進位客戶端先取得完整的 Tag 字典
+            self._ensure_tag_ids(snapshot, skip=client)
+            for _, changes in deltas or ():
+                self._ensure_tag_ids(changes, skip=client)
+            # enc: 實際採用的格式 (要求 msgpack 但未安裝時為 bin)，客戶端據此選擇解碼方式
+            self.send(client, {"type": "dict", "enc": client.encoding, "tags": self._tag_ids})
+        if deltas is None:
+            self.send(client, {"type": "snapshot", "epoch": self.epoch, "seq": self.seq,
+                               "data": self._filter(client, snapshot)})
             return
-        
-        # 遍歷副本以避免在迭代時修改列表
-        for connection in self.active_connections[:]:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.warning(f"Error sending to client (removing): {e}")
-                self.disconnect(connection)
\ No newline at end of file
+        for seq, changes in deltas:
+            data = self._filter(client, changes)
+            if data:
+                self._send_delta(client, seq, data)
+
+    @staticmethod
+    def _filter(client: WsClient, data: Dict[str, Any]) -> Dict[str, Any]:
+        if client.subscribes_all:
+            return data
+        return {k: v for k, v in data.items() if client.wants_tag(k)}
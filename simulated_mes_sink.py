@@ -0,0 +1,105 @@
+import argparse
+import gzip
+import json
+import logging
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 設定 Logging
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [MES-SINK] %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger("mes-sink")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- 設定區 ---
+BIND_IP = "0.0.0.0"
+BIND_PORT = 8090
+
+
+class SinkState:
+    """模擬 MES 接收端：以 Idempotency-Key 去除重送的批次"""
+    def __init__(self, fail_rate: float):
+        self.fail_rate = fail_rate
+        self.seen_keys = set()
+        self.rows = {}        # stream -> 累計筆數
+        self.duplicates = 0
+
+
+def make_handler(state: SinkState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _reply(self, code: int, doc: dict):
+            body = json.dumps(doc).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._reply(200, {"batches": len(state.seen_keys), "rows": state.rows,
+                              "duplicates": state.duplicates})
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if random.random() < state.fail_rate:
+                logger.warning("Simulated failure (503)")
+                self._reply(503, {"error": "simulated outage"})
+                return
+
+            key = self.headers.get('Idempotency-Key')
+            if key in state.seen_keys:
+                state.duplicates += 1
+                logger.info(f"Duplicate batch {key} ignored")
+                self._reply(200, {"status": "duplicate"})
+                return
+
+            encoding = self.headers.get('Content-Encoding', 'identity')
+            try:
+                if encoding == 'gzip':
+                    raw = gzip.decompress(raw)
+                elif encoding == 'zstd':
+                    if zstandard is None:
+                        self._reply(415, {"error": "zstd not supported"})
+                        return
+                    raw = zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+                doc = json.loads(raw)
+            except Exception as e:
+                self._reply(400, {"error": str(e)})
+                return
+
+            state.seen_keys.add(key)
+            stream = doc.get('stream', '?')
+            state.rows[stream] = state.rows.get(stream, 0) + len(doc.get('rows', []))
+            logger.info(f"📦 {key}: {len(doc.get('rows', []))} {stream} rows ({encoding}, "
+                        f"{self.headers.get('Content-Length', '0')} bytes) total={state.rows}")
+            self._reply(200, {"status": "ok"})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the MES export endpoint")
+    parser.add_argument('--port', type=int, default=BIND_PORT)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    state = SinkState(args.fail_rate)
+    server = ThreadingHTTPServer((BIND_IP, args.port), make_handler(state))
+    logger.info(f"🚀 MES sink listening on http://{BIND_IP}:{args.port}/ingest (fail rate {args.fail_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
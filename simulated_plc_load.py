@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import random
+import struct
+import time
+from typing import Dict, List, Optional
+
+import yaml
+
+from simulated_plc_server import (
+    PLCSimulator, make_store, ModbusServerContext,
+    REG_WEIGHT_NOW, REG_FISH_CODE, REG_FISH_COUNT, REG_ALARM_CODE, REG_ERROR_CODE,
+)
+from pymodbus.server import ModbusTcpServer
+
+logger = logging.getLogger("plc-load")
+
+BIND_IP = "0.0.0.0"
+STATUS_CODES = {'RUN': 1, 'IDLE': 2, 'ALARM': 3, 'STOP': 4}
+DEFAULT_CODES = {'F001': [600, 100], 'F002': [1000, 150], 'F003': [1500, 150]}
+
+# Modbus TCP (MBAP header: transaction id, protocol id, length, unit id)
+_MBAP = struct.Struct('>HHHB')
+
+
+class LoadUnit(PLCSimulator):
+    """
+    壓力測試用的一台機台 (unit)：固定節拍的高速生產、定期換魚種、狀態隨機切換。
+    重量 / 換魚種 / 狀態切換各自使用以 (seed, unit) 建立的 random.Random，
+    各序列不受協程排程先後影響：同一 seed 下第 n 隻魚的重量、第 n 次換魚種與狀態切換都相同。
+    (實際產生的魚數仍取決於執行時機，例如狀態切換落在哪一拍。)
+    """
+    def __init__(self, context, slave_id: int, scenario: Dict, seed, unit: str):
+        super().__init__(context, slave_id)
+        fish = scenario.get('fish', {})
+        status = scenario.get('status', {})
+        self.rng_weights = random.Random(f"{seed}-{unit}-weights")
+        self.rng_changeover = random.Random(f"{seed}-{unit}-changeover")
+        self.rng_chatter = random.Random(f"{seed}-{unit}-chatter")
+        self.rate = float(fish.get('rate', 20))
+        self.hold = float(fish.get('hold', 0.5))
+        self.codes = {str(k): v for k, v in (fish.get('codes') or DEFAULT_CODES).items()}
+        self.changeover_every = float(fish.get('changeover_every', 0))
+        self.chatter_rate = float(status.get('chatter_rate', 0))
+        self.chatter_states = status.get('states') or {'IDLE': 0.5, 'ALARM': 0.4, 'STOP': 0.1}
+        self.chatter_duration = status.get('duration') or [0.5, 3.0]
+        self.alarm_codes = status.get('alarm_codes') or [1, 2, 3, 4, 5]
+        self.error_rate = float(status.get('error_rate', 0))
+        self.fish_code = next(iter(self.codes))
+        self._write_string_code(self.fish_code)
+
+    def _write_string_code(self, code: str):
+        self.fish_code = code
+        self._write_string(REG_FISH_CODE, code)
+
+    async def run(self):
+        await asyncio.gather(self._loop_clock(), self._loop_chatter(), self._loop_changeover(),
+                             self._loop_fast_production())
+
+    async def _loop_fast_production(self):
+        """固定節拍 (絕對時間排程，不累積誤差)：寫入重量 -> 保持 hold 比例 -> 歸零"""
+        period = 1.0 / self.rate
+        next_at = time.monotonic()
+        while True:
+            if self.current_status == 1:
+                mean, sigma = self.codes.get(self.fish_code, [1000, 200])
+                weight = int(min(max(self.rng_weights.gauss(mean, sigma), 400), 1800))
+                self.total_count += 1
+                self._write_dword(REG_WEIGHT_NOW, weight)
+                self._write_dword(REG_FISH_COUNT, self.total_count)
+                self._update_bucket_stats(weight)
+                await asyncio.sleep(max(next_at + period * self.hold - time.monotonic(), 0))
+                self._write_dword(REG_WEIGHT_NOW, 0)
+            next_at += period
+            delay = next_at - time.monotonic()
+            if delay < -1.0:
+                next_at = time.monotonic()   # 落後太多 (事件迴圈忙碌) 時重新對齊，不補發
+            await asyncio.sleep(max(delay, 0))
+
+    async def _loop_changeover(self):
+        if self.changeover_every <= 0 or len(self.codes) < 2:
+            return
+        codes = list(self.codes)
+        while True:
+            await asyncio.sleep(self.changeover_every)
+            self._write_string_code(self.rng_changeover.choice([c for c in codes if c != self.fish_code]))
+
+    async def _loop_chatter(self):
+        """每秒以 chatter_rate 機率離開 RUN，停留 duration 秒後恢復"""
+        if self.chatter_rate <= 0:
+            return
+        states, weights = list(self.chatter_states), list(self.chatter_states.values())
+        store = self.context[self.slave_id]
+        rng = self.rng_chatter
+        while True:
+            await asyncio.sleep(1.0)
+            if rng.random() >= self.chatter_rate:
+                continue
+            state = rng.choices(states, weights)[0]
+            if state == 'ALARM':
+                store.setValues(3, REG_ALARM_CODE, [rng.choice(self.alarm_codes)])
+            if self.error_rate and rng.random() < self.error_rate:
+                store.setValues(3, REG_ERROR_CODE, [rng.randint(1, 6)])
+            self._update_status_register(STATUS_CODES.get(state, 2))
+            await asyncio.sleep(rng.uniform(*self.chatter_duration))
+            store.setValues(3, REG_ALARM_CODE, [0])
+            store.setValues(3, REG_ERROR_CODE, [0])
+            self._update_status_register(1)
+
+
+class FaultProxy:
+    """
+    Modbus TCP 故障注入代理：位於客戶端與模擬伺服器之間，逐一解析請求 (MBAP)，
+    依情境加入回應延遲 / 抖動、隨機斷線、或直接回覆 Modbus 例外 (不轉送到伺服器)。
+    每條客戶端連線使用各自的 random.Random (seed, 埠, 第 n 條連線)，故障序列不受其他連線影響。
+    """
+    def __init__(self, listen_port: int, backend_port: int, faults: Dict, seed):
+        self.listen_port = listen_port
+        self.backend_port = backend_port
+        self.seed = seed
+        self.connections = 0
+        self.latency = float(faults.get('latency_ms', 0)) / 1000.0
+        self.jitter = float(faults.get('jitter_ms', 0)) / 1000.0
+        self.drop_rate = float(faults.get('drop_rate', 0))
+        self.exception_rate = float(faults.get('exception_rate', 0))
+        self.exception_codes = faults.get('exception_codes') or [2, 4, 6]
+        self.stats = {'requests': 0, 'drops': 0, 'exceptions': 0}
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle, BIND_IP, self.listen_port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, client_r: asyncio.StreamReader, client_w: asyncio.StreamWriter):
+        rng = random.Random(f"{self.seed}-{self.listen_port}-conn{self.connections}")
+        self.connections += 1
+        try:
+            backend_r, backend_w = await asyncio.open_connection('127.0.0.1', self.backend_port)
+        except OSError:
+            client_w.close()
+            return
+        try:
+            while True:
+                header = await client_r.readexactly(_MBAP.size)
+                tid, pid, length, unit = _MBAP.unpack(header)
+                pdu = await client_r.readexactly(length - 1)
+                self.stats['requests'] += 1
+                roll = rng.random()
+                delay = self.latency + (rng.uniform(0, self.jitter) if self.jitter else 0)
+                if roll < self.drop_rate:
+                    self.stats['drops'] += 1
+                    break
+                if roll < self.drop_rate + self.exception_rate:
+                    self.stats['exceptions'] += 1
+                    await asyncio.sleep(delay)
+                    code = rng.choice(self.exception_codes)
+                    client_w.write(_MBAP.pack(tid, pid, 3, unit) + bytes([pdu[0] | 0x80, code]))
+                    await client_w.drain()
+                    continue
+                backend_w.write(header + pdu)
+                await backend_w.drain()
+                resp_header = await backend_r.readexactly(_MBAP.size)
+                resp = await backend_r.readexactly(_MBAP.unpack(resp_header)[2] - 1)
+                if delay:
+                    await asyncio.sleep(delay)
+                client_w.write(resp_header + resp)
+                await client_w.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for w in (client_w, backend_w):
+                w.close()
+
+
+def load_scenario(path: str) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+async def run_scenario(path: str, seed: Optional[int] = None):
+    """
+    依情境檔啟動 N 台模擬機台：
+      layout: ports    -> 每台一個埠 (base_port + i)，unit id 皆為 1 (每台可接一個 Gateway)
+      layout: unit_ids -> 同一個埠、unit id 1..N
+    faults.enabled 時伺服器改綁 base_port + backend_offset，對外埠由故障注入代理提供。
+    """
+    scenario = load_scenario(path)
+    seed = scenario.get('seed', 0) if seed is None else seed
+    units_cfg = scenario.get('units', {})
+    count = int(units_cfg.get('count', 1))
+    layout = units_cfg.get('layout', 'ports')
+    base_port = int(units_cfg.get('base_port', 5020))
+    faults = scenario.get('faults', {})
+    proxied = faults.get('enabled', False)
+    backend_offset = int(faults.get('backend_offset', 1000))
+
+    if layout == 'unit_ids':
+        groups = [list(range(1, count + 1))]
+    else:
+        groups = [[1] for _ in range(count)]
+
+    tasks, units, proxies = [], [], []
+    for i, slave_ids in enumerate(groups):
+        context = ModbusServerContext({sid: make_store() for sid in slave_ids}, single=False)
+        for sid in slave_ids:
+            units.append(LoadUnit(context, sid, scenario, seed, unit=f"{i}-{sid}"))
+        port = base_port + i
+        server_port = port + backend_offset if proxied else port
+        server = ModbusTcpServer(context, address=(BIND_IP, server_port))
+        tasks.append(asyncio.create_task(server.serve_forever()))
+        if proxied:
+            proxy = FaultProxy(port, server_port, faults, seed)
+            proxies.append(proxy)
+            tasks.append(asyncio.create_task(proxy.serve()))
+    tasks.extend(asyncio.create_task(u.run()) for u in units)
+
+    rate = units[0].rate if units else 0
+    logger.info(f"🚀 Load scenario {path} (seed {seed}): {len(units)} units on "
+                f"{'port ' + str(base_port) if layout == 'unit_ids' else f'ports {base_port}..{base_port + len(groups) - 1}'}"
+                f", {rate:g} fish/s each" + (f", fault proxy (backend +{backend_offset})" if proxied else ''))
+
+    duration = float(scenario.get('duration', 0))
+    report_interval = float(scenario.get('report_interval', 5))
+    started = last_at = time.monotonic()
+    last_total = 0
+    try:
+        while True:
+            remaining = duration - (time.monotonic() - started) if duration else report_interval
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(report_interval, remaining))
+            now, total = time.monotonic(), sum(u.total_count for u in units)
+            fault_stats = _sum_stats(proxies)
+            logger.info(f"fish {total} ({(total - last_total) / (now - last_at):.1f}/s)"
+                        + (f" | requests {fault_stats['requests']}, drops {fault_stats['drops']}, "
+                           f"exceptions {fault_stats['exceptions']}" if proxies else ''))
+            last_total, last_at = total, now
+    finally:
+        for t in tasks:
+            t.cancel()
+        logger.info(f"Scenario finished: {sum(u.total_count for u in units)} fish in "
+                    f"{time.monotonic() - started:.1f}s, faults {_sum_stats(proxies)}")
+
+
+def _sum_stats(proxies: List[FaultProxy]) -> Dict[str, int]:
+    out = {'requests': 0, 'drops': 0, 'exceptions': 0}
+    for p in proxies:
+        for k in out:
+            out[k] += p.stats[k]
+    return out
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import logging
 import random
@@ -64,12 +65,14 @@ REG_BUCKET_RO_MIN_BASE = 40043
 REG_B1_SETTING_BASE = 40101
 REG_FISH_CODE = 40131       # String
 REG_STATUS = 40135          # Word (1: RUN, 2: IDLE...)
+REG_ALARM_CODE = 40136      # Word (config/enums/machine_alarm.json)
+REG_ERROR_CODE = 40137      # Word (config/enums/machine_error.json)
 REG_FISH_COUNT = 40141      # Dword (累計產量)
 
 class PLCSimulator:
-    def __init__(self, context):
+    def __init__(self, context, slave_id: int = 1):
         self.context = context
-        self.slave_id = 1
+        self.slave_id = slave_id
         
         # 生產參數
         self.production_interval = 3.0
@@ -173,12 +176,15 @@ class PLCSimulator:
                         self._update_status_register(2)
                         await asyncio.sleep(5)
                     else:
-                        logger.warning("⚠️ Status: ALARM")
+                        alarm = random.randint(1, 5)
+                        logger.warning(f"⚠️ Status: ALARM (code {alarm})")
+                        self.context[self.slave_id].setValues(3, REG_ALARM_CODE, [alarm])
                         self._update_status_register(3)
                         await asyncio.sleep(3)
                     
                     # 恢復 RUN
                     logger.info("✅ Status: RUN")
+                    self.context[self.slave_id].setValues(3, REG_ALARM_CODE, [0])
                     self._update_status_register(1)
 
             except Exception as e:
@@ -248,14 +254,16 @@ class PLCSimulator:
         await asyncio.sleep(delay)
         self._write_dword(REG_WEIGHT_NOW, 0)
 
-async def main():
-    store = ModbusSlaveContext(
+def make_store():
+    return ModbusSlaveContext(
         hr=ModbusSequentialDataBlock(START_ADDRESS, [0] * REGISTER_COUNT),
         ir=ModbusSequentialDataBlock(START_ADDRESS, [0] * REGISTER_COUNT),
         co=ModbusSequentialDataBlock(START_ADDRESS, [0] * REGISTER_COUNT),
         di=ModbusSequentialDataBlock(START_ADDRESS, [0] * REGISTER_COUNT)
     )
-    slaves = {1: store}
+
+async def main():
+    slaves = {1: make_store()}
     context = ModbusServerContext(slaves, single=False)
     
     sim = PLCSimulator(context)
@@ -277,7 +285,16 @@ async def main():
     )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated FX5U fish scale (Modbus TCP)")
+    parser.add_argument('--scenario', help="load mode: scenario YAML (e.g. config/scenarios/stress.yaml)")
+    parser.add_argument('--seed', type=int, help="override the scenario seed")
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        if args.scenario:
+            # 壓力測試模式：多台 / 高速生產 / 狀態切換 / 故障注入 (見 simulated_plc_load.py)
+            from simulated_plc_load import run_scenario
+            asyncio.run(run_scenario(args.scenario, seed=args.seed))
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass
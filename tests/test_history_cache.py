@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.historian import Historian
+from app.journal import EventJournal
+
+
+@pytest.fixture
+def historian(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = Historian('data/history.db', journal=EventJournal('data/journal'))
+    h.init_db()
+    h.open_journal()
+    yield h
+    h.journal.close()
+
+
+def _ts(seconds_ago):
+    return (datetime.now() - timedelta(seconds=seconds_ago)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_late_journal_events_are_not_hidden_by_immutable_cache(historian):
+    start, end = _ts(3600), _ts(1800)
+    # 資料庫停滯期間寫入日誌的事件 (時間落在查詢範圍內，尚未套用)
+    historian.journal.append({'timestamp': _ts(2400), 'fish_code': 'F001', 'weight': 900.0, 'status': 'RUN'})
+    assert not historian.is_past(end)
+
+    before = historian.get_history_result(start, end, None, 100)
+    assert before.value == []
+
+    historian.journal.apply_pending(historian)
+    assert historian.is_past(end)
+    after = historian.get_history_result(start, end, None, 100)
+    assert [r['weight'] for r in after.value] == [900.0]
+    assert after.etag != before.etag
+    # 之後沒有待套用事件：同一範圍可永久快取
+    assert historian.get_history_result(start, end, None, 100) is after
+
+
+def test_pending_events_after_range_keep_it_immutable(historian):
+    historian.journal.append({'timestamp': _ts(60), 'fish_code': 'F001', 'weight': 900.0, 'status': 'RUN'})
+    assert historian.is_past(_ts(1800))
@@ -0,0 +1,91 @@
+import os
+import struct
+
+import pytest
+
+from app.historian import Historian
+from app.journal import EventJournal, _HEADER
+
+
+def _event(i):
+    return {'timestamp': f'2026-10-19 08:00:{i:02d}', 'fish_code': 'F001', 'weight': 1000.0 + i, 'status': 'RUN'}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Historian / 分區封存路徑為相對路徑 (data/...)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _history(historian):
+    with historian.get_connection() as conn:
+        return [tuple(r) for r in conn.execute('SELECT id, weight FROM history ORDER BY id')]
+
+
+def test_replay_after_torn_tail(workdir):
+    journal = EventJournal('data/journal')
+    journal.open()
+    for i in range(3):
+        journal.append(_event(i))
+    journal.close()
+
+    # 寫到一半當機：header 完整但 payload 不足
+    segment = os.path.join('data/journal', sorted(os.listdir('data/journal'))[-1])
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(_HEADER.pack(100, 4, 0) + b'{"timestamp"')
+
+    journal = EventJournal('data/journal')
+    journal.open()
+    assert os.path.getsize(segment) == size          # 尾端被截斷
+    assert [seq for seq, _ in journal._pending] == [1, 2, 3]
+    assert journal.append(_event(3)) == 4            # 新序號接在最後一筆完整紀錄之後
+    journal.close()
+
+    historian = Historian('data/history.db', journal=EventJournal('data/journal'))
+    historian.init_db()
+    historian.open_journal()                          # 啟動時套用全部未套用事件
+    historian.journal.close()
+    assert _history(historian) == [(1, 1000.0), (2, 1001.0), (3, 1002.0), (4, 1003.0)]
+
+
+def test_corrupt_record_stops_scan(workdir):
+    journal = EventJournal('data/journal')
+    journal.open()
+    for i in range(3):
+        journal.append(_event(i))
+    journal.close()
+
+    # 第二筆紀錄的 payload 被破壞：CRC 不符，之後的紀錄不可信 (最後區段視為尾端截斷)
+    segment = os.path.join('data/journal', sorted(os.listdir('data/journal'))[-1])
+    with open(segment, 'r+b') as f:
+        data = f.read()
+        first_len = struct.unpack_from('<I', data, 0)[0]
+        f.seek(_HEADER.size + first_len + _HEADER.size)
+        f.write(b'X')
+
+    journal = EventJournal('data/journal')
+    journal.open()
+    assert [seq for seq, _ in journal._pending] == [1]
+    journal.close()
+
+
+def test_replay_is_idempotent(workdir):
+    historian = Historian('data/history.db', journal=EventJournal('data/journal'))
+    historian.init_db()
+    historian.open_journal()
+    for i in range(3):
+        historian.log_data(_event(i))
+    assert historian.journal.apply_pending(historian) == 3
+    historian.journal.close()
+
+    # 套用進度遺失 (例如在寫入 journal_state 前當機)：重新套用同一批事件不可產生重複資料
+    with historian.get_connection() as conn:
+        conn.execute('DELETE FROM journal_state')
+    historian = Historian('data/history.db', journal=EventJournal('data/journal'))
+    historian.init_db()
+    historian.open_journal()
+    historian.journal.close()
+    assert [r[0] for r in _history(historian)] == [1, 2, 3]
+    assert historian.journal.applied_seq == 3
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from app import oee
+from app.historian import Historian
+from app.oee import OeeTracker, STATE_UNKNOWN
+
+
+SHIFT_START = datetime(2026, 10, 19, 6, 0).timestamp()
+
+
+@pytest.fixture
+def historian(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = Historian('data/history.db')
+    h.init_db()
+    return h
+
+
+def test_restore_records_outage_as_unknown(historian, monkeypatch):
+    t0 = SHIFT_START + 3600
+    before = OeeTracker(historian)
+    before.update({'status': 'RUN', 'fish_code': 'F001'}, now=t0)
+    before._advance(t0 + 600)
+    before.checkpoint(t0 + 600)
+    # 未正常關閉 (當機)：30 分鐘後重新啟動
+    monkeypatch.setattr(oee.time, 'time', lambda: t0 + 2400)
+
+    after = OeeTracker(historian)
+    after.restore()
+
+    intervals = historian.get_state_intervals(limit=10)
+    assert [(i['state'], i['start'], i['end']) for i in intervals] == [
+        (STATE_UNKNOWN, oee._fmt(t0 + 600), None),
+        ('RUN', oee._fmt(t0), oee._fmt(t0 + 600)),
+    ]
+    seconds = after._counters['F001'].seconds
+    assert seconds == {'RUN': 600.0, STATE_UNKNOWN: 1800.0}
+
+    # 第一次輪詢結束未知區間
+    after.update({'status': 'RUN', 'fish_code': 'F001'}, now=t0 + 2410)
+    unknown = historian.get_state_intervals(state=STATE_UNKNOWN)[0]
+    assert unknown['end'] == oee._fmt(t0 + 2410)
+    assert after._counters['F001'].seconds[STATE_UNKNOWN] == 1810.0
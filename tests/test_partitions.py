@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from app.historian import Historian
+from app.partitions import table_name
+
+
+MONTH = '202401'
+
+
+@pytest.fixture
+def historian(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = Historian('data/history.db', partitions={'archive_path': 'data/archive'})
+    h.init_db()
+    return h
+
+
+def _event(seq, day):
+    return (seq, {'timestamp': f'2024-01-{day:02d} 08:00:00', 'fish_code': 'F001',
+                  'weight': float(seq), 'status': 'RUN'})
+
+
+def _ids(historian):
+    rows = historian.get_history_result('2024-01-01 00:00:00', '2024-01-31 23:59:59', None, 1000).value
+    return sorted(int(r['weight']) for r in rows)
+
+
+def test_archive_moves_partition_out_of_live_set(historian):
+    historian.apply_events([_event(i, 1 + i) for i in range(1, 6)])
+    historian.partitions._archive_month(MONTH)
+
+    assert MONTH not in historian.partitions.live_months_list()
+    assert _ids(historian) == [1, 2, 3, 4, 5]
+
+
+def test_late_rows_during_export_keep_partition_live(historian, monkeypatch):
+    historian.apply_events([_event(i, 1 + i) for i in range(1, 4)])
+    store = historian.partitions
+    original = store._late_rows
+
+    def late_before_check(conn, table, max_id):
+        # 匯出完成後、取得寫入鎖之前寫入的遲到事件
+        conn.rollback()
+        historian.apply_events([_event(10, 20)])
+        conn.execute('BEGIN IMMEDIATE')
+        return original(conn, table, max_id)
+
+    monkeypatch.setattr(store, '_late_rows', late_before_check)
+    store._archive_month(MONTH)
+
+    assert MONTH in store.live_months_list()
+    assert _ids(historian) == [1, 2, 3, 10]
+
+
+def test_late_rows_applied_while_archive_holds_write_lock(historian, monkeypatch):
+    historian.apply_events([_event(i, 1 + i) for i in range(1, 4)])
+    store = historian.partitions
+    original = store._late_rows
+    writer = threading.Thread(target=historian.apply_events, args=([_event(10, 20)],))
+
+    def late_after_check(conn, table, max_id):
+        late = original(conn, table, max_id)
+        # 檢查之後才到的寫入必須等待封存交易完成，不能寫進即將 DROP 的分區
+        writer.start()
+        writer.join(0.3)
+        assert writer.is_alive()
+        return late
+
+    monkeypatch.setattr(store, '_late_rows', late_after_check)
+    store._archive_month(MONTH)
+    writer.join(5)
+    assert not writer.is_alive()
+
+    # 遲到事件重新建立線上分區，原資料已在封存檔中，兩者都查得到
+    info = store._catalog[MONTH]
+    assert info['live'] and info['archive']
+    assert _ids(historian) == [1, 2, 3, 10]
+
+    # 下次維護將遲到事件併入封存檔
+    monkeypatch.setattr(store, '_late_rows', original)
+    store._archive_month(MONTH, existing=info['archive'])
+    assert MONTH not in store.live_months_list()
+    assert _ids(historian) == [1, 2, 3, 10]
+    with historian.get_connection() as conn:
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table_name(MONTH),)).fetchone()
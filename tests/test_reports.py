@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from app.historian import Historian
+from app.reports import ShiftReporter
+
+
+KEY = '2026-10-18_A'
+
+
+@pytest.fixture
+def reporter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = Historian('data/history.db')
+    h.init_db()
+    r = ShiftReporter(h)
+    r.build(KEY)
+    return r
+
+
+def _late_row(seq):
+    return (seq, '2026-10-18 08:00:00', 'F001', 850.0, 'RUN')
+
+
+def test_result_is_cached_per_revision(reporter):
+    first = reporter.result(KEY)
+    assert reporter.result(KEY) is first
+    reporter._merge_late(KEY, [_late_row(1)])
+    second = reporter.result(KEY)
+    assert second.etag != first.etag
+    assert json.loads(second.body)['late_rows'] == 1
+
+
+def test_merge_during_cache_miss_does_not_cache_stale_revision(reporter, monkeypatch):
+    historian = reporter.historian
+    original = historian.get_shift_report
+    merged = []
+
+    def read_then_merge(key):
+        row = original(key)
+        if not merged:
+            # 讀取舊 revision 之後、放入快取之前，遲到事件合併並寫入新 revision
+            merged.append(True)
+            reporter._merge_late(key, [_late_row(1)])
+        return row
+
+    monkeypatch.setattr(historian, 'get_shift_report', read_then_merge)
+    stale = reporter.result(KEY)
+    assert json.loads(stale.body)['revision'] == 1
+
+    fresh = reporter.result(KEY)
+    assert json.loads(fresh.body)['revision'] == 2
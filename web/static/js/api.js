@@ -48,6 +48,30 @@ export async function getDailyStats() {
   return await r.json();
 }
 
+// 取得即時統計 (記憶體內，window: 5m / shift / day)
+export async function getLiveStats(window = 'day') {
+  const r = await fetch(`/api/stats/live?window=${window}`);
+  if (!r.ok) throw new Error('Failed to fetch live stats');
+  return await r.json();
+}
+
+// 取得記憶體趨勢資料 (欄位式)
+export async function getTrend(tags = ['weight'], minutes = null, points = null) {
+  const params = new URLSearchParams({ tags: tags.join(',') });
+  if (minutes) params.set('minutes', minutes);
+  if (points) params.set('points', points);
+  const r = await fetch(`/api/trend?${params.toString()}`);
+  if (!r.ok) throw new Error('Failed to fetch trend');
+  return await r.json();
+}
+
+// 取得分規即時績效 (產能 / 平均重量 / 超重)
+export async function getBucketLive() {
+  const r = await fetch('/api/buckets/live');
+  if (!r.ok) throw new Error('Failed to fetch bucket stats');
+  return await r.json();
+}
+
 // 取得歷史資料 (History 頁面用)
 export async function getHistoryData(query = {}) {
   const params = new URLSearchParams(query);
@@ -74,6 +98,17 @@ export async function saveRecipe(fishCode, params) {
   return await r.json();
 }
 
+// 以歷史重量模擬候選配方 (What-if)
+export async function simulateRecipe(fishCode, params, startTime = null, endTime = null) {
+  const r = await fetch('/api/recipes/simulate', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ fish_code: fishCode, params, start_time: startTime, end_time: endTime })
+  });
+  if (!r.ok) throw new Error('Failed to simulate recipe');
+  return await r.json();
+}
+
 export async function writeRecipeToPLC(fishCode, params) {
   const r = await fetch('/api/control/write-recipe', {
     method: 'POST',
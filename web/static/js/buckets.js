@@ -1,4 +1,5 @@
-import { getFishTypes, getSystemStatus, getRecipe, saveRecipe, writeRecipeToPLC, setCategory } from './api.js';
+import { getFishTypes, getSystemStatus, getRecipe, saveRecipe, writeRecipeToPLC, setCategory, getBucketLive, simulateRecipe } from './api.js';
+import { connectLive } from './ws.js';
 
 let fishList = [];
 
@@ -18,6 +19,40 @@ async function initPage() {
 
     // 2. 渲染空的表格結構
     renderTable();
+
+    // 3. 即時分規績效 (先取一次，之後由 WebSocket 推播更新)
+    try {
+        renderLiveStats(await getBucketLive());
+    } catch (e) {
+        console.warn("Initial bucket stats load failed:", e);
+    }
+    connectLive((msg) => {
+        if (msg.type === 'bucket_stats') renderLiveStats(msg.data);
+    }, { topics: ['bucket_stats'] });
+}
+
+function renderLiveStats(data) {
+    const tbody = document.getElementById('bucket-live-body');
+    if (!tbody || !data || !data.buckets) return;
+
+    const fmt = (v, digits = 0) => (v === null || v === undefined) ? '--' : Number(v).toFixed(digits);
+    let html = '';
+    for (let i = 1; i <= 7; i++) {
+        const b = data.buckets[i] || {};
+        const giveawayClass = b.giveaway > 0 ? 'text-orange-600' : 'text-gray-600';
+        html += `
+        <tr class="hover:bg-gray-50 transition">
+            <td class="px-6 py-3 font-bold text-gray-700">分規 ${i}</td>
+            <td class="px-6 py-3 text-right font-mono text-blue-600">${fmt(b.rate_per_min, 1)}</td>
+            <td class="px-6 py-3 text-right font-mono">${fmt(b.avg_weight)}</td>
+            <td class="px-6 py-3 text-right font-mono ${giveawayClass}">${fmt(b.giveaway, 1)}</td>
+            <td class="px-6 py-3 text-right font-mono text-gray-500">${fmt(b.total_count)}</td>
+        </tr>`;
+    }
+    tbody.innerHTML = html;
+
+    const elCode = document.getElementById('live-fish-code');
+    if (elCode) elCode.innerText = data.fish_code || '--';
 }
 
 function renderFishSelect(list) {
@@ -221,13 +256,19 @@ window.writeToPLC = async function() {
     statusMsg.className = "text-blue-600";
 
     try {
-        // 步驟 1: 寫入分規參數
-        await writeRecipeToPLC(code, params);
+        // 步驟 1: 寫入分規參數 (只寫入變動欄位，並由 PLC 讀回驗證)
+        const report = await writeRecipeToPLC(code, params);
+        if (!report.success) {
+            const detail = report.failed
+                .map(k => `${k}: ${report.fields[k].status} (設定 ${report.fields[k].requested}，讀回 ${report.fields[k].readback ?? '--'})`)
+                .join('\n');
+            throw new Error(`下列欄位驗證失敗:\n${detail}`);
+        }
         
         // 步驟 2: 寫入魚種代碼
         await setCategory(code);
         
-        alert("寫入設備成功！ (參數與魚種已更新)");
+        alert(`寫入設備成功！ (變更 ${report.written} 個欄位，${report.unchanged} 個未變動，已讀回驗證)`);
         statusMsg.innerText = "寫入完成";
         statusMsg.className = "text-green-600 font-bold";
         
@@ -237,4 +278,67 @@ window.writeToPLC = async function() {
         statusMsg.innerText = "寫入失敗";
         statusMsg.className = "text-red-600";
     }
-};
\ No newline at end of file
+};
+
+// 5. 以歷史重量模擬目前表格中的配方 (不寫入 PLC)
+window.simulateWhatIf = async function() {
+    const code = getSelectedFish();
+    if (!code) return;
+
+    const params = gatherTableData();
+    if (!params) {
+        alert("表格為空，無法模擬");
+        return;
+    }
+
+    const statusMsg = document.getElementById('status-msg');
+    statusMsg.innerText = "正在模擬...";
+    statusMsg.className = "text-blue-600";
+
+    const pad = (n) => String(n).padStart(2, '0');
+    const since = new Date(Date.now() - 7 * 24 * 60 * 60 * 1000);
+    const startTime = `${since.getFullYear()}-${pad(since.getMonth() + 1)}-${pad(since.getDate())} 00:00:00`;
+
+    try {
+        const result = await simulateRecipe(code, params, startTime);
+        renderSimulation(result);
+        statusMsg.innerText = `模擬完成 (${result.total.toLocaleString()} 筆，${(result.load_ms + result.compute_ms).toFixed(0)} ms)`;
+        statusMsg.className = "text-indigo-600 font-medium";
+    } catch (e) {
+        console.error(e);
+        statusMsg.innerText = "模擬失敗";
+        statusMsg.className = "text-red-500";
+    }
+};
+
+function renderSimulation(result) {
+    const panel = document.getElementById('sim-panel');
+    const tbody = document.getElementById('sim-table-body');
+    if (!panel || !tbody) return;
+
+    const fmt = (v, digits = 0) => (v === null || v === undefined) ? '--' : Number(v).toFixed(digits);
+    let html = '';
+    Object.keys(result.buckets).forEach(id => {
+        const b = result.buckets[id];
+        html += `
+        <tr class="hover:bg-gray-50 transition">
+            <td class="px-6 py-3 font-bold text-gray-700">分規 ${id} <span class="text-xs font-normal text-gray-400 ml-1">${fmt(b.min)}~${fmt(b.max)}</span></td>
+            <td class="px-6 py-3 text-right font-mono">${b.count.toLocaleString()}</td>
+            <td class="px-6 py-3 text-right font-mono text-blue-600">${(b.share * 100).toFixed(1)}%</td>
+            <td class="px-6 py-3 text-right font-mono">${fmt(b.mean)}</td>
+            <td class="px-6 py-3 text-right font-mono">${fmt(b.giveaway_per_fish, 1)}</td>
+        </tr>`;
+    });
+    html += `
+        <tr class="bg-gray-50">
+            <td class="px-6 py-3 font-bold text-gray-500">未分規</td>
+            <td class="px-6 py-3 text-right font-mono text-red-500">${result.unassigned.toLocaleString()}</td>
+            <td class="px-6 py-3 text-right font-mono text-red-500">${result.total ? (result.unassigned / result.total * 100).toFixed(1) : '0.0'}%</td>
+            <td colspan="2"></td>
+        </tr>`;
+    tbody.innerHTML = html;
+
+    const summary = document.getElementById('sim-summary');
+    if (summary) summary.innerText = `${result.fish_code} | 共 ${result.total.toLocaleString()} 筆`;
+    panel.classList.remove('hidden');
+}
@@ -4,7 +4,8 @@
  * Uses Centralized API Module
  */
 
-import { getFishTypes, getDailyStats, getSystemStatus } from './api.js';
+import { getFishTypes, getLiveStats, getSystemStatus } from './api.js';
+import { connectLive } from './ws.js';
 
 // --- 1. State & Config ---
 let fishMapping = {};
@@ -150,53 +151,52 @@ function initCharts() {
 }
 
 function connectWebSocket() {
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws`;
-    
-    const ws = new WebSocket(wsUrl);
-    const elIndicator = document.getElementById('ws-indicator');
-    const elText = document.getElementById('ws-text');
-
-    ws.onopen = () => {
-        if(elIndicator) {
-            elIndicator.classList.remove('bg-red-500');
-            elIndicator.classList.add('bg-green-500');
-        }
-        if(elText) elText.innerText = '連線中';
-    };
-
-    ws.onclose = () => {
-        if(elIndicator) {
-            elIndicator.classList.remove('bg-green-500');
-            elIndicator.classList.add('bg-red-500');
-        }
-        if(elText) elText.innerText = '離線';
-        setTimeout(connectWebSocket, 3000);
-    };
-
-    ws.onmessage = (event) => {
-        try {
-            const data = JSON.parse(event.data);
+    connectLive((msg) => {
+        if (msg.type === 'tags') {
+            const data = msg.data;
             if (data && (data.fish_code || data.weight !== undefined)) {
                 initialLoadComplete = true; 
             }
             updateDashboard(data);
-        } catch (e) { console.error("WS Message Error:", e); }
-    };
+        } else if (msg.type === 'trend') {
+            fillWeightTrend(msg.data);
+        } else if (msg.type === 'stats') {
+            if (msg.data && msg.data.day) updateProductionChart(msg.data.day);
+        }
+    }, { topics: ['live', 'status', 'stats', 'trend'], binary: true });
 }
 
 // --- API Calls ---
+// 今日產量由記憶體即時統計取得 (不查詢資料庫)
 async function loadDailyStats() {
     try {
-        const result = await getDailyStats();
-        if (productionChart && result.labels && result.data) {
-            productionChart.data.labels = result.labels;
-            productionChart.data.datasets[0].data = result.data;
-            productionChart.update();
-        }
+        updateProductionChart(await getLiveStats('day'));
     } catch (e) { console.error("Failed to fetch stats", e); }
 }
 
+function updateProductionChart(dayStats) {
+    if (!productionChart || !dayStats || !dayStats.fish) return;
+    const codes = Object.keys(dayStats.fish).sort();
+    productionChart.data.labels = codes.map(code => fishMapping[code] || code);
+    productionChart.data.datasets[0].data = codes.map(code => dayStats.fish[code].count);
+    productionChart.update();
+}
+
+// 連線時由伺服器送來的近期趨勢，直接填滿重量圖表
+function fillWeightTrend(trend) {
+    if (!trend || !trend.series || !trend.series.weight) return;
+    const values = trend.series.weight;
+    const start = Math.max(0, values.length - maxDataPoints);
+    const pad = maxDataPoints - (values.length - start);
+
+    for (let i = 0; i < maxDataPoints; i++) {
+        const src = start + i - pad;
+        weightData[i] = src >= start ? values[src] : null;
+        timeLabels[i] = src >= start ? new Date(trend.t[src] * 1000).toLocaleTimeString() : '';
+    }
+    if (weightChart) weightChart.update('none');
+}
+
 // --- UI Updates ---
 function updateDashboard(data) {
     if (data.status) {
@@ -2,7 +2,8 @@ import { getHistoryData, getFishTypes } from './api.js';
 
 let trendChart = null;
 let histogramChart = null;
-let currentData = []; // 暫存目前的查詢結果，供匯出 CSV 使用
+// 暫存目前的查詢結果 (欄位式 { timestamp: [...], fish_code: [...], weight: [...] })，供匯出 CSV 使用
+let currentData = null;
 let fishMap = {}; // 用於儲存魚種代碼與名稱的對照表
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -52,7 +53,7 @@ function updateActionButtonsState() {
     const btnExport = document.getElementById('btn-export-csv');
     const btnToggle = document.getElementById('btn-toggle-list');
     
-    const hasData = currentData && currentData.length > 0;
+    const hasData = rowCount(currentData) > 0;
 
     const setBtnState = (btn, enabled) => {
         if (!btn) return;
@@ -72,19 +73,21 @@ function updateActionButtonsState() {
 }
 
 function exportToCSV() {
-    if (!currentData || currentData.length === 0) {
+    const n = rowCount(currentData);
+    if (n === 0) {
         alert("無資料可匯出");
         return;
     }
 
     const headers = ["時間 (Time)", "代碼 (Code)", "名稱 (Name)", "重量 (g)"];
-    
-    const rows = currentData.map(item => {
-        const timeStr = item.timestamp ? item.timestamp.replace('T', ' ') : '--';
-        const weight = parseInt(item.weight) || 0;
-        const name = fishMap[item.fish_code] || '';
-        return `"${timeStr}","${item.fish_code}","${name}","${weight}"`;
-    });
+    const { timestamp: times, fish_code: codes, weight: weights } = currentData;
+
+    const rows = new Array(n);
+    for (let i = 0; i < n; i++) {
+        const timeStr = times[i] ? times[i].replace('T', ' ') : '--';
+        const name = fishMap[codes[i]] || '';
+        rows[i] = `"${timeStr}","${codes[i]}","${name}","${parseInt(weights[i]) || 0}"`;
+    }
 
     const csvContent = "\uFEFF" + [headers.join(","), ...rows].join("\n");
 
@@ -160,27 +163,29 @@ async function fetchData() {
 
     updateStatsDisplay(0, 0, 0);
     
-    currentData = [];
+    currentData = null;
     updateActionButtonsState();
 
     // [修改] colspan 5
     tbody.innerHTML = `<tr><td colspan="5" class="text-center py-8"><i class="fa-solid fa-spinner fa-spin text-gray-400 text-xl"></i></td></tr>`;
 
     try {
-        const query = { limit: 2000 };
+        // 欄位式回應：欄位名稱不重複，瀏覽器解析與記憶體用量都較小
+        const query = { limit: 2000, format: 'columnar' };
         if (start) query.start_time = start.replace('T', ' ');
         if (end) query.end_time = end.replace('T', ' ');
         if (code) query.fish_code = code;
 
         const data = await getHistoryData(query);
+        const n = rowCount(data);
         
         currentData = data;
         
-        if (countEl) countEl.innerText = `${data.length} 筆`;
+        if (countEl) countEl.innerText = `${n} 筆`;
         
         updateActionButtonsState();
 
-        if (data.length === 0) {
+        if (n === 0) {
             // [修改] colspan 5
             tbody.innerHTML = `<tr><td colspan="5" class="text-center py-8 text-gray-400">查無資料</td></tr>`;
             clearCharts();
@@ -204,16 +209,21 @@ async function fetchData() {
     }
 }
 
+function rowCount(data) {
+    return data && data.timestamp ? data.timestamp.length : 0;
+}
+
 // [新增] 計算各魚種平均重量的函式
 function calculateFishAverages(data) {
     const sums = {}; // { code: { total: 0, count: 0 } }
-    data.forEach(row => {
-        const code = row.fish_code;
-        const weight = parseFloat(row.weight) || 0;
+    const n = rowCount(data);
+    for (let i = 0; i < n; i++) {
+        const code = data.fish_code[i];
+        const weight = parseFloat(data.weight[i]) || 0;
         if (!sums[code]) sums[code] = { total: 0, count: 0 };
         sums[code].total += weight;
         sums[code].count++;
-    });
+    }
 
     const averages = {};
     for (const code in sums) {
@@ -253,12 +263,11 @@ function clearChartMessages() {
 
 function calculateAndShowStats(data) {
     let totalWeight = 0;
-    let count = data.length;
+    let count = rowCount(data);
 
-    data.forEach(row => {
-        const w = parseFloat(row.weight) || 0;
-        totalWeight += w;
-    });
+    for (let i = 0; i < count; i++) {
+        totalWeight += parseFloat(data.weight[i]) || 0;
+    }
 
     const avgWeight = count > 0 ? (totalWeight / count) : 0;
     updateStatsDisplay(count, totalWeight, avgWeight);
@@ -277,9 +286,11 @@ function updateStatsDisplay(count, total, avg) {
 
 function renderTable(data, tbody, averages) {
     let html = '';
-    const displayData = data.slice(0, 100);
+    const n = rowCount(data);
+    const shown = Math.min(n, 100);
     
-    displayData.forEach(row => {
+    for (let i = 0; i < shown; i++) {
+        const row = { timestamp: data.timestamp[i], fish_code: data.fish_code[i], weight: data.weight[i] };
         const timeStr = row.timestamp ? row.timestamp.replace('T', ' ') : '--';
         // [新增] 取得名稱與平均重量
         const name = fishMap[row.fish_code] || '--';
@@ -295,11 +306,11 @@ function renderTable(data, tbody, averages) {
             <!-- [新增] 平均重量欄位 -->
             <td class="px-6 py-3 text-right font-mono text-gray-500">${avg}</td>
         </tr>`;
-    });
+    }
 
-    if (data.length > 100) {
+    if (n > 100) {
         // [修改] colspan 5
-        html += `<tr><td colspan="5" class="text-center py-2 text-xs text-gray-400">... 僅顯示前 100 筆，共 ${data.length} 筆 ...</td></tr>`;
+        html += `<tr><td colspan="5" class="text-center py-2 text-xs text-gray-400">... 僅顯示前 100 筆，共 ${n} 筆 ...</td></tr>`;
     }
     
     tbody.innerHTML = html;
@@ -308,13 +319,12 @@ function renderTable(data, tbody, averages) {
 function renderCharts(data) {
     clearChartMessages();
 
-    const sortedData = [...data].reverse();
-
-    const labels = sortedData.map(d => {
-        const ts = d.timestamp.replace('T', ' ');
+    // 查詢結果為新到舊，圖表改為舊到新
+    const labels = data.timestamp.map(t => {
+        const ts = t.replace('T', ' ');
         return ts.split(' ')[1] || ts;
-    }); 
-    const weights = sortedData.map(d => parseFloat(d.weight));
+    }).reverse();
+    const weights = data.weight.map(w => parseFloat(w)).reverse();
 
     const totalWeight = weights.reduce((a, b) => a + b, 0);
     const avgWeight = weights.length > 0 ? totalWeight / weights.length : 0;
@@ -0,0 +1,186 @@
+/**
+ * 共用 WebSocket 連線 (自動重連 + 導覽列連線指示燈)
+ *
+ * Tag 變更以帶序號的差異 (delta) 傳送；重連時附上最後收到的序號，
+ * 伺服器只補送遺漏的差異，無法補送時才回傳完整快照 (snapshot)。
+ *
+ * 可只訂閱需要的主題 (topics) 或 Tag 樣式 (tags)，未指定時接收全部：
+ *   live, status, time, bucket_config, bucket_stats, events, stats, trend
+ * 只訂閱部分 Tag 時序號會跳號 (未訂閱的變更不送)，因此序號只要求遞增。
+ */
+
+const RECONNECT_DELAY = 3000;
+
+// 二進位差異 (enc=bin) 的值型態，需與 app/ws_hub.py 一致
+const V_NULL = 0, V_INT32 = 1, V_FLOAT64 = 2, V_STR = 3, V_INT64 = 4;
+const textDecoder = new TextDecoder();
+
+function decodeBinaryDelta(buffer, idToName) {
+    const view = new DataView(buffer);
+    let pos = 0;
+    const frameType = view.getUint8(pos); pos += 1;
+    const seq = view.getUint32(pos, true); pos += 4;
+    const count = view.getUint16(pos, true); pos += 2;
+    const data = {};
+    for (let i = 0; i < count; i++) {
+        const id = view.getUint16(pos, true); pos += 2;
+        const vtype = view.getUint8(pos); pos += 1;
+        let value = null;
+        if (vtype === V_INT32) { value = view.getInt32(pos, true); pos += 4; }
+        else if (vtype === V_FLOAT64) { value = view.getFloat64(pos, true); pos += 8; }
+        else if (vtype === V_INT64) { value = Number(view.getBigInt64(pos, true)); pos += 8; }
+        else if (vtype === V_STR) {
+            const len = view.getUint16(pos, true); pos += 2;
+            value = textDecoder.decode(new Uint8Array(buffer, pos, len)); pos += len;
+        }
+        const name = idToName[id];
+        if (name !== undefined) data[name] = value;
+    }
+    return { type: frameType === 1 ? 'delta' : 'unknown', seq, data };
+}
+
+// MessagePack 解碼 (enc=msgpack)：只支援伺服器差異訊框會用到的型態 (map / array / str / 數值 / nil / bool)
+function decodeMsgpack(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    let pos = 0;
+    const str = (len) => { const v = textDecoder.decode(bytes.subarray(pos, pos + len)); pos += len; return v; };
+    const arr = (len) => { const out = []; for (let i = 0; i < len; i++) out.push(read()); return out; };
+    const map = (len) => { const out = {}; for (let i = 0; i < len; i++) { const k = read(); out[k] = read(); } return out; };
+    const read = () => {
+        const b = view.getUint8(pos); pos += 1;
+        if (b <= 0x7f) return b;
+        if (b >= 0xe0) return b - 0x100;
+        if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+        if ((b & 0xf0) === 0x90) return arr(b & 0x0f);
+        if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+        let v;
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+            case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+            case 0xcc: v = view.getUint8(pos); pos += 1; return v;
+            case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+            case 0xce: v = view.getUint32(pos); pos += 4; return v;
+            case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+            case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+            case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+            case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+            case 0xd9: v = view.getUint8(pos); pos += 1; return str(v);
+            case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+            case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+            case 0xdc: v = view.getUint16(pos); pos += 2; return arr(v);
+            case 0xdd: v = view.getUint32(pos); pos += 4; return arr(v);
+            case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+            case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+        }
+        throw new Error(`Unsupported msgpack type 0x${b.toString(16)}`);
+    };
+    return read();
+}
+
+function decodeMsgpackDelta(buffer, idToName) {
+    const frame = decodeMsgpack(buffer);
+    const data = {};
+    for (const [id, value] of Object.entries(frame.d || {})) {
+        const name = idToName[id];
+        if (name !== undefined) data[name] = value;
+    }
+    return { type: frame.t === 'delta' ? 'delta' : 'unknown', seq: frame.s, data };
+}
+
+function setIndicator(online) {
+    const elIndicator = document.getElementById('ws-indicator');
+    const elText = document.getElementById('ws-text');
+    if (elIndicator) {
+        elIndicator.classList.remove(online ? 'bg-red-500' : 'bg-green-500');
+        elIndicator.classList.add(online ? 'bg-green-500' : 'bg-red-500');
+    }
+    if (elText) elText.innerText = online ? '連線中' : '離線';
+}
+
+/**
+ * 建立即時連線
+ * @param {function} onMessage - 收到訊息時呼叫。
+ *   Tag 資料統一為 { type: 'tags', data: {...}, full: true|false }，
+ *   其他訊息 (trend / stats / bucket_stats / event ...) 原樣傳入。
+ * @param {object} options - { topics: [...], tags: [...], binary: true|false, encoding: 'bin'|'msgpack' }
+ *   binary: 高頻差異改用二進位訊框 (連線時先收到 Tag 字典)
+ *   encoding: 二進位格式 (預設 bin)；伺服器未安裝 msgpack 時改用 bin，實際格式以 Tag 字典的 enc 為準
+ */
+export function connectLive(onMessage, options = {}) {
+    const state = { epoch: null, seq: null };
+    const topics = options.topics || [];
+    const tags = options.tags || [];
+    const encoding = options.encoding || (options.binary ? 'bin' : null);
+    const binary = !!encoding;
+    let idToName = {};
+    let negotiated = 'bin';
+
+    const open = () => {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const params = new URLSearchParams();
+        if (topics.length) params.set('topics', topics.join(','));
+        if (tags.length) params.set('tags', tags.join(','));
+        if (binary) params.set('enc', encoding);
+        if (state.epoch !== null && state.seq !== null) {
+            params.set('epoch', state.epoch);
+            params.set('since', state.seq);
+        }
+        const query = params.toString();
+        const ws = new WebSocket(`${protocol}//${window.location.host}/ws${query ? '?' + query : ''}`);
+        let resync = false;
+        if (binary) ws.binaryType = 'arraybuffer';
+
+        ws.onopen = () => setIndicator(true);
+
+        ws.onclose = () => {
+            setIndicator(false);
+            setTimeout(open, resync ? 0 : RECONNECT_DELAY);
+        };
+
+        ws.onmessage = (event) => {
+            let msg;
+            try {
+                msg = (typeof event.data === 'string')
+                    ? JSON.parse(event.data)
+                    : (negotiated === 'msgpack' ? decodeMsgpackDelta : decodeBinaryDelta)(event.data, idToName);
+            } catch (e) {
+                console.error("WS Message Error:", e);
+                return;
+            }
+
+            if (msg.type === 'dict') {
+                if (msg.enc) negotiated = msg.enc;
+                for (const [name, id] of Object.entries(msg.tags)) idToName[id] = name;
+                return;
+            }
+
+            if (msg.type === 'snapshot') {
+                state.epoch = msg.epoch;
+                state.seq = msg.seq;
+                onMessage({ type: 'tags', data: msg.data, full: true });
+                return;
+            }
+            if (msg.type === 'delta') {
+                const expectNext = !topics.length && !tags.length;
+                if (state.seq !== null && (expectNext ? msg.seq !== state.seq + 1 : msg.seq <= state.seq)) {
+                    // 序號異常，重新連線以補送或取得快照
+                    console.warn(`WS sequence gap (${state.seq} -> ${msg.seq}), resyncing`);
+                    resync = true;
+                    ws.close();
+                    return;
+                }
+                state.seq = msg.seq;
+                onMessage({ type: 'tags', data: msg.data, full: false });
+                return;
+            }
+            onMessage(msg);
+        };
+    };
+
+    open();
+}